@@ -0,0 +1,214 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import http.client
+import urllib.request
+
+import tracing
+from audio_stream import ffmpeg_command
+from metrics import BYTES_DOWNLOADED, CACHE_HITS, CACHE_MISSES
+from subprocess_watchdog import run_with_deadline
+
+DEFAULT_ARTWORK_DIR = "artwork_cache"
+ARTWORK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+ARTWORK_SIZE = 600  # Longest side of the embedded cover, in pixels
+FETCH_TIMEOUT = 30  # Seconds
+EVICT_MIN_AGE = 300  # Seconds; variants used more recently may be about to be embedded
+
+ORIGINAL = 0  # Variant size standing for the downloaded image itself
+
+trace = tracing.get_tracer("artwork_cache")
+
+def thumbnail_url(metadata):
+    """Return the URL of the largest thumbnail, or None."""
+    thumbnails = [thumbnail for thumbnail in metadata.get("thumbnails") or [] if thumbnail.get("url")]
+    if not thumbnails:
+        return metadata.get("thumbnail")
+
+    # yt-dlp lists thumbnails worst first; the size, when known, decides
+    best = max(
+        enumerate(thumbnails),
+        key=lambda entry: ((entry[1].get("width") or 0) * (entry[1].get("height") or 0), entry[0]),
+    )
+    return best[1]["url"]
+
+def cover_hash(cover):
+    """Return the content hash of a cover image, or None for no cover."""
+    if cover is None:
+        return None
+    with open(cover, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def fetch(url):
+    request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+        return response.read()
+
+def resize(source, target, size):
+    """Scale an image to fit in size x size and save it as a JPEG."""
+    command = ffmpeg_command() + [
+        "-hide_banner", "-loglevel", "error", "-y", "-i", source,
+        "-vf", f"scale={size}:{size}:force_original_aspect_ratio=decrease",
+        "-frames:v", "1", "-q:v", "2", "-f", "image2", "-c:v", "mjpeg", target,
+    ]
+    result = run_with_deadline(command, "artwork_resize")
+    if result.returncode != 0:
+        raise OSError(result.stderr.strip() or "ffmpeg could not resize the artwork.")
+
+class ArtworkCache:
+    """Cover art stored by content hash, with resized JPEG variants.
+
+    URLs map to the hash of the bytes they served, so identical artwork behind
+    different URLs is stored and resized once. Several workers can share the
+    directory; the least recently used variants are evicted above max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_ARTWORK_DIR, max_bytes=ARTWORK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, "index.db"), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                fetched REAL
+            )
+        """)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS variants (
+                content_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                last_used REAL,
+                PRIMARY KEY (content_hash, size)
+            )
+        """)
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def variant_path(self, content_hash, size):
+        name = "original" if size == ORIGINAL else f"{size}.jpg"
+        return os.path.join(self.directory, content_hash[:2], content_hash, name)
+
+    def _lookup(self, content_hash, size):
+        """Return the path of a stored variant and mark it used, or None."""
+        path = self.variant_path(content_hash, size)
+        if not self._execute(
+            "SELECT 1 FROM variants WHERE content_hash = ? AND size = ?", (content_hash, size)
+        ) or not os.path.exists(path):
+            return None
+        self._execute(
+            "UPDATE variants SET last_used = ? WHERE content_hash = ? AND size = ?",
+            (time.time(), content_hash, size),
+        )
+        return path
+
+    def _store(self, content_hash, size, write):
+        """Create a variant with write(temp_path), publish it atomically and index it."""
+        path = self.variant_path(content_hash, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self._execute(
+            "INSERT OR REPLACE INTO variants (content_hash, size, bytes, last_used) VALUES (?, ?, ?, ?)",
+            (content_hash, size, os.path.getsize(path), time.time()),
+        )
+        return path
+
+    def _original(self, url):
+        """Return the content hash of the image behind a URL, fetching it only when unknown."""
+        rows = self._execute("SELECT content_hash FROM urls WHERE url = ?", (url,))
+        if rows and self._lookup(rows[0][0], ORIGINAL):
+            return rows[0][0]
+
+        data = fetch(url)
+        BYTES_DOWNLOADED.inc(len(data), kind="artwork")
+        content_hash = hashlib.sha256(data).hexdigest()
+        if not self._lookup(content_hash, ORIGINAL):
+            def write(temp_path):
+                with open(temp_path, "wb") as file:
+                    file.write(data)
+            self._store(content_hash, ORIGINAL, write)
+
+        self._execute(
+            "INSERT OR REPLACE INTO urls (url, content_hash, fetched) VALUES (?, ?, ?)",
+            (url, content_hash, time.time()),
+        )
+        return content_hash
+
+    def get(self, url, size=ARTWORK_SIZE):
+        """Return the path of the artwork at a URL resized to fit size x size."""
+        rows = self._execute("SELECT content_hash FROM urls WHERE url = ?", (url,))
+        if rows:
+            path = self._lookup(rows[0][0], size)
+            if path:
+                CACHE_HITS.inc(cache="artwork")
+                return path
+        CACHE_MISSES.inc(cache="artwork")
+
+        content_hash = self._original(url)
+        # Another URL may have served the same image and been resized already
+        path = self._lookup(content_hash, size)
+        if path is None:
+            path = self._store(
+                content_hash, size, lambda temp_path: resize(self.variant_path(content_hash, ORIGINAL), temp_path, size)
+            )
+        self.evict()
+        return path
+
+    def cover_for(self, metadata, size=ARTWORK_SIZE):
+        """Return a cover for an upload, or None when it has none or it cannot be fetched.
+
+        Missing artwork never fails an item.
+        """
+        url = thumbnail_url(metadata)
+        if not url:
+            return None
+        try:
+            return self.get(url, size)
+        except (OSError, ValueError, http.client.HTTPException, sqlite3.Error) as e:
+            trace.debug("No artwork for %s: %s", metadata.get("id"), e)
+            return None
+
+    def total_bytes(self):
+        return self._execute("SELECT COALESCE(SUM(bytes), 0) FROM variants")[0][0]
+
+    def evict(self):
+        """Remove the least recently used variants until the cache fits in max_bytes.
+
+        Variants used in the last EVICT_MIN_AGE seconds are kept, even above max_bytes.
+        """
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+
+        for content_hash, size, size_bytes in self._execute(
+            "SELECT content_hash, size, bytes FROM variants WHERE last_used < ? ORDER BY last_used",
+            (time.time() - EVICT_MIN_AGE,),
+        ):
+            if excess <= 0:
+                break
+            path = self.variant_path(content_hash, size)
+            if os.path.exists(path):
+                os.remove(path)
+            self._execute("DELETE FROM variants WHERE content_hash = ? AND size = ?", (content_hash, size))
+            excess -= size_bytes
+            trace.debug("Evicted artwork %s/%s", content_hash, size)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -2,24 +2,19 @@ import sys
 import os
 import json
 
+import tracing
+from observed_values import record_values, regenerate_view
+
 # File paths
 AUDIO_CODEC_FILE = "docs/audio_codecs.txt"
 AUDIO_FORMAT_NOTE_FILE = "docs/audio_format_notes.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        print(f"[DEBUG] {message}")
+trace = tracing.get_tracer("audio_codecs_qualities")
 
 def validate_input():
     """Validate command-line arguments and check if debug mode is enabled."""
-    global DEBUG_MODE
-
     if "-d" in sys.argv:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         sys.argv.remove("-d")  # Remove debug flag from arguments
 
     if len(sys.argv) < 2:
@@ -36,7 +31,7 @@ def validate_input():
         print(f"Error: File '{json_file}' is not a JSON file.")
         sys.exit(1)
 
-    log_debug(f"Validated input file: {json_file}")
+    trace.debug("Validated input file: %s", json_file)
     return json_file
 
 def load_json(json_file):
@@ -44,7 +39,7 @@ def load_json(json_file):
     try:
         with open(json_file, "r", encoding="utf-8") as file:
             data = json.load(file)
-            log_debug("Successfully loaded JSON data.")
+            trace.debug("Successfully loaded JSON data.")
             return data
     except Exception as e:
         print(f"Error: Failed to read JSON file '{json_file}'. Reason: {e}")
@@ -80,15 +75,6 @@ def load_existing_priorities(filepath):
 
     return priorities
 
-def save_sorted_data(filepath, data, existing_priorities):
-    """Save sorted data to a file while preserving priority markers."""
-    sorted_codecs = sorted(set(data))  # Sort without markers
-
-    with open(filepath, "w", encoding="utf-8") as file:
-        for codec in sorted_codecs:
-            marker = existing_priorities.get(codec, "")  # Get existing marker
-            file.write(f"{marker}{codec}\n")
-
 def process_audio_data(json_file):
     """Extract and update audio codec and format note files."""
     metadata = load_json(json_file)
@@ -112,15 +98,21 @@ def process_audio_data(json_file):
         if format_note:
             format_notes.add(format_note)
 
-    log_debug(f"Extracted {len(audio_codecs)} unique audio codecs.")
-    log_debug(f"Extracted {len(format_notes)} unique format notes.")
+    trace.debug("Extracted %s unique audio codecs.", len(audio_codecs))
+    trace.debug("Extracted %s unique format notes.", len(format_notes))
+
+    # Observations are appended; the sorted views are only rewritten for new values
+    record_values(AUDIO_CODEC_FILE, audio_codecs)
+    record_values(AUDIO_FORMAT_NOTE_FILE, format_notes)
 
-    # Load existing priority markers before saving
     existing_codec_priorities = load_existing_priorities(AUDIO_CODEC_FILE)
     existing_format_priorities = load_existing_priorities(AUDIO_FORMAT_NOTE_FILE)
 
-    save_sorted_data(AUDIO_CODEC_FILE, audio_codecs, existing_codec_priorities)
-    save_sorted_data(AUDIO_FORMAT_NOTE_FILE, format_notes, existing_format_priorities)
+    if not audio_codecs.issubset(existing_codec_priorities):
+        regenerate_view(AUDIO_CODEC_FILE, audio_codecs)
+
+    if not format_notes.issubset(existing_format_priorities):
+        regenerate_view(AUDIO_FORMAT_NOTE_FILE, format_notes)
 
     # print(f"Updated {AUDIO_CODEC_FILE} and {AUDIO_FORMAT_NOTE_FILE}")
 
@@ -130,4 +122,4 @@ def main():
     process_audio_data(json_file)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
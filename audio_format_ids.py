@@ -2,27 +2,21 @@ import sys
 import os
 import json
 
+import tracing
+from bandwidth_selection import load_budget_settings, select_by_bandwidth
+from metrics import SELECTION_RUNGS
+
 # File paths
 AUDIO_CODEC_FILE = "docs/audio_codecs.txt"
 AUDIO_FORMAT_NOTES_FILE = "docs/audio_format_notes.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        try:
-            print(f"[DEBUG] {message}")
-        except UnicodeEncodeError:
-            print(f"[DEBUG] {message}".encode("ascii", "ignore").decode("ascii"))
+trace = tracing.get_tracer("audio_format_ids")
 
 def validate_input():
     """Validate command-line arguments and check if debug mode is enabled."""
-    global DEBUG_MODE
     
     if "-d" in sys.argv:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         sys.argv.remove("-d")
     
     if len(sys.argv) < 2:
@@ -39,7 +33,7 @@ def validate_input():
         print(f"Error: File '{json_file}' is not a JSON file.")
         sys.exit(1)
     
-    log_debug(f"Validated input file: {json_file}")
+    trace.debug("Validated input file: %s", json_file)
     return json_file
 
 def load_prioritized_data(file_path):
@@ -47,7 +41,7 @@ def load_prioritized_data(file_path):
     primary, secondary = None, None
     
     if not os.path.exists(file_path):
-        log_debug(f"File '{file_path}' does not exist. Skipping.")
+        trace.debug("File '%s' does not exist. Skipping.", file_path)
         return primary, secondary
     
     with open(file_path, "r", encoding="utf-8") as file:
@@ -58,15 +52,19 @@ def load_prioritized_data(file_path):
             elif line.startswith("#") and secondary is None:
                 secondary = line[1:]
     
-    log_debug(f"Loaded priority data from {file_path}: Primary: {primary}, Secondary: {secondary}")
+    trace.debug("Loaded priority data from %s: Primary: %s, Secondary: %s", file_path, primary, secondary)
     return primary, secondary
 
-def find_matching_format_id(json_data, primary_codec, secondary_codec, primary_note, secondary_note):
-    """Find format_id based on codec and format note priority."""
+def select_audio_format(json_data, primary_codec, secondary_codec, primary_note, secondary_note):
+    """Select a format_id based on codec and format note priority.
+
+    Returns (format_id, rung), where rung names the rule that decided; (None, None) if none did.
+    """
     format_id_candidates = []
     selected_format_id = None
+    selected_rung = None
 
-    log_debug(f"Searching for format IDs with primary_codec={primary_codec}, secondary_codec={secondary_codec}, primary_note={primary_note}, secondary_note={secondary_note}")
+    trace.debug("Searching for format IDs with primary_codec=%s, secondary_codec=%s, primary_note=%s, secondary_note=%s", primary_codec, secondary_codec, primary_note, secondary_note)
 
     for fmt in json_data.get("formats", []):
         if fmt.get("acodec") == "none":
@@ -76,44 +74,60 @@ def find_matching_format_id(json_data, primary_codec, secondary_codec, primary_n
         fmt_note = fmt.get("format_note")
         fmt_id = fmt.get("format_id")
 
-        log_debug(f"Checking format: ID={fmt_id}, Codec={fmt_codec}, Note={fmt_note}")
+        if trace.tracing:
+            trace.trace("Checking format: ID=%s, Codec=%s, Note=%s", fmt_id, fmt_codec, fmt_note)
 
         # Priority 1: Highest codec + highest format note
         if fmt_codec == primary_codec and fmt_note == primary_note:
-            log_debug(f"✅ Found exact match: {fmt_id} (Primary Codec + Primary Note)")
-            print(fmt_id)
-            return
+            trace.debug("✅ Found exact match: %s (Primary Codec + Primary Note)", fmt_id)
+            return fmt_id, "primary"
 
         # Priority 2: Highest codec + secondary format note
         if fmt_codec == primary_codec and fmt_note == secondary_note:
-            log_debug(f"⚠️ Found match: {fmt_id} (Primary Codec + Secondary Note)")
-            selected_format_id = fmt_id
+            trace.trace("⚠️ Found match: %s (Primary Codec + Secondary Note)", fmt_id)
+            selected_format_id, selected_rung = fmt_id, "primary_codec"
 
         # Priority 3: Highest codec, ignore format note
         if fmt_codec == primary_codec and not selected_format_id:
-            log_debug(f"⚠️ Found match: {fmt_id} (Primary Codec, ignoring Note)")
-            selected_format_id = fmt_id
+            trace.trace("⚠️ Found match: %s (Primary Codec, ignoring Note)", fmt_id)
+            selected_format_id, selected_rung = fmt_id, "primary_codec"
 
         # Priority 4: Secondary codec + highest format note
         if fmt_codec == secondary_codec and fmt_note == primary_note and not selected_format_id:
-            log_debug(f"⚠️ Found match: {fmt_id} (Secondary Codec + Primary Note)")
-            selected_format_id = fmt_id
+            trace.trace("⚠️ Found match: %s (Secondary Codec + Primary Note)", fmt_id)
+            selected_format_id, selected_rung = fmt_id, "secondary"
 
         # Priority 5: Secondary codec + secondary format note
         if fmt_codec == secondary_codec and fmt_note == secondary_note and not selected_format_id:
-            log_debug(f"⚠️ Found match: {fmt_id} (Secondary Codec + Secondary Note)")
-            selected_format_id = fmt_id
+            trace.trace("⚠️ Found match: %s (Secondary Codec + Secondary Note)", fmt_id)
+            selected_format_id, selected_rung = fmt_id, "secondary"
 
         # Priority 6: Secondary codec, ignore format note
         if fmt_codec == secondary_codec and not selected_format_id:
-            log_debug(f"⚠️ Found match: {fmt_id} (Secondary Codec, ignoring Note)")
-            selected_format_id = fmt_id
+            trace.trace("⚠️ Found match: %s (Secondary Codec, ignoring Note)", fmt_id)
+            selected_format_id, selected_rung = fmt_id, "secondary"
+
+    if selected_format_id:
+        trace.debug("✅ Using best available match: %s", selected_format_id)
+        return selected_format_id, selected_rung
+    return None, None
+
+def select_audio_format_id(json_data, primary_codec, secondary_codec, primary_note, secondary_note):
+    """Select a format_id based on codec and format note priority, or None."""
+    return select_audio_format(json_data, primary_codec, secondary_codec, primary_note, secondary_note)[0]
+
+def find_matching_format_id(json_data, primary_codec, secondary_codec, primary_note, secondary_note):
+    """Find format_id based on codec and format note priority and print it."""
+    selected_format_id, rung = select_audio_format(
+        json_data, primary_codec, secondary_codec, primary_note, secondary_note
+    )
 
     if selected_format_id:
-        log_debug(f"✅ Using best available match: {selected_format_id}")
+        SELECTION_RUNGS.inc(kind="audio", rung=rung)
         print(selected_format_id)
     else:
-        log_debug("⚠️ No suitable match found. Using 'av'.")
+        trace.debug("⚠️ No suitable match found. Using 'av'.")
+        SELECTION_RUNGS.inc(kind="audio", rung="fallback")
         print("av")
 
 def process_audio_format_ids(json_file):
@@ -129,6 +143,14 @@ def process_audio_format_ids(json_file):
         print("Error: 'formats' data missing in JSON file.")
         sys.exit(1)
 
+    # A bandwidth selection mode, when configured, takes precedence over the markers
+    bandwidth_format_id = select_by_bandwidth(metadata, "audio", load_budget_settings())
+    if bandwidth_format_id:
+        trace.debug("✅ Using bandwidth selection: %s", bandwidth_format_id)
+        SELECTION_RUNGS.inc(kind="audio", rung="bandwidth")
+        print(bandwidth_format_id)
+        return
+
     primary_codec, secondary_codec = load_prioritized_data(AUDIO_CODEC_FILE)
     primary_note, secondary_note = load_prioritized_data(AUDIO_FORMAT_NOTES_FILE)
 
@@ -144,4 +166,4 @@ def main():
     process_audio_format_ids(json_file)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
@@ -1,19 +1,14 @@
 import sys
 import os
-import subprocess
 
-# Global debug flag
-DEBUG_MODE = False
+import tracing
+from subprocess_watchdog import run_with_deadline
+from stage_scheduler import stage_name
 
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        print(f"[DEBUG] {message}")
+trace = tracing.get_tracer("audio_id")
 
 def validate_input():
     """Validate command-line arguments and check if the JSON file exists."""
-    global DEBUG_MODE
-
     if len(sys.argv) < 2:
         print("Error: No JSON file provided.")
         sys.exit(1)
@@ -22,7 +17,7 @@ def validate_input():
 
     # Check if debug mode is enabled
     if "-d" in args:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         args.remove("-d")  # Remove debug flag from arguments
 
     json_file = args[0] if args else None
@@ -39,18 +34,15 @@ def validate_input():
         print(f"Error: File '{json_file}' is not a JSON file.")
         sys.exit(1)
 
-    log_debug(f"Validated input file: {json_file}")
+    trace.debug("Validated input file: %s", json_file)
     return json_file
 
 def run_script(script_name, json_file):
     """Execute a Python script with the given JSON file."""
     command = ["python", script_name, json_file]
-    if DEBUG_MODE:
-        command.append("-d")  # Pass debug flag if enabled
-
-    log_debug(f"Executing: {' '.join(command)}")
+    trace.debug("Executing: %s", " ".join(command))
 
-    result = subprocess.run(command, capture_output=True, text=True)
+    result = run_with_deadline(command, stage_name(script_name))
 
     if result.returncode != 0:
         print(f"Error: {script_name} failed.")
@@ -73,4 +65,4 @@ def main():
     run_script("audio_format_ids.py", json_file)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
@@ -1,11 +1,14 @@
 import sys
-import subprocess
 
-# Global debug flag
-DEBUG_MODE = "-d" in sys.argv
+import tracing
+from subprocess_watchdog import run_with_deadline
+from stage_scheduler import stage_name
 
 def validate_input():
     """Validate that a JSON file is provided."""
+    if "-d" in sys.argv:
+        tracing.enable_debug()  # Inherited by the scripts started below
+
     args = [arg for arg in sys.argv[1:] if arg != "-d"]
 
     if not args:
@@ -17,10 +20,11 @@ def validate_input():
 def run_script(script_name, json_file):
     """Execute a Python script with the JSON file."""
     command = ["python", script_name, json_file]
-    if DEBUG_MODE:
-        command.append("-d")  # Pass debug flag if enabled
-
-    subprocess.run(command, check=True)
+    # Both scripts make up the audio_markers stage and share its deadline
+    result = run_with_deadline(command, stage_name("audio_selections.py"), capture_output=False)
+    if result.returncode != 0:
+        print(result.stderr or f"Error: {script_name} failed.")
+        sys.exit(1)
 
 def main():
     """Launch audio selection scripts with JSON file."""
@@ -30,4 +34,4 @@ def main():
     run_script("audio_selections_codecs.py", json_file)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
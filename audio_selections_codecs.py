@@ -1,28 +1,23 @@
 import sys
 import os
 
+import tracing
+
 # File path for audio codecs
 AUDIO_CODEC_FILE = "docs/audio_codecs.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        print(f"[DEBUG] {message}")
+trace = tracing.get_tracer("audio_selections_codecs")
 
 def validate_input():
     """Validate command-line arguments and check if debug mode is enabled."""
-    global DEBUG_MODE
     if "-d" in sys.argv:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         sys.argv.remove("-d")  # Remove debug flag from arguments
 
 def load_codecs():
     """Loads codec lines from the file, preserving order and markers."""
     if not os.path.exists(AUDIO_CODEC_FILE):
-        log_debug(f"File '{AUDIO_CODEC_FILE}' does not exist. Skipping.")
+        trace.debug("File '%s' does not exist. Skipping.", AUDIO_CODEC_FILE)
         return []
 
     with open(AUDIO_CODEC_FILE, "r", encoding="utf-8") as file:
@@ -39,7 +34,7 @@ def update_codecs():
     if not codecs:
         return
 
-    log_debug(f"Initial codecs: {codecs}")
+    trace.debug("Initial codecs: %s", codecs)
 
     codec_map = {}  # Stores markers for each codec
     ordered_codecs = []  # Stores codecs in order
@@ -79,9 +74,9 @@ def update_codecs():
     if updated:
         updated_codecs = [f"{codec_map.get(c, '')}{c}" for c in ordered_codecs]
         save_codecs(updated_codecs)
-        log_debug(f"Updated codecs: {updated_codecs}")
+        trace.debug("Updated codecs: %s", updated_codecs)
     else:
-        log_debug("No changes needed.")
+        trace.debug("No changes needed.")
 
 def main():
     """Main execution."""
@@ -89,4 +84,4 @@ def main():
     update_codecs()
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
@@ -1,28 +1,23 @@
 import sys
 import os
 
+import tracing
+
 # File path for audio format notes
 AUDIO_FORMAT_NOTE_FILE = "docs/audio_format_notes.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        print(f"[DEBUG] {message}")
+trace = tracing.get_tracer("audio_selections_format_notes")
 
 def validate_input():
     """Validate command-line arguments and check if debug mode is enabled."""
-    global DEBUG_MODE
     if "-d" in sys.argv:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         sys.argv.remove("-d")  # Remove debug flag from arguments
 
 def load_format_notes():
     """Loads format note lines from the file, preserving order and markers."""
     if not os.path.exists(AUDIO_FORMAT_NOTE_FILE):
-        log_debug(f"File '{AUDIO_FORMAT_NOTE_FILE}' does not exist. Skipping.")
+        trace.debug("File '%s' does not exist. Skipping.", AUDIO_FORMAT_NOTE_FILE)
         return []
 
     with open(AUDIO_FORMAT_NOTE_FILE, "r", encoding="utf-8") as file:
@@ -39,7 +34,7 @@ def update_format_notes():
     if not format_notes:
         return
 
-    log_debug(f"Initial format notes: {format_notes}")
+    trace.debug("Initial format notes: %s", format_notes)
 
     note_map = {}  # Stores markers for each format note
     ordered_notes = []  # Stores format notes in order
@@ -79,9 +74,9 @@ def update_format_notes():
     if updated:
         updated_notes = [f"{note_map.get(n, '')}{n}" for n in ordered_notes]
         save_format_notes(updated_notes)
-        log_debug(f"Updated format notes: {updated_notes}")
+        trace.debug("Updated format notes: %s", updated_notes)
     else:
-        log_debug("No changes needed.")
+        trace.debug("No changes needed.")
 
 def main():
     """Main execution."""
@@ -89,4 +84,4 @@ def main():
     update_format_notes()
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
@@ -0,0 +1,345 @@
+import sys
+import os
+import re
+import json
+import time
+import subprocess
+import threading
+
+import tracing
+import loudness
+from metadata_fetch import YTDLP_COMMAND
+from stage_scheduler import chain_output
+from metrics import BYTES_DOWNLOADED, CACHE_HITS, CACHE_MISSES, ENCODE_SECONDS
+from subprocess_watchdog import (
+    DEFAULT_DEADLINE,
+    WATCHDOG_ENV,
+    kill_process_tree,
+    load_deadlines,
+    process_group_options,
+    record,
+    track_process,
+    untrack_process,
+)
+
+EXECUTABLES_FOLDER = "executables"
+
+# Bytes moved from yt-dlp to ffmpeg per read; a full ffmpeg pipe blocks the
+# write, which in turn stops reading from yt-dlp until ffmpeg catches up
+STREAM_CHUNK_SIZE = 64 * 1024
+
+MP3_QUALITY = "2"  # libmp3lame VBR quality, about 190 kbit/s
+MP3_BYTES_PER_SECOND = 190 * 1000 // 8
+MP3_OPTIONS = ["-codec:a", "libmp3lame", "-q:a", MP3_QUALITY, "-id3v2_version", "3"]
+
+# Fallback IDs printed by the format ID scripts, as yt-dlp selectors
+FALLBACK_SELECTORS = {"av": "ba", "": "ba"}
+
+trace = tracing.get_tracer("audio_stream")
+
+def selected_audio_format(stage_results):
+    """Return the audio format ID the audio chain printed last, or 'ba'."""
+    output = chain_output(stage_results, "audio").splitlines()
+    return output[-1].strip() if output else "ba"
+
+def ffmpeg_command():
+    """Return ffmpeg from the 'executables' folder, or the one on PATH."""
+    program = os.path.join(EXECUTABLES_FOLDER, "ffmpeg")
+    return [program] if os.path.isfile(program) else ["ffmpeg"]
+
+def safe_name(text, default="audio"):
+    """Replace the characters file systems reject in a file name."""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", text or "").strip(" .")
+    return name or default
+
+def output_name(metadata):
+    """The title and video ID, without extension."""
+    return f"{safe_name(metadata.get('title'))} [{metadata.get('id', 'unknown')}]"
+
+def output_filename(metadata):
+    """Name the mp3 after the title and video ID, without characters file systems reject."""
+    return f"{output_name(metadata)}.mp3"
+
+def metadata_tags(metadata, **overrides):
+    """ffmpeg options writing the essential ID3 tags; keyword arguments replace single tags."""
+    tags = {
+        "title": metadata.get("track") or metadata.get("title"),
+        "artist": metadata.get("artist") or metadata.get("uploader"),
+        "album": metadata.get("album"),
+        "date": (metadata.get("release_date") or metadata.get("upload_date") or "")[:4],
+    }
+    tags.update(overrides)
+    options = []
+    for name, value in tags.items():
+        if value:
+            options += ["-metadata", f"{name}={value}"]
+    return options
+
+def cover_options(cover):
+    """ffmpeg options adding a cover image as the second input."""
+    return ["-i", cover] if cover else []
+
+def cover_mapping(cover):
+    """Options for one output embedding the second input as its front cover."""
+    if not cover:
+        return []
+    return [
+        "-map", "1:v", "-c:v", "copy", "-disposition:v", "attached_pic",
+        "-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)",
+    ]
+
+def drain(stream, chunks):
+    """Collect a child's stderr so it never blocks on a full pipe."""
+    chunks.append(stream.read())
+
+def pump(source, sink):
+    """Copy the download into the encoder.
+
+    Returns the number of bytes moved and whether the download ended normally
+    (False when the encoder stopped reading).
+    """
+    total = 0
+    while True:
+        chunk = source.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return total, True
+        try:
+            sink.write(chunk)
+        except BrokenPipeError:
+            return total, False  # The encoder failed; its stderr says why
+        total += len(chunk)
+
+def download_command(metadata_file, format_id):
+    """yt-dlp writing the selected format of the saved metadata to stdout."""
+    selector = FALLBACK_SELECTORS.get(format_id, format_id)
+    return YTDLP_COMMAND + [
+        "--load-info-json", metadata_file, "-f", selector, "-o", "-", "--quiet", "--no-progress",
+    ]
+
+def run_pipe(download, process, stage="stream_audio"):
+    """Run yt-dlp into ffmpeg under the stage's deadline.
+
+    Returns a dict with the bytes moved, both return codes, ffmpeg's stderr,
+    the combined error output and whether the deadline was hit.
+    """
+    deadlines = load_deadlines()
+    deadline = deadlines.get(stage, deadlines.get("default", DEFAULT_DEADLINE))
+    options = process_group_options()
+    own_group = bool(options)
+    env = dict(os.environ, **{WATCHDOG_ENV: "1"})
+
+    trace.debug("Streaming: %s | %s", " ".join(download), " ".join(process))
+
+    # bufsize=0 keeps Python from buffering on top of the pipes
+    encoder = subprocess.Popen(
+        process, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        bufsize=0, env=env, **options,
+    )
+    track_process(encoder, own_group)
+    try:
+        downloader = subprocess.Popen(
+            download, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0, env=env, **options,
+        )
+    except OSError:
+        kill_process_tree(encoder, own_group)
+        untrack_process(encoder, own_group)
+        raise
+    track_process(downloader, own_group)
+
+    timed_out = threading.Event()
+
+    def on_deadline():
+        timed_out.set()
+        kill_process_tree(downloader, own_group)
+        kill_process_tree(encoder, own_group)
+
+    timer = threading.Timer(deadline, on_deadline)
+    timer.daemon = True
+    errors = {"download": [], "encode": []}
+    drains = [
+        threading.Thread(target=drain, args=(downloader.stderr, errors["download"]), daemon=True),
+        threading.Thread(target=drain, args=(encoder.stderr, errors["encode"]), daemon=True),
+    ]
+    for thread in drains:
+        thread.start()
+    timer.start()
+
+    try:
+        downloaded, complete = pump(downloader.stdout, encoder.stdin)
+        if not complete:
+            kill_process_tree(downloader, own_group)  # Nobody reads its output any more
+        try:
+            encoder.stdin.close()  # End of input; ffmpeg finishes the file
+        except BrokenPipeError:
+            pass
+        if downloader.wait() != 0:
+            kill_process_tree(encoder, own_group)  # Never finish on a truncated stream
+        encoder.wait()
+    except BaseException:
+        kill_process_tree(downloader, own_group)  # Interrupted; neither child sees the terminal's Ctrl-C
+        kill_process_tree(encoder, own_group)
+        raise
+    finally:
+        timer.cancel()
+        for thread in drains:
+            thread.join()
+        untrack_process(downloader, own_group)
+        untrack_process(encoder, own_group)
+
+    BYTES_DOWNLOADED.inc(downloaded, kind="audio")
+    outputs = {name: b"".join(chunks).decode("utf-8", "replace").strip() for name, chunks in errors.items()}
+    error_output = "\n".join(output for output in outputs.values() if output)
+    if timed_out.is_set():
+        record(stage, "timeouts")
+        error_output = f"Error: {stage} timed out after {deadline:g}s."
+
+    return {
+        "bytes": downloaded,
+        "download_returncode": downloader.returncode,
+        "returncode": encoder.returncode,
+        "ffmpeg_output": outputs["encode"],
+        "error": error_output,
+        "timed_out": timed_out.is_set(),
+        "ok": not timed_out.is_set() and downloader.returncode == 0 and encoder.returncode == 0,
+    }
+
+def is_concrete_format(metadata, format_id):
+    """Check whether a format ID names one of the upload's formats.
+
+    Fallback selectors like 'av' may resolve to a different format next time,
+    so results derived from them are never cached.
+    """
+    return bool(metadata.get("id")) and any(fmt.get("format_id") == format_id for fmt in metadata.get("formats", []))
+
+def measure_loudness(metadata_file, metadata, format_id, cache):
+    """Return the loudness of the selected format, measuring it only on a cache miss.
+
+    The measuring pass costs about as much as the encode, so its result is kept
+    for later re-encodes of the same format. Returns the measurement and None,
+    or None and the error output.
+    """
+    video_id = metadata.get("id")
+    cacheable = is_concrete_format(metadata, format_id)
+
+    if cacheable:
+        measured = cache.get(video_id, format_id)
+        if measured is not None:
+            CACHE_HITS.inc(cache="loudness")
+            return measured, None
+        CACHE_MISSES.inc(cache="loudness")
+
+    analyze = ffmpeg_command() + [
+        "-hide_banner", "-nostats", "-loglevel", "info", "-i", "pipe:0", "-vn",
+        "-af", loudness.analysis_filter(), "-f", "null", "-",
+    ]
+    result = run_pipe(download_command(metadata_file, format_id), analyze, stage="loudness_analysis")
+    measured = loudness.parse_measurement(result["ffmpeg_output"]) if result["ok"] else None
+    if measured is None:
+        return None, result["error"] or "Error: The loudness analysis printed no measurement."
+
+    if cacheable:
+        cache.put(video_id, format_id, measured)
+    return measured, None
+
+def stream_audio(metadata_file, metadata, format_id, output_dir=".", journal=None, link=None,
+                 loudness_cache=None, artwork_cache=None, cover=None):
+    """Pipe the selected audio format from yt-dlp straight into an mp3 encoder.
+
+    With a loudness cache the mp3 is normalized with loudnorm's second pass,
+    using the cached measurement when there is one; a given cover image, or
+    with an artwork cache the thumbnail, is embedded as its cover. Only the
+    finished mp3 is written to disk. Returns the output path and None on
+    success, or None and the error output.
+    """
+    output_path = os.path.join(output_dir, output_filename(metadata))
+    partial_path = f"{output_path}.part"
+
+    filters = []
+    if loudness_cache is not None:
+        measured, error = measure_loudness(metadata_file, metadata, format_id, loudness_cache)
+        if measured is None:
+            return None, error
+        filters = ["-af", loudness.normalization_filter(measured)]
+
+    if cover is None and artwork_cache is not None:
+        cover = artwork_cache.cover_for(metadata)
+    encode_command = ffmpeg_command() + [
+        "-hide_banner", "-loglevel", "error", "-y", "-i", "pipe:0",
+    ] + cover_options(cover) + ["-map", "0:a"] + filters + MP3_OPTIONS + cover_mapping(cover) + metadata_tags(
+        metadata
+    ) + ["-f", "mp3", partial_path]
+
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    result = run_pipe(download_command(metadata_file, format_id), encode_command)
+
+    if result["download_returncode"] == 0 and not result["timed_out"] and journal:
+        journal.record(link, "downloaded", bytes=result["bytes"])
+
+    if not result["ok"]:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return None, result["error"] or "Error: Streaming stopped before the audio was complete."
+
+    ENCODE_SECONDS.observe(time.perf_counter() - started)
+    os.replace(partial_path, output_path)
+    if journal:
+        journal.record(link, "encoded", output_file=output_path)
+    trace.debug("Streamed %s bytes into %s", result["bytes"], output_path)
+    return output_path, None
+
+def validate_input():
+    """Validate command-line arguments and check if debug mode is enabled."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    output_dir = "."
+    if "-o" in args:
+        index = args.index("-o")
+        if index + 1 >= len(args):
+            print("Error: -o requires a directory argument.")
+            sys.exit(1)
+        output_dir = args[index + 1]
+        del args[index:index + 2]
+
+    normalize = "-n" in args
+    if normalize:
+        args.remove("-n")
+
+    if len(args) < 2:
+        print("Error: Usage: audio_stream.py <metadata file> <audio format ID> [-o <output directory>] [-n]")
+        sys.exit(1)
+
+    json_file, format_id = args[0], args[1]
+    if not os.path.exists(json_file):
+        print(f"Error: File '{json_file}' not found.")
+        sys.exit(1)
+
+    if not json_file.lower().endswith(".json"):
+        print(f"Error: File '{json_file}' is not a JSON file.")
+        sys.exit(1)
+
+    return json_file, format_id, output_dir, normalize
+
+def main():
+    """Main execution."""
+    json_file, format_id, output_dir, normalize = validate_input()
+    try:
+        with open(json_file, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+    except Exception as e:
+        print(f"Error: Failed to read JSON file. {e}")
+        sys.exit(1)
+
+    cache = loudness.LoudnessCache() if normalize else None
+    output_path, error = stream_audio(json_file, metadata, format_id, output_dir, loudness_cache=cache)
+    if output_path is None:
+        print("Error: Failed to stream the audio.")
+        print(error)
+        sys.exit(1)
+    print(f"Saved: {output_path}")
+
+if __name__ == "__main__":
+    tracing.run_main(main)
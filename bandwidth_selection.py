@@ -0,0 +1,113 @@
+import os
+
+# File with the bandwidth selection settings, one `key=value` per line
+BANDWIDTH_BUDGET_FILE = "docs/bandwidth_budget.txt"
+
+# Settings understood in the budget file
+NUMERIC_SETTINGS = (
+    "video_min_height",
+    "video_min_tbr",
+    "video_max_bytes",
+    "audio_min_abr",
+    "audio_max_bytes",
+)
+
+def load_budget_settings():
+    """Load bandwidth selection settings; an absent file disables the mode."""
+    settings = {"mode": "off"}
+
+    if not os.path.exists(BANDWIDTH_BUDGET_FILE):
+        return settings
+
+    with open(BANDWIDTH_BUDGET_FILE, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or "=" not in line:
+                continue
+            key, value = (part.strip() for part in line.split("=", 1))
+            if key == "mode":
+                settings["mode"] = value.lower()
+            elif key in NUMERIC_SETTINGS:
+                try:
+                    settings[key] = float(value)
+                except ValueError:
+                    continue  # Ignore malformed entries
+
+    return settings
+
+def estimate_bytes(fmt, duration):
+    """Estimate a format's size from filesize, filesize_approx or its bitrate."""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return size
+
+    bitrate = fmt.get("tbr") or fmt.get("abr") or fmt.get("vbr")  # kbit/s
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+
+    return None
+
+def candidate_formats(metadata, kind):
+    """Return the video formats, or the audio-only formats, of a video."""
+    formats = metadata.get("formats", [])
+    if kind == "video":
+        return [fmt for fmt in formats if fmt.get("vcodec") not in (None, "none")]
+    return [
+        fmt for fmt in formats
+        if fmt.get("acodec") not in (None, "none") and fmt.get("vcodec") in (None, "none")
+    ]
+
+def quality_key(fmt, kind):
+    """Sort key where a larger value means a better format."""
+    if kind == "video":
+        return ((fmt.get("width") or 0) * (fmt.get("height") or 0), fmt.get("tbr") or 0)
+    return (fmt.get("abr") or fmt.get("tbr") or 0,)
+
+def short_side(fmt):
+    """Return the shorter known side of a video format, which its `Np` note names, or 0."""
+    return min((side for side in (fmt.get("width"), fmt.get("height")) if side), default=0)
+
+def meets_floor(fmt, kind, settings):
+    """Check whether a format reaches the declared quality floor."""
+    if kind == "video":
+        return (
+            short_side(fmt) >= settings.get("video_min_height", 0)
+            and (fmt.get("tbr") or 0) >= settings.get("video_min_tbr", 0)
+        )
+    return (fmt.get("abr") or fmt.get("tbr") or 0) >= settings.get("audio_min_abr", 0)
+
+def select_by_bandwidth(metadata, kind, settings):
+    """Pick a format by size: the cheapest above the floor, or the best under the budget.
+
+    Returns the format_id, or None when the mode is off or nothing qualifies.
+    """
+    mode = settings.get("mode", "off")
+    if mode not in ("floor", "budget"):
+        return None
+
+    duration = metadata.get("duration")
+    sized = [
+        (fmt, estimate_bytes(fmt, duration))
+        for fmt in candidate_formats(metadata, kind)
+    ]
+
+    if mode == "floor":
+        eligible = [(fmt, size) for fmt, size in sized if meets_floor(fmt, kind, settings)]
+        if not eligible:
+            return None
+        # Formats of unknown size go last; ties prefer the better format
+        fmt, _ = min(
+            eligible,
+            key=lambda entry: (entry[1] is None, entry[1] or 0, [-v for v in quality_key(entry[0], kind)]),
+        )
+        return fmt.get("format_id")
+
+    budget = settings.get(f"{kind}_max_bytes")
+    if budget is None:
+        return None
+    eligible = [(fmt, size) for fmt, size in sized if size is not None and size <= budget]
+    if not eligible:
+        return None
+    # Ties prefer the smaller download
+    fmt, _ = max(eligible, key=lambda entry: (quality_key(entry[0], kind), -entry[1]))
+    return fmt.get("format_id")
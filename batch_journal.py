@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import threading
+
+# Item states, in the order an item goes through them
+STATES = ("queued", "metadata_fetched", "selected", "downloaded", "encoded", "done")
+FAILED = "failed"
+
+# Buffered records are written and fsynced once either limit is reached
+JOURNAL_FLUSH_RECORDS = 32
+JOURNAL_FLUSH_SECONDS = 1.0
+
+def journal_path(links_file):
+    """Return the journal file kept next to a links file."""
+    return f"{links_file}.journal"
+
+def load_journal(path):
+    """Replay a journal into {link: merged record} holding each link's last durable state."""
+    items = {}
+
+    if not os.path.exists(path):
+        return items
+
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A torn write at the moment of the crash
+
+            items.setdefault(record["link"], {}).update(record)
+
+    return items
+
+class BatchJournal:
+    """Append-only log of item state transitions, written in fsynced batches."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def record(self, link, state, **data):
+        """Buffer a state transition for a link."""
+        entry = {"link": link, "state": state, "time": time.time(), **data}
+        with self._lock:
+            self._buffer.append(json.dumps(entry) + "\n")
+            if len(self._buffer) >= JOURNAL_FLUSH_RECORDS:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.clear()
+
+    def flush(self):
+        """Make every buffered transition durable."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(JOURNAL_FLUSH_SECONDS):
+            self.flush()
+
+    def close(self):
+        """Flush the remaining transitions and close the journal."""
+        self._stop.set()
+        self._flusher.join()
+        with self._lock:
+            self._flush_locked()
+            self._file.close()
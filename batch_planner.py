@@ -0,0 +1,139 @@
+import json
+import shutil
+import threading
+
+from audio_stream import MP3_BYTES_PER_SECOND, selected_audio_format
+from bandwidth_selection import candidate_formats, estimate_bytes
+from stage_scheduler import PROFILES_STAGE, chain_output
+
+# Order in which admitted items are handed to workers
+POLICIES = ("shortest", "longest", "fifo")
+DEFAULT_POLICY = "shortest"
+
+# Free space always left untouched in the output and temp directories
+DISK_RESERVE_BYTES = 1024 * 1024 * 1024
+
+def load_metadata(metadata_file):
+    """Load a metadata file, or return None when it cannot be read."""
+    try:
+        with open(metadata_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def selected_format_size(metadata, kind, format_id):
+    """Estimate the size of a selected format; fallbacks count as the largest format."""
+    duration = metadata.get("duration")
+    formats = candidate_formats(metadata, kind)
+
+    for fmt in formats:
+        if fmt.get("format_id") == format_id:
+            return estimate_bytes(fmt, duration) or 0
+
+    # `bv`/`av` or a selector: yt-dlp picks the best, which is usually the largest
+    sizes = [estimate_bytes(fmt, duration) or 0 for fmt in formats]
+    return max(sizes, default=0)
+
+def profile_format_ids(metadata, stage_results, kind):
+    """Return the format IDs of a kind that the profiles stage printed, one per profile."""
+    fallback = "bv" if kind == "video" else "av"
+    known = {fmt.get("format_id") for fmt in candidate_formats(metadata, kind)}
+
+    format_ids = []
+    for line in chain_output(stage_results, PROFILES_STAGE["chain"]).splitlines():
+        _, _, selection = line.rpartition(": ")
+        format_ids.extend(
+            format_id for format_id in selection.strip().split("+")
+            if format_id in known or format_id == fallback
+        )
+    return format_ids
+
+def estimate_item_bytes(item, metadata, kinds=("video", "audio")):
+    """Estimate the bytes of an item's selected video and audio formats.
+
+    With profiles, an item is as large as the largest selection any profile makes.
+    """
+    total = 0
+    for kind in kinds:
+        output = chain_output(item["stage_results"], kind).splitlines()
+        format_ids = [output[-1].strip()] if output else profile_format_ids(metadata, item["stage_results"], kind)
+        total += max((selected_format_size(metadata, kind, format_id) for format_id in format_ids),
+                     default=selected_format_size(metadata, kind, None))
+
+    return total
+
+def estimate_output_bytes(item, metadata):
+    """Estimate the bytes an item's mp3 takes on disk; the source itself is only streamed."""
+    duration = metadata.get("duration")
+    if duration:
+        return int(duration * MP3_BYTES_PER_SECOND)
+    return selected_format_size(metadata, "audio", selected_audio_format(item["stage_results"]))
+
+class BatchPlanner:
+    """Order prepared items by size and hold back items that would fill the disk.
+
+    Only runs that extract audio write to disk; other items are admitted right away.
+    """
+
+    def __init__(self, policy=DEFAULT_POLICY, directories=(".",), reserve=DISK_RESERVE_BYTES, kinds=("video", "audio"),
+                 extract_audio=False):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy '{policy}'. Choose one of: {', '.join(POLICIES)}.")
+        self.policy = policy
+        self.directories = list(directories)
+        self.reserve = reserve
+        self.kinds = kinds  # The kinds of media items select
+        self.extract_audio = extract_audio
+        self.pending = []
+        self.in_flight_bytes = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        """Queue a prepared item with its estimated size and the disk space it needs."""
+        metadata = load_metadata(item["metadata_file"]) or {}
+        item["estimated_bytes"] = estimate_item_bytes(item, metadata, self.kinds)
+        item["reserved_bytes"] = estimate_output_bytes(item, metadata) if self.extract_audio else 0
+        with self._lock:
+            item["sequence"] = self._sequence
+            self._sequence += 1
+            self.pending.append(item)
+
+    def free_bytes(self):
+        """Return the space available to new items across the watched directories."""
+        free = min(shutil.disk_usage(directory).free for directory in self.directories)
+        return free - self.reserve - self.in_flight_bytes
+
+    def _ordered(self):
+        if self.policy == "shortest":
+            return sorted(self.pending, key=lambda item: (item["estimated_bytes"], item["sequence"]))
+        if self.policy == "longest":
+            return sorted(self.pending, key=lambda item: (-item["estimated_bytes"], item["sequence"]))
+        return sorted(self.pending, key=lambda item: item["sequence"])
+
+    def next_admitted(self):
+        """Pop the next item that fits on disk, or return None to wait."""
+        with self._lock:
+            free = self.free_bytes() if self.extract_audio else 0
+            for item in self._ordered():
+                if not item["reserved_bytes"] or item["reserved_bytes"] <= free:
+                    self.pending.remove(item)
+                    self.in_flight_bytes += item["reserved_bytes"]
+                    return item
+            return None
+
+    def pop_unfittable(self):
+        """Remove and return the items that cannot fit even with nothing in flight."""
+        with self._lock:
+            if self.in_flight_bytes or not self.extract_audio:
+                return []
+            free = self.free_bytes()
+            unfittable = [item for item in self.pending if item["reserved_bytes"] > max(free, 0)]
+            for item in unfittable:
+                self.pending.remove(item)
+            return unfittable
+
+    def release(self, item):
+        """Return an item's reserved space once it is finished."""
+        with self._lock:
+            self.in_flight_bytes -= item["reserved_bytes"]
@@ -0,0 +1,265 @@
+import sys
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import loudness
+from artwork_cache import cover_hash
+from audio_stream import (
+    MP3_QUALITY,
+    is_concrete_format,
+    output_filename,
+    output_name,
+    selected_audio_format,
+    stream_audio,
+)
+from batch_journal import BatchJournal, FAILED, load_journal
+from batch_planner import BatchPlanner, DEFAULT_POLICY, load_metadata
+from chapter_split import load_chapters, split_audio
+from metadata_prefetch import MetadataPrefetcher, PREFETCH_WINDOW
+from metrics import LINKS_PROCESSED
+from output_store import output_key
+from stage_scheduler import STAGES, StageScheduler, chain_output, failed_stage
+
+# Number of items handled at the same time
+BATCH_WORKERS = 2
+
+# Keeps the output of items handled in parallel from interleaving
+print_lock = threading.Lock()
+
+def read_links(links_file):
+    """Read links from a file, one per line, ignoring blanks and comments."""
+    if not os.path.exists(links_file):
+        print(f"Error: Batch file '{links_file}' does not exist.")
+        sys.exit(1)
+
+    with open(links_file, "r", encoding="utf-8") as file:
+        return [
+            line.strip() for line in file
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+def report_item(stage_results, chains=("video", "audio")):
+    """Print the outputs of an item's chains, or the error of its failed stage."""
+    stage = failed_stage(stage_results)
+    if stage:
+        result = stage_results[stage["name"]]
+        print(f"Error: {stage['script']} failed.")
+        print(result.stdout.strip())  # Stage scripts report their errors on stdout
+        print(result.stderr)
+        return False
+
+    for chain in chains:
+        print(chain_output(stage_results, chain))
+    return True
+
+def encode_settings(loudness_cache=None, cover=None, chapters=()):
+    """Everything besides the source format that changes the bytes of an output."""
+    return {
+        "quality": MP3_QUALITY,
+        "loudness": loudness.target_options() if loudness_cache is not None else None,
+        "artwork": cover_hash(cover),
+        "chapters": [list(chapter) for chapter in chapters],
+    }
+
+def save_audio(metadata_file, metadata, format_id, output_dir=".", journal=None, link=None,
+                  loudness_cache=None, artwork_cache=None, split_chapters=False, output_store=None):
+    """Save the selected audio as an mp3, or as one mp3 per chapter.
+
+    With an output store, an output already stored for the same video, format
+    and settings is linked into place instead of being downloaded and encoded.
+    Returns the output path and None, or None and the error output.
+    """
+    chapters = load_chapters(metadata) if split_chapters else []
+    # The cover is resolved first, so an output whose cover could not be fetched is keyed without one
+    cover = artwork_cache.cover_for(metadata) if artwork_cache is not None else None
+    destination = os.path.join(output_dir, output_name(metadata) if chapters else output_filename(metadata))
+
+    key = None
+    settings = encode_settings(loudness_cache, cover, chapters)
+    if output_store is not None and is_concrete_format(metadata, format_id):
+        key = output_key(metadata["id"], format_id, settings)
+        os.makedirs(output_dir, exist_ok=True)
+        if output_store.place(key, destination):
+            if journal:
+                journal.record(link, "encoded", output_file=destination, stored=key)
+            return destination, None
+
+    extract = split_audio if chapters else stream_audio
+    options = {"chapters": chapters} if chapters else {}
+    output_path, error = extract(
+        metadata_file, metadata, format_id, output_dir, journal=journal, link=link,
+        loudness_cache=loudness_cache, cover=cover, **options,
+    )
+    if output_path and key:
+        output_store.add(key, metadata["id"], format_id, settings, output_path)
+    return output_path, error
+
+def extract_item_audio(item, output_dir=".", journal=None, loudness_cache=None, split_chapters=False,
+                       artwork_cache=None, output_store=None):
+    """Stream an item's selected audio format into an mp3, or one mp3 per chapter."""
+    output_path, error = save_audio(
+        item["metadata_file"], load_metadata(item["metadata_file"]) or {},
+        selected_audio_format(item["stage_results"]), output_dir, journal=journal, link=item["link"],
+        loudness_cache=loudness_cache, artwork_cache=artwork_cache, split_chapters=split_chapters,
+        output_store=output_store,
+    )
+
+    with print_lock:
+        if output_path is None:
+            print(f"Error: Failed to extract the audio of {item['link']}.")
+            print(error)
+            return False
+        print(f"Saved: {output_path}")
+        return True
+
+def handle_item(item, chains, extract=None):
+    """Handle a prepared item whose stages all succeeded, extracting its audio if asked."""
+    with print_lock:
+        print(f"Input Link: {item['link']}")
+        if not report_item(item["stage_results"], chains):
+            return False
+    return extract(item) if extract else True
+
+def report_failed_item(item):
+    """Print why an item could not be prepared."""
+    with print_lock:
+        print(f"Input Link: {item['link']}")
+        if item["error"] is not None:
+            print("Error: Failed to retrieve metadata.")
+            print(item["error"])
+        else:
+            report_item(item["stage_results"])
+
+def process_items(pool, workers, prefetcher, planner, chains, extract, finish):
+    """Hand the prefetcher's items to the pool, smallest first; returns how many succeeded.
+
+    finish(item, state) is called once per item with "done" or FAILED.
+    """
+    succeeded = 0
+    running = {}
+
+    def dispatch():
+        """Start admitted items while workers are free."""
+        while len(running) < workers:
+            item = planner.next_admitted()
+            if item is None:
+                return
+            running[pool.submit(handle_item, item, chains, extract)] = item
+
+    def collect(block):
+        """Record finished items and give back their disk reservation."""
+        nonlocal succeeded
+        if not running:
+            return
+        done, _ = wait(running, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = running.pop(future)
+            planner.release(item)
+            if future.result():
+                succeeded += 1
+                finish(item, "done")
+            else:
+                finish(item, FAILED)
+
+    def drop_unfittable():
+        """Report items that cannot fit on disk even when nothing else runs."""
+        for item in planner.pop_unfittable():
+            finish(item, FAILED)
+            with print_lock:
+                print(f"Input Link: {item['link']}")
+                print(f"Error: Not enough disk space (needs about {item['reserved_bytes'] // 2**20} MB).")
+
+    for item in prefetcher:
+        if item is None:
+            # Waiting for more links; finish what is running meanwhile
+            dispatch()
+            drop_unfittable()
+            collect(block=False)
+            continue
+
+        if item["error"] is not None or failed_stage(item["stage_results"]):
+            report_failed_item(item)
+            finish(item, FAILED)
+            continue
+
+        planner.add(item)
+        dispatch()
+
+        # Keep about one window of items waiting so the ordering stays local
+        while len(planner.pending) >= prefetcher.window and running:
+            collect(block=True)
+            dispatch()
+        collect(block=False)
+        drop_unfittable()
+
+    while planner.pending or running:
+        dispatch()
+        drop_unfittable()
+        collect(block=True)
+    return succeeded
+
+def run_batch(links, max_workers=None, prefetch=PREFETCH_WINDOW, stages=STAGES, chains=("video", "audio"),
+              workers=BATCH_WORKERS, policy=DEFAULT_POLICY, journal_file=None, resume=False,
+              extract_audio=False, output_dir=".", loudness_cache=None, split_chapters=False,
+              artwork_cache=None, output_store=None, audio_only=False):
+    """Handle prepared links, smallest first, while the next ones are fetched and selected."""
+
+    # Links finished by an earlier run are skipped; the rest continue from their last state
+    resume_items = load_journal(journal_file) if journal_file and resume else {}
+    done_links = {link for link, record in resume_items.items() if record["state"] == "done"}
+    if done_links:
+        print(f"Resuming: {len(done_links)} links already done.")
+    remaining = [link for link in links if link not in done_links]
+
+    journal = BatchJournal(journal_file, resume=resume) if journal_file else None
+    if journal:
+        for link in remaining:
+            if link not in resume_items:
+                journal.record(link, "queued")
+
+    if extract_audio:
+        os.makedirs(output_dir, exist_ok=True)  # The planner watches its free space from the start
+
+    scheduler = StageScheduler(stages=stages, max_workers=max_workers)
+    prefetcher = MetadataPrefetcher(
+        remaining, scheduler, window=prefetch, journal=journal, resume_items=resume_items, audio_only=audio_only
+    )
+    planner = BatchPlanner(
+        policy, directories=(os.getcwd(), output_dir), kinds=("audio",) if audio_only else ("video", "audio"),
+        extract_audio=extract_audio,
+    )
+
+    def finish(item, state):
+        """Record an item's final state in the journal."""
+        LINKS_PROCESSED.inc(result=state)
+        if journal:
+            journal.record(item["link"], state)
+
+    def extract(item):
+        """Stream an item's audio unless an earlier run already encoded it."""
+        output_file = resume_items.get(item["link"], {}).get("output_file")
+        if output_file and os.path.exists(output_file):
+            with print_lock:
+                print(f"Saved: {output_file} (earlier run)")
+            return True
+        return extract_item_audio(
+            item, output_dir, journal, loudness_cache, split_chapters, artwork_cache, output_store
+        )
+
+    succeeded = len(done_links)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            succeeded += process_items(
+                pool, workers, prefetcher, planner, chains, extract if extract_audio else None, finish
+            )
+        except KeyboardInterrupt:
+            prefetcher.cancel()
+            print("Batch aborted.")
+            return False
+        finally:
+            if journal:
+                journal.close()
+
+    print(f"Batch finished: {succeeded} of {len(links)} links processed.")
+    return succeeded == len(links)
@@ -0,0 +1,390 @@
+import sys
+import os
+import json
+import time
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import tracing
+from bandwidth_selection import load_budget_settings, select_by_bandwidth
+from video_format_ids import (
+    RES_LANDSCAPE_FILE,
+    RES_PORTRAIT_FILE,
+    VIDEO_CODEC_FILE,
+    determine_orientation,
+    load_prioritized_data,
+    normalize_codec,
+    select_video_format_id,
+)
+from audio_format_ids import AUDIO_CODEC_FILE, AUDIO_FORMAT_NOTES_FILE, select_audio_format_id
+from metrics import CACHE_HITS, CACHE_MISSES, write_textfile
+
+DEFAULT_RESULTS_FILE = "reselect_results.jsonl"
+CHUNK_SIZE = 64  # Documents handed to a worker process at a time
+
+trace = tracing.get_tracer("bulk_reselect")
+
+# Ladders loaded once per worker process
+_ladders = None
+
+
+def load_ladders():
+    """Load the current `@`/`#` ladders and bandwidth settings from docs/."""
+    return {
+        "Landscape": load_prioritized_data(RES_LANDSCAPE_FILE),
+        "Portrait": load_prioritized_data(RES_PORTRAIT_FILE),
+        "video_codecs": load_prioritized_data(VIDEO_CODEC_FILE),
+        "audio_codecs": load_prioritized_data(AUDIO_CODEC_FILE),
+        "audio_notes": load_prioritized_data(AUDIO_FORMAT_NOTES_FILE),
+        "bandwidth": load_budget_settings(),
+    }
+
+def select_video(metadata, ladders):
+    """Return the video ID video_format_ids would print, or None without a priority resolution."""
+    video = select_by_bandwidth(metadata, "video", ladders["bandwidth"])
+    if video:
+        return video
+
+    orientation = determine_orientation(metadata)
+    primary_res, secondary_res = ladders[orientation]
+    if not primary_res:
+        return None
+    width, height = map(int, primary_res.split("x"))
+    return select_video_format_id(
+        metadata, width, height, *ladders["video_codecs"], secondary_res, orientation
+    ) or "bv"
+
+def select_audio(metadata, ladders):
+    """Return the audio ID audio_format_ids would print, or None without a priority codec."""
+    audio = select_by_bandwidth(metadata, "audio", ladders["bandwidth"])
+    if audio:
+        return audio
+
+    if not ladders["audio_codecs"][0]:
+        return None
+    return select_audio_format_id(metadata, *ladders["audio_codecs"], *ladders["audio_notes"]) or "av"
+
+def select_formats(metadata, ladders):
+    """Select the video and audio IDs the format ID stages would print for a document."""
+    selection = {"id": metadata.get("id")}
+
+    selection["video"] = select_video(metadata, ladders)
+    if selection["video"] is None:
+        selection["error"] = "No priority resolution found."
+
+    selection["audio"] = select_audio(metadata, ladders)
+    if selection["audio"] is None:
+        selection["error"] = "No priority codec found."
+
+    return selection
+
+def selection_dependencies(metadata):
+    """Record the values in a document whose ladder position can change its selection."""
+    video_codecs, audio_codecs, audio_notes = set(), set(), set()
+
+    for fmt in metadata.get("formats", []):
+        if fmt.get("vcodec") != "none":
+            video_codecs.add(normalize_codec(fmt.get("vcodec") or ""))
+        if fmt.get("acodec") != "none":
+            audio_codecs.add(fmt.get("acodec"))  # Compared unnormalized by audio_format_ids
+            audio_notes.add(fmt.get("format_note"))
+
+    def ordered(values):
+        return sorted(values, key=lambda value: (value is None, value or ""))
+
+    return {
+        "orientation": determine_orientation(metadata),
+        "video_codecs": ordered(video_codecs),
+        "audio_codecs": ordered(audio_codecs),
+        "audio_notes": ordered(audio_notes),
+    }
+
+def init_worker(ladders):
+    """Keep the ladders in the worker process so they are not sent with every document."""
+    global _ladders
+    _ladders = ladders
+
+def load_document(path):
+    """Return (metadata, None), or (None, error record) if the document cannot be used."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+    except Exception as e:
+        return None, {"path": path, "error": f"Failed to read JSON file. {e}"}
+
+    if "formats" not in metadata:
+        return None, {"path": path, "error": "'formats' data missing in JSON file."}
+
+    return metadata, None
+
+def selection_record(path, metadata, selection):
+    return {
+        "path": path,
+        "mtime": os.path.getmtime(path),
+        **selection,
+        "depends": selection_dependencies(metadata),
+    }
+
+def reselect_document(path):
+    """Load one metadata document and select its formats.
+
+    A document the selectors fail on gets an error record, so it does not end the run.
+    """
+    metadata, error = load_document(path)
+    if error:
+        return error
+    try:
+        return selection_record(path, metadata, select_formats(metadata, _ladders))
+    except Exception as e:
+        return {"path": path, "error": f"Failed to select formats. {type(e).__name__}: {e}"}
+
+def find_documents(paths):
+    """Collect JSON files from the given files and directories, recursively."""
+    documents = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                documents += [os.path.join(root, name) for name in files if name.lower().endswith(".json")]
+        elif path.lower().endswith(".json") and os.path.exists(path):
+            documents.append(path)
+        else:
+            print(f"Warning: Skipping '{path}' (not a JSON file or directory).")
+
+    return sorted(documents)
+
+def ladders_path(results_file):
+    """Return the file holding the ladders a results file was computed with."""
+    return f"{results_file}.ladders.json"
+
+def save_ladders(results_file, ladders):
+    with open(ladders_path(results_file), "w", encoding="utf-8") as file:
+        json.dump(ladders, file)
+
+def load_previous(results_file):
+    """Load the stored records by path and the ladders they were computed with."""
+    if not os.path.exists(results_file) or not os.path.exists(ladders_path(results_file)):
+        return {}, None
+
+    with open(ladders_path(results_file), "r", encoding="utf-8") as file:
+        ladders = json.load(file)
+
+    records = {}
+    if results_file.lower().endswith((".db", ".sqlite")):
+        connection = sqlite3.connect(results_file)
+        for (record,) in connection.execute("SELECT record FROM selections"):
+            record = json.loads(record)
+            records[record["path"]] = record
+        connection.close()
+    else:
+        with open(results_file, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["path"]] = record
+
+    return records, ladders
+
+def ladder_roles(pair):
+    """Map each ladder value to its role: primary or secondary."""
+    primary, secondary = pair
+    roles = {secondary: "secondary"} if secondary is not None else {}
+    if primary is not None:
+        roles[primary] = "primary"
+    return roles
+
+def changed_values(old_pair, new_pair):
+    """Return the values whose role differs between two ladders."""
+    old_roles, new_roles = ladder_roles(old_pair), ladder_roles(new_pair)
+    changed = {value for value in old_roles.keys() | new_roles.keys() if old_roles.get(value) != new_roles.get(value)}
+    # A missing primary or secondary matches formats without the field, so it counts as a value too
+    if (old_pair[0] is None) != (new_pair[0] is None) or (old_pair[1] is None) != (new_pair[1] is None):
+        changed.add(None)
+    return changed
+
+def build_reverse_index(records):
+    """Map (dependency, value) to the paths of the records that contain it."""
+    index = {}
+    for path, record in records.items():
+        depends = record.get("depends")
+        if not depends:
+            continue
+        index.setdefault(("orientation", depends["orientation"]), set()).add(path)
+        for key in ("video_codecs", "audio_codecs", "audio_notes"):
+            for value in depends[key]:
+                index.setdefault((key, value), set()).add(path)
+    return index
+
+def affected_paths(records, old_ladders, new_ladders):
+    """Return the stored paths whose selection could change between two sets of ladders."""
+    if old_ladders.get("bandwidth") != new_ladders.get("bandwidth"):
+        return set(records)  # Bandwidth selection can pick any format
+
+    # Records without dependencies (older results or errors) are always recomputed
+    affected = {path for path, record in records.items() if not record.get("depends")}
+    index = build_reverse_index(records)
+
+    # Resolution matching is by width or height and falls back to the nearest size,
+    # so a resolution change affects every video of that orientation
+    for orientation in ("Landscape", "Portrait"):
+        if list(old_ladders[orientation]) != list(new_ladders[orientation]):
+            affected |= index.get(("orientation", orientation), set())
+
+    for key in ("video_codecs", "audio_codecs", "audio_notes"):
+        old_pair, new_pair = tuple(old_ladders[key]), tuple(new_ladders[key])
+        if old_pair == new_pair:
+            continue
+        if key == "audio_codecs" and (old_pair[0] is None or new_pair[0] is None):
+            return set(records)  # Selection turns on or off for every record
+        for value in changed_values(old_pair, new_pair):
+            affected |= index.get((key, value), set())
+
+    return affected
+
+class ResultSink:
+    """Write selection records to a JSONL file, or to SQLite for .db/.sqlite paths."""
+
+    def __init__(self, path):
+        self.path = path
+        self.is_sqlite = path.lower().endswith((".db", ".sqlite"))
+        if self.is_sqlite:
+            self._connection = sqlite3.connect(path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS selections "
+                "(path TEXT PRIMARY KEY, video_id TEXT, video TEXT, audio TEXT, record TEXT)"
+            )
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, record):
+        if self.is_sqlite:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO selections VALUES (?, ?, ?, ?, ?)",
+                (record["path"], record.get("id"), record.get("video"), record.get("audio"), json.dumps(record)),
+            )
+        else:
+            self._file.write(json.dumps(record) + "\n")
+
+    def remove(self, path):
+        """Drop the record of a document that no longer exists."""
+        if self.is_sqlite:
+            self._connection.execute("DELETE FROM selections WHERE path = ?", (path,))
+
+    def close(self):
+        if self.is_sqlite:
+            self._connection.commit()
+            self._connection.close()
+        else:
+            self._file.close()
+
+def reselect(documents, results_file, workers=None, kept_records=(), removed_paths=()):
+    """Select formats for every document on a process pool; returns (count, errors, seconds).
+
+    kept_records are earlier results that are still valid and are written back unchanged;
+    removed_paths are documents whose records are dropped.
+    """
+    ladders = load_ladders()
+    trace.debug("Loaded ladders: %s", ladders)
+
+    sink = ResultSink(results_file)
+    errors = 0
+    started = time.perf_counter()
+
+    try:
+        if not sink.is_sqlite:
+            for record in kept_records:
+                sink.write(record)  # The JSONL file is rewritten as a whole
+        for path in removed_paths:
+            sink.remove(path)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(ladders,)) as pool:
+            for count, record in enumerate(pool.map(reselect_document, documents, chunksize=CHUNK_SIZE), 1):
+                sink.write(record)
+                if "error" in record:
+                    errors += 1
+                if count % 1000 == 0:
+                    trace.debug("%s documents, %.1f docs/s", count, count / (time.perf_counter() - started))
+    finally:
+        sink.close()
+
+    save_ladders(results_file, ladders)
+    return len(documents), errors, time.perf_counter() - started
+
+def plan_incremental(documents, results_file):
+    """Split documents into those to recompute, stored records that are still valid and removed paths."""
+    records, old_ladders = load_previous(results_file)
+    if old_ladders is None:
+        print("No earlier results with stored ladders; re-selecting everything.")
+        return documents, [], []
+
+    # Documents named on the command line that have no record yet are new
+    new_documents = [path for path in documents if path not in records]
+
+    affected = affected_paths(records, old_ladders, load_ladders())
+    for path, record in records.items():
+        # Edited or removed documents are recomputed (and dropped if gone)
+        if not os.path.exists(path) or os.path.getmtime(path) != record.get("mtime"):
+            affected.add(path)
+
+    recompute = sorted(path for path in affected if os.path.exists(path)) + new_documents
+    removed = sorted(path for path in affected if not os.path.exists(path))
+    kept = [record for path, record in records.items() if path not in affected]
+    CACHE_HITS.inc(len(kept), cache="reselect")
+    CACHE_MISSES.inc(len(recompute), cache="reselect")
+    print(f"Incremental: {len(recompute)} to recompute, {len(kept)} unchanged, {len(removed)} removed.")
+    return recompute, kept, removed
+
+def main():
+    """Re-select formats for a corpus of saved metadata."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    results_file = DEFAULT_RESULTS_FILE
+    workers = None
+    metrics_file = None
+    for flag in ("-o", "-j", "--metrics-file"):
+        if flag in args:
+            index = args.index(flag)
+            if index + 1 >= len(args):
+                print(f"Error: {flag} requires a value.")
+                sys.exit(1)
+            value = args[index + 1]
+            del args[index:index + 2]
+            if flag == "-o":
+                results_file = value
+            elif flag == "-j":
+                workers = int(value)
+            else:
+                metrics_file = value
+
+    # Only recompute what a preference change can affect
+    incremental = "--incremental" in args
+    if incremental:
+        args.remove("--incremental")
+
+    if not args and not incremental:
+        print("Error: Usage: bulk_reselect.py <directory or JSON files> [-o results.jsonl|.db] "
+              "[-j workers] [--incremental] [--metrics-file <file>]")
+        sys.exit(1)
+
+    documents = find_documents(args)
+    if not documents and not incremental:
+        print("Error: No JSON files found.")
+        sys.exit(1)
+
+    kept, removed = [], []
+    if incremental:
+        documents, kept, removed = plan_incremental(documents, results_file)
+
+    count, errors, seconds = reselect(documents, results_file, workers, kept, removed)
+    rate = count / seconds if seconds else float("inf")
+    print(f"Re-selected {count} documents ({errors} errors) in {seconds:.2f}s: {rate:.1f} docs/s")
+    print(f"Results written to {results_file}")
+
+    if metrics_file:
+        write_textfile(metrics_file)  # Nightly runs leave their cache hit rate for the textfile collector
+
+if __name__ == "__main__":
+    tracing.run_main(main)
@@ -0,0 +1,171 @@
+import sys
+import os
+import json
+import time
+import shutil
+
+import tracing
+import loudness
+from audio_stream import (
+    MP3_OPTIONS,
+    cover_mapping,
+    cover_options,
+    download_command,
+    ffmpeg_command,
+    measure_loudness,
+    metadata_tags,
+    output_name,
+    run_pipe,
+    safe_name,
+)
+from metrics import ENCODE_SECONDS
+
+trace = tracing.get_tracer("chapter_split")
+
+def load_chapters(metadata):
+    """Return the chapters as (start, end, title) in seconds, skipping empty ones.
+
+    The end of the last chapter may be None, meaning the end of the audio.
+    """
+    chapters = []
+    duration = metadata.get("duration")
+
+    for chapter in metadata.get("chapters") or []:
+        start = chapter.get("start_time") or 0
+        end = chapter.get("end_time")
+        if duration and end is not None and end >= duration:
+            end = None  # Let the last track run to the real end of the stream
+        if end is not None and end <= start:
+            continue
+        chapters.append((float(start), None if end is None else float(end), chapter.get("title")))
+
+    trace.debug("Loaded %s chapters", len(chapters))
+    return chapters
+
+def track_filename(index, count, title):
+    """Number the tracks so they sort in order."""
+    width = max(2, len(str(count)))
+    return f"{index:0{width}d} - {safe_name(title, f'Track {index}')}.mp3"
+
+def split_graph(chapters, pre_filter=None):
+    """Filter graph decoding the input once and cutting one output per chapter."""
+    source = f"[0:a]{pre_filter}," if pre_filter else "[0:a]"
+    parts = [f"{source}asplit={len(chapters)}" + "".join(f"[s{i}]" for i in range(len(chapters)))]
+
+    for i, (start, end, _) in enumerate(chapters):
+        trim = f"start={start:.3f}" + (f":end={end:.3f}" if end is not None else "")
+        parts.append(f"[s{i}]atrim={trim},asetpts=PTS-STARTPTS[t{i}]")
+    return ";".join(parts)
+
+def split_audio(metadata_file, metadata, format_id, output_dir=".", journal=None, link=None,
+                loudness_cache=None, artwork_cache=None, chapters=None, cover=None):
+    """Stream the selected audio format into one mp3 per chapter with a single ffmpeg run.
+
+    The tracks go into a directory named after the upload. Returns the
+    directory and None on success, or None and the error output.
+    """
+    chapters = chapters if chapters is not None else load_chapters(metadata)
+    album = metadata.get("album") or metadata.get("title")
+    track_dir = os.path.join(output_dir, output_name(metadata))
+    partial_dir = f"{track_dir}.part"
+
+    pre_filter = None
+    if loudness_cache is not None:
+        measured, error = measure_loudness(metadata_file, metadata, format_id, loudness_cache)
+        if measured is None:
+            return None, error
+        pre_filter = loudness.normalization_filter(measured)
+
+    # Every track shares one cover input
+    if cover is None and artwork_cache is not None:
+        cover = artwork_cache.cover_for(metadata)
+    encode_command = ffmpeg_command() + [
+        "-hide_banner", "-loglevel", "error", "-y", "-i", "pipe:0",
+    ] + cover_options(cover) + ["-filter_complex", split_graph(chapters, pre_filter)]
+    for i, (_, _, title) in enumerate(chapters):
+        number = i + 1
+        encode_command += ["-map", f"[t{i}]"] + MP3_OPTIONS + cover_mapping(cover) + metadata_tags(
+            metadata, title=title or f"Track {number}", album=album, track=f"{number}/{len(chapters)}",
+        ) + ["-f", "mp3", os.path.join(partial_dir, track_filename(number, len(chapters), title))]
+
+    shutil.rmtree(partial_dir, ignore_errors=True)  # Left over from an interrupted split
+    os.makedirs(partial_dir)
+    started = time.perf_counter()
+    result = run_pipe(download_command(metadata_file, format_id), encode_command)
+
+    if result["download_returncode"] == 0 and not result["timed_out"] and journal:
+        journal.record(link, "downloaded", bytes=result["bytes"])
+
+    if not result["ok"]:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        return None, result["error"] or "Error: Streaming stopped before the audio was complete."
+
+    ENCODE_SECONDS.observe(time.perf_counter() - started)
+    shutil.rmtree(track_dir, ignore_errors=True)  # Tracks of an earlier split are replaced as a whole
+    os.replace(partial_dir, track_dir)
+
+    if journal:
+        journal.record(link, "encoded", output_file=track_dir, tracks=len(chapters))
+    trace.debug("Split %s bytes into %s tracks in %s", result["bytes"], len(chapters), track_dir)
+    return track_dir, None
+
+def validate_input():
+    """Validate command-line arguments and check if debug mode is enabled."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    output_dir = "."
+    if "-o" in args:
+        index = args.index("-o")
+        if index + 1 >= len(args):
+            print("Error: -o requires a directory argument.")
+            sys.exit(1)
+        output_dir = args[index + 1]
+        del args[index:index + 2]
+
+    normalize = "-n" in args
+    if normalize:
+        args.remove("-n")
+
+    if len(args) < 2:
+        print("Error: Usage: chapter_split.py <metadata file> <audio format ID> [-o <output directory>] [-n]")
+        sys.exit(1)
+
+    json_file, format_id = args[0], args[1]
+    if not os.path.exists(json_file):
+        print(f"Error: File '{json_file}' not found.")
+        sys.exit(1)
+
+    if not json_file.lower().endswith(".json"):
+        print(f"Error: File '{json_file}' is not a JSON file.")
+        sys.exit(1)
+
+    return json_file, format_id, output_dir, normalize
+
+def main():
+    """Main execution."""
+    json_file, format_id, output_dir, normalize = validate_input()
+    try:
+        with open(json_file, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+    except Exception as e:
+        print(f"Error: Failed to read JSON file. {e}")
+        sys.exit(1)
+
+    chapters = load_chapters(metadata)
+    if not chapters:
+        print("Error: The metadata has no chapters.")
+        sys.exit(1)
+
+    cache = loudness.LoudnessCache() if normalize else None
+    track_dir, error = split_audio(json_file, metadata, format_id, output_dir, loudness_cache=cache, chapters=chapters)
+    if track_dir is None:
+        print("Error: Failed to split the audio.")
+        print(error)
+        sys.exit(1)
+    print(f"Saved {len(chapters)} tracks in: {track_dir}")
+
+if __name__ == "__main__":
+    tracing.run_main(main)
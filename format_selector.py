@@ -0,0 +1,195 @@
+import sys
+import os
+import json
+
+import tracing
+from bandwidth_selection import load_budget_settings, select_by_bandwidth
+from video_format_ids import (
+    RES_LANDSCAPE_FILE,
+    RES_PORTRAIT_FILE,
+    VIDEO_CODEC_FILE,
+    build_resolution_index,
+    determine_orientation,
+    load_prioritized_data,
+    normalize_codec,
+    select_video_format_id,
+)
+from audio_format_ids import AUDIO_CODEC_FILE, AUDIO_FORMAT_NOTES_FILE, select_audio_format_id
+
+# yt-dlp filters matching each normalized codec
+VIDEO_CODEC_FILTERS = {
+    "vp09": "vcodec~='^vp0?9'",
+    "avc1": "vcodec^=avc1",
+    "av01": "vcodec^=av01",
+}
+AUDIO_CODEC_FILTERS = {
+    "mp4a": "acodec^=mp4a",
+    "opus": "acodec^=opus",
+}
+
+trace = tracing.get_tracer("format_selector")
+
+def validate_input():
+    """Validate command-line arguments and check if debug mode is enabled."""
+    if "-d" in sys.argv:
+        tracing.enable_debug()
+        sys.argv.remove("-d")  # Remove debug flag from arguments
+
+    if len(sys.argv) < 2:
+        print("Error: No JSON file provided.")
+        sys.exit(1)
+
+    json_file = sys.argv[1]
+
+    if not os.path.exists(json_file):
+        print(f"Error: File '{json_file}' not found.")
+        sys.exit(1)
+
+    if not json_file.lower().endswith(".json"):
+        print(f"Error: File '{json_file}' is not a JSON file.")
+        sys.exit(1)
+
+    trace.debug("Validated input file: %s", json_file)
+    return json_file
+
+def unique(entries):
+    """Drop empty and repeated entries while keeping the order."""
+    seen = set()
+    result = []
+    for entry in entries:
+        if entry and entry not in seen:
+            seen.add(entry)
+            result.append(entry)
+    return result
+
+def codec_filter(codec, filters, field):
+    """Return the yt-dlp filter for a normalized codec."""
+    return filters.get(codec, f"{field}^={codec}")
+
+def order_by_codec(formats, primary_codec, secondary_codec, field="vcodec"):
+    """Order formats primary codec first, then secondary codec, then the rest."""
+    def codec_rank(fmt):
+        codec = fmt.get(field) or ""
+        codec = normalize_codec(codec) if field == "vcodec" else codec
+        if codec == primary_codec:
+            return 0
+        if codec == secondary_codec:
+            return 1
+        return 2
+
+    return sorted(formats, key=codec_rank)  # Stable, keeps the original order per rank
+
+def video_ladder(metadata, primary_res, secondary_res, primary_codec, secondary_codec, orientation):
+    """Build the video fallback chain, best choice first."""
+    ladder = [select_by_bandwidth(metadata, "video", load_budget_settings())]
+
+    if primary_res:
+        width, height = map(int, primary_res.split("x"))
+        ladder.append(select_video_format_id(
+            metadata, width, height, primary_codec, secondary_codec, secondary_res, orientation
+        ))
+
+        # Every exact resolution match, then smaller resolutions down to the secondary one
+        exact = [
+            fmt for fmt in metadata.get("formats", [])
+            if fmt.get("vcodec") != "none" and (fmt.get("width") == width or fmt.get("height") == height)
+        ]
+        ladder += [fmt.get("format_id") for fmt in order_by_codec(exact, primary_codec, secondary_codec)]
+
+        floor = 0
+        if secondary_res:
+            secondary_width, secondary_height = map(int, secondary_res.split("x"))
+            floor = secondary_width * secondary_height
+        smaller = [
+            fmt for pixels, fmt in reversed(build_resolution_index(metadata, orientation))
+            if floor <= pixels <= width * height
+        ]
+        ladder += [fmt.get("format_id") for fmt in order_by_codec(smaller, primary_codec, secondary_codec)]
+
+        # Let yt-dlp resolve the same preferences against fresh format lists
+        bounds = f"[width<={width}][height<={height}]"
+        if secondary_res:
+            bounds += f"[width>={secondary_width}][height>={secondary_height}]"
+        for codec in (primary_codec, secondary_codec):
+            if codec:
+                ladder.append(f"bv{bounds}[{codec_filter(codec, VIDEO_CODEC_FILTERS, 'vcodec')}]")
+        ladder.append(f"bv{bounds}")
+
+    ladder.append("bv")
+    return unique(ladder)
+
+def audio_ladder(metadata, primary_codec, secondary_codec, primary_note, secondary_note):
+    """Build the audio fallback chain, best choice first."""
+    ladder = [
+        select_by_bandwidth(metadata, "audio", load_budget_settings()),
+        select_audio_format_id(metadata, primary_codec, secondary_codec, primary_note, secondary_note),
+    ]
+
+    # The remaining matches in the order of the priority rungs
+    audio_formats = [fmt for fmt in metadata.get("formats", []) if fmt.get("acodec") != "none"]
+    rungs = [
+        (primary_codec, primary_note),
+        (primary_codec, secondary_note),
+        (primary_codec, None),
+        (secondary_codec, primary_note),
+        (secondary_codec, secondary_note),
+        (secondary_codec, None),
+    ]
+    for codec, note in rungs:
+        if not codec:
+            continue
+        ladder += [
+            fmt.get("format_id") for fmt in audio_formats
+            if fmt.get("acodec") == codec and (note is None or fmt.get("format_note") == note)
+        ]
+
+    for codec in (primary_codec, secondary_codec):
+        if codec:
+            ladder.append(f"ba[{codec_filter(codec, AUDIO_CODEC_FILTERS, 'acodec')}]")
+
+    ladder.append("ba")
+    return unique(ladder)
+
+def build_selectors(metadata):
+    """Compile the `@`/`#` entries and matched IDs into video and audio selectors."""
+    orientation = determine_orientation(metadata)
+    res_file = RES_LANDSCAPE_FILE if orientation == "Landscape" else RES_PORTRAIT_FILE
+    primary_res, secondary_res = load_prioritized_data(res_file)
+    primary_video_codec, secondary_video_codec = load_prioritized_data(VIDEO_CODEC_FILE)
+    primary_audio_codec, secondary_audio_codec = load_prioritized_data(AUDIO_CODEC_FILE)
+    primary_note, secondary_note = load_prioritized_data(AUDIO_FORMAT_NOTES_FILE)
+
+    video = video_ladder(
+        metadata, primary_res, secondary_res, primary_video_codec, secondary_video_codec, orientation
+    )
+    audio = audio_ladder(
+        metadata, primary_audio_codec, secondary_audio_codec, primary_note, secondary_note
+    )
+
+    trace.debug("Video ladder: %s", video)
+    trace.debug("Audio ladder: %s", audio)
+    return "/".join(video), "/".join(audio)
+
+def process_format_selector(json_file):
+    """Print a single yt-dlp format selector with the full fallback chain."""
+    try:
+        with open(json_file, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+    except Exception as e:
+        print(f"Error: Failed to read JSON file. {e}")
+        sys.exit(1)
+
+    if "formats" not in metadata:
+        print("Error: 'formats' data missing in JSON file.")
+        sys.exit(1)
+
+    video_selector, audio_selector = build_selectors(metadata)
+    print(f"({video_selector})+({audio_selector})")
+
+def main():
+    """Main execution."""
+    json_file = validate_input()
+    process_format_selector(json_file)
+
+if __name__ == "__main__":
+    tracing.run_main(main)
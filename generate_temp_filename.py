@@ -2,14 +2,23 @@ import time
 import os
 
 def generate_unique_filename():
-    """Generate a unique temporary filename based on system time in milliseconds."""
+    """Generate and create a unique temporary file named after the system time in milliseconds.
+
+    The file is created with O_EXCL, so callers running at the same time
+    never get the same name.
+    """
     while True:
         timestamp = str(int(time.time() * 1000))[-8:]  # Get last 8 digits of milliseconds
         filename = f".{timestamp}.json"
 
-        if not os.path.exists(filename):
-            return filename  # Return the unique filename
+        try:
+            os.close(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            return filename  # Reserved for this caller
+        except FileExistsError:
+            time.sleep(0.001)  # Taken; try the next millisecond
 
 # If executed directly, print the generated filename for testing
 if __name__ == "__main__":
-    print(generate_unique_filename())
+    filename = generate_unique_filename()
+    os.remove(filename)
+    print(filename)
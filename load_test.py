@@ -0,0 +1,539 @@
+import sys
+import os
+import io
+import json
+import math
+import time
+import wave
+import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tracing
+from metadata_fetch import YTDLP_COMMAND_ENV
+from metrics import SPOOL_ENV
+
+# Settings of the yt-dlp stand-in, passed to it through the environment
+FAKE_LATENCY_ENV = "YTM_FAKE_LATENCY"
+FAKE_ERROR_RATE_ENV = "YTM_FAKE_ERROR_RATE"
+FAKE_MEDIA_ENV = "YTM_FAKE_MEDIA_URL"
+
+DEFAULT_LINKS = 50
+DEFAULT_RATE = 2.0  # Links started per second in one-shot mode
+DEFAULT_CONCURRENCY = 4
+DEFAULT_LATENCY = 0.5  # Seconds a metadata fetch takes, on average
+DEFAULT_ERROR_RATE = 0.0
+
+SAMPLE_INTERVAL = 1.0  # Seconds between CPU/RSS samples
+MEDIA_SECONDS = 5  # Length of the silent audio served for every format
+PERCENTILES = (50, 95, 99)
+
+# Files the pipeline needs in its working directory; executables/ gets stand-ins instead
+WORKDIR_FOLDERS = ("docs",)
+
+# Priority markers seeded in the working directory; the user sets these, so they are untracked
+MARKER_FILES = {
+    "docs/video_resolutions_landscape.txt": ("@1280x720", "#854x480"),
+    "docs/video_resolutions_portrait.txt": ("@720x1280", "#480x854"),
+    "docs/video_codecs.txt": ("@vp09", "#avc1"),
+}
+
+# Installed as executables/yt-dlp, where requirements.py and the default command look for it
+YTDLP_STAND_IN = """import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from load_test import fake_ytdlp
+
+fake_ytdlp(sys.argv[1:])
+"""
+
+# Installed as executables/ffmpeg when no ffmpeg is found; only --extract needs a real one
+FFMPEG_STAND_IN = """#!/bin/sh
+echo "ffmpeg is not installed; the load test only needs it for --extract." >&2
+exit 1
+"""
+
+AUDIO_FORMATS = (
+    ("139", "m4a", "mp4a.40.5", "low", 48),
+    ("140", "m4a", "mp4a.40.2", "medium", 129),
+    ("249", "webm", "opus", "low", 50),
+    ("250", "webm", "opus", "low", 70),
+    ("251", "webm", "opus", "medium", 135),
+)
+VIDEO_CODECS = (("avc1.4d401e", "mp4"), ("vp09.00.40.08", "webm"), ("av01.0.08M.08", "mp4"))
+VIDEO_SIZES = ((256, 144), (426, 240), (640, 360), (854, 480), (1280, 720), (1920, 1080))
+
+trace = tracing.get_tracer("load_test")
+
+# --- yt-dlp stand-in ---------------------------------------------------------
+
+def synthetic_metadata(link, media_url):
+    """yt-dlp style metadata for a link, the same every time for the same link."""
+    video_id = hashlib.sha1(link.encode("utf-8")).hexdigest()[:11]
+    rng = random.Random(video_id)
+    duration = rng.randint(120, 600)
+    portrait = rng.random() < 0.2
+
+    def entry(format_id, ext, acodec, vcodec, tbr, note, width=None, height=None):
+        return {
+            "format_id": format_id, "ext": ext, "acodec": acodec, "vcodec": vcodec,
+            "width": width, "height": height, "tbr": tbr, "format_note": note,
+            "filesize": int(tbr * 1000 / 8 * duration), "protocol": "https",
+            "url": f"{media_url}/media/{video_id}/{format_id}",
+        }
+
+    formats = [entry(*audio[:3], "none", audio[4], audio[3]) for audio in AUDIO_FORMATS]
+    format_number = 394
+    for width, height in VIDEO_SIZES:
+        if portrait:
+            width, height = height, width
+        for vcodec, ext in VIDEO_CODECS:
+            tbr = round(width * height / 1000 * rng.uniform(1.5, 3.0), 1)
+            formats.append(entry(str(format_number), ext, "none", vcodec, tbr, f"{min(width, height)}p", width, height))
+            format_number += 1
+
+    return {
+        "id": video_id,
+        "title": f"Load test {video_id}",
+        "uploader": "Load Test",
+        "duration": duration,
+        "webpage_url": link,
+        "formats": formats,
+    }
+
+def pick_format(metadata, selector):
+    """Resolve a format ID, or treat any selector as 'best audio'."""
+    formats = metadata.get("formats", [])
+    for fmt in formats:
+        if fmt.get("format_id") == selector:
+            return fmt
+    audio = [fmt for fmt in formats if fmt.get("acodec") not in (None, "none")]
+    return max(audio or formats, key=lambda fmt: fmt.get("tbr") or 0)
+
+def fake_ytdlp(args):
+    """Answer `-j <link>` and `--load-info-json <file> -f <id> -o -` like yt-dlp."""
+    if "-j" in args:
+        latency = float(os.environ.get(FAKE_LATENCY_ENV, DEFAULT_LATENCY))
+        time.sleep(latency * random.uniform(0.5, 1.5))
+        if random.random() < float(os.environ.get(FAKE_ERROR_RATE_ENV, DEFAULT_ERROR_RATE)):
+            sys.stderr.write("ERROR: [youtube] Video unavailable (simulated)\n")
+            sys.exit(1)
+        link = args[args.index("-j") + 1]
+        print(json.dumps(synthetic_metadata(link, os.environ.get(FAKE_MEDIA_ENV, ""))))
+        return
+
+    if "--load-info-json" in args:
+        with open(args[args.index("--load-info-json") + 1], "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+        selector = args[args.index("-f") + 1] if "-f" in args else "ba"
+        with urllib.request.urlopen(pick_format(metadata, selector)["url"], timeout=30) as response:
+            shutil.copyfileobj(response, sys.stdout.buffer)
+        return
+
+    sys.stderr.write("ERROR: The load test stand-in only supports -j and --load-info-json.\n")
+    sys.exit(2)
+
+# --- Local media server ------------------------------------------------------
+
+def silent_wav(seconds=MEDIA_SECONDS, rate=8000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(rate)
+        output.writeframes(b"\0\0" * rate * seconds)
+    return buffer.getvalue()
+
+class MediaHandler(BaseHTTPRequestHandler):
+    media = silent_wav()
+
+    def do_GET(self):
+        if not self.path.startswith("/media/"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(len(self.media)))
+        self.end_headers()
+        self.wfile.write(self.media)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_media():
+    """Serve dummy media from a background thread; returns the server and its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- Resource sampling -------------------------------------------------------
+
+def descendants(root_pid):
+    """Return the PIDs of every live process below root_pid (Linux only)."""
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue  # Exited while we looked
+        children.setdefault(int(fields[1]), []).append(int(name))
+
+    found, pending = [], [root_pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+def process_usage(pid):
+    """Return (CPU seconds, RSS bytes) of a process, or None once it has exited."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+class ResourceSampler:
+    """Sample the CPU use and memory of everything the load test started."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = []  # (seconds since start, CPU %, RSS bytes, processes)
+        self.supported = os.path.isdir("/proc") and hasattr(os, "sysconf")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_periodically, daemon=True)
+
+    def start(self):
+        if self.supported:
+            self._thread.start()
+        return self
+
+    def _cpu_seconds(self):
+        """CPU time of reaped children plus that of every live descendant."""
+        times = os.times()
+        total, rss, count = times.children_user + times.children_system, 0, 0
+        for pid in descendants(os.getpid()):
+            usage = process_usage(pid)
+            if usage:
+                total, rss, count = total + usage[0], rss + usage[1], count + 1
+        return total, rss, count
+
+    def _sample_periodically(self):
+        started = time.perf_counter()
+        previous_cpu, previous_time = self._cpu_seconds()[0], started
+        while not self._stop.wait(self.interval):
+            cpu, rss, count = self._cpu_seconds()
+            now = time.perf_counter()
+            percent = max(0.0, (cpu - previous_cpu) / (now - previous_time) * 100)
+            self.samples.append((round(now - started, 1), round(percent, 1), rss, count))
+            previous_cpu, previous_time = cpu, now
+
+    def stop(self):
+        self._stop.set()
+        if self.supported:
+            self._thread.join()
+
+# --- Load generation ---------------------------------------------------------
+
+def find_ffmpeg(source_dir):
+    """Return the ffmpeg the pipeline would use from source_dir, or None."""
+    program = os.path.join(source_dir, "executables", "ffmpeg")
+    return program if os.path.isfile(program) else shutil.which("ffmpeg")
+
+def write_file(path, content, mode=0o644):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.chmod(path, mode)
+
+def prepare_workdir(source_dir):
+    """Copy the pipeline into a scratch directory, so its views and files stay untouched.
+
+    The marker files and the programs requirements.py checks for are seeded, so
+    the run does not depend on the checkout's settings or on an installed yt-dlp.
+    """
+    workdir = tempfile.mkdtemp(prefix="ytm_load_")
+    for name in os.listdir(source_dir):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(source_dir, name), workdir)
+    for folder in WORKDIR_FOLDERS:
+        if os.path.isdir(os.path.join(source_dir, folder)):
+            shutil.copytree(os.path.join(source_dir, folder), os.path.join(workdir, folder))
+
+    for name, markers in MARKER_FILES.items():
+        write_file(os.path.join(workdir, name), "\n".join(markers) + "\n")
+
+    executables = os.path.join(workdir, "executables")
+    os.makedirs(executables, exist_ok=True)
+    write_file(os.path.join(executables, "yt-dlp"), YTDLP_STAND_IN, 0o755)
+
+    # requirements.py looks for ffmpeg on PATH, which the run puts executables/ first on
+    ffmpeg = find_ffmpeg(source_dir)
+    if ffmpeg:
+        os.symlink(os.path.abspath(ffmpeg), os.path.join(executables, "ffmpeg"))
+    else:
+        write_file(os.path.join(executables, "ffmpeg"), FFMPEG_STAND_IN, 0o755)
+    return workdir
+
+def failure_reason(stdout, stderr):
+    """Return the first error a failed run printed."""
+    for line in stdout.splitlines():
+        if line.startswith("Error:"):
+            return line.strip()
+    lines = stderr.strip().splitlines() or stdout.strip().splitlines()
+    return lines[-1].strip() if lines else "No output."
+
+def synthetic_links(count):
+    return [f"https://www.youtube.com/watch?v=load{index:07d}" for index in range(count)]
+
+def run_one_shot(links, workdir, env, rate, concurrency, extra_args):
+    """Start `main.py <link>` processes at a fixed rate, at most `concurrency` at a time."""
+    results = []
+    slots = threading.Semaphore(concurrency)
+    threads = []
+    lock = threading.Lock()
+
+    def run(link):
+        started = time.perf_counter()
+        try:
+            process = subprocess.run(
+                [sys.executable, "main.py", link] + extra_args, cwd=workdir, env=env,
+                capture_output=True, text=True,
+            )
+        finally:
+            slots.release()
+        with lock:
+            results.append({
+                "link": link, "seconds": time.perf_counter() - started, "ok": process.returncode == 0,
+                "error": None if process.returncode == 0 else failure_reason(process.stdout, process.stderr),
+            })
+
+    started = time.perf_counter()
+    for index, link in enumerate(links):
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        slots.acquire()
+        thread = threading.Thread(target=run, args=(link,))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+def batch_failure_reasons(output):
+    """Map each link of a batch's output to the first error printed for it."""
+    reasons, link = {}, None
+    for line in output.splitlines():
+        if line.startswith("Input Link: "):
+            link = line[len("Input Link: "):].strip()
+        elif line.startswith("Error:") and link and link not in reasons:
+            reasons[link] = line.strip()
+    return reasons
+
+def journal_latencies(path, reasons=None):
+    """Seconds from 'queued' to the final state of every link in a batch journal."""
+    reasons = reasons or {}
+    queued, finished = {}, {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record["state"] == "queued":
+                queued[record["link"]] = record["time"]
+            elif record["state"] in ("done", "failed"):
+                finished[record["link"]] = (record["time"], record["state"] == "done")
+
+    return [
+        {"link": link, "seconds": end - queued[link], "ok": ok,
+         "error": None if ok else reasons.get(link, "No error printed.")}
+        for link, (end, ok) in finished.items() if link in queued
+    ]
+
+def run_batch_mode(links, workdir, env, concurrency, extra_args):
+    """Run one `main.py -b` over all links with `concurrency` workers."""
+    links_file = os.path.join(workdir, "load_test_links.txt")
+    with open(links_file, "w", encoding="utf-8") as file:
+        file.write("\n".join(links) + "\n")
+
+    process = subprocess.run(
+        [sys.executable, "main.py", "-b", links_file, "-w", str(concurrency)] + extra_args,
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    trace.debug("Batch output:\n%s", process.stdout)
+    if not os.path.exists(f"{links_file}.journal"):
+        print(f"Error: The batch did not start. {failure_reason(process.stdout, process.stderr)}")
+        sys.exit(1)
+    return journal_latencies(f"{links_file}.journal", batch_failure_reasons(process.stdout))
+
+# --- Reporting -----------------------------------------------------------------
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+def spool_latencies(spool_path):
+    """Group the raw latency samples the pipeline spooled by stage."""
+    latencies = {}
+    if not os.path.exists(spool_path):
+        return latencies
+
+    with open(spool_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                name, key, value = json.loads(line)
+            except ValueError:
+                continue
+            if name == "ytm_stage_seconds":
+                latencies.setdefault(key[0], []).append(value)
+            elif name == "ytm_fetch_seconds":
+                latencies.setdefault("fetch_metadata", []).append(value)
+            elif name == "ytm_encode_seconds":
+                latencies.setdefault("stream_audio", []).append(value)
+    return latencies
+
+def build_report(mode, results, elapsed, latencies, sampler):
+    succeeded = sum(1 for result in results if result["ok"])
+    latencies = dict(latencies, link=[result["seconds"] for result in results])
+    failures = {}
+    for result in results:
+        if not result["ok"]:
+            failures[result["error"]] = failures.get(result["error"], 0) + 1
+    return {
+        "mode": mode,
+        "links": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "seconds": round(elapsed, 2),
+        "throughput": round(len(results) / elapsed, 3) if elapsed else 0,
+        "failures": dict(sorted(failures.items(), key=lambda entry: -entry[1])),
+        "latency": {
+            stage: {"count": len(values), **{f"p{p}": round(percentile(values, p), 3) for p in PERCENTILES}}
+            for stage, values in latencies.items() if values
+        },
+        "resources": [
+            {"time": t, "cpu_percent": cpu, "rss_mb": round(rss / 2**20, 1), "processes": count}
+            for t, cpu, rss, count in sampler.samples
+        ],
+    }
+
+def print_report(report):
+    print(f"Mode: {report['mode']}")
+    print(f"Links: {report['links']} ({report['succeeded']} ok, {report['failed']} failed) "
+          f"in {report['seconds']}s: {report['throughput']} links/s")
+
+    print(f"\n{'Stage':<20}{'count':>7}" + "".join(f"{f'p{p} (s)':>10}" for p in PERCENTILES))
+    for stage, values in sorted(report["latency"].items(), key=lambda entry: entry[0] == "link"):
+        name = "link (end to end)" if stage == "link" else stage
+        print(f"{name:<20}{values['count']:>7}" + "".join(f"{values[f'p{p}']:>10.3f}" for p in PERCENTILES))
+
+    if report["failures"]:
+        print(f"\n{'Links':>7}  Failure")
+        for reason, count in report["failures"].items():
+            print(f"{count:>7}  {reason}")
+
+    if report["resources"]:
+        print(f"\n{'Time (s)':>8}{'CPU %':>8}{'RSS (MB)':>10}{'Procs':>7}")
+        for sample in report["resources"]:
+            print(f"{sample['time']:>8}{sample['cpu_percent']:>8}{sample['rss_mb']:>10}{sample['processes']:>7}")
+    else:
+        print("\nCPU/RSS sampling needs /proc and is skipped on this system.")
+
+def get_option(args, flag, default, convert=str):
+    """Return the converted value following a flag, or the default."""
+    if flag not in args:
+        return default
+    index = args.index(flag)
+    try:
+        return convert(args[index + 1])
+    except (IndexError, ValueError):
+        print(f"Error: {flag} requires a value.")
+        sys.exit(1)
+
+def main():
+    """Drive the pipeline against local stand-ins and report its throughput and latency."""
+    args = sys.argv[1:]
+    if args[:1] == ["fake-yt-dlp"]:
+        fake_ytdlp(args[1:])
+        return
+
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    mode = get_option(args, "--mode", "oneshot")
+    if mode not in ("oneshot", "batch"):
+        print("Error: Usage: load_test.py [--mode oneshot|batch] [--links <n>] [--rate <links/s>] "
+              "[--concurrency <n>] [--latency <s>] [--error-rate <0-1>] [--extract] [--audio-only] "
+              "[--report <json file>] [--keep]")
+        sys.exit(1)
+
+    links = synthetic_links(get_option(args, "--links", DEFAULT_LINKS, int))
+    rate = get_option(args, "--rate", DEFAULT_RATE, float)
+    concurrency = get_option(args, "--concurrency", DEFAULT_CONCURRENCY, int)
+    extra_args = (["-x", "--no-artwork", "-o", "load_test_output"] if "--extract" in args else []) + (
+        ["-a"] if "--audio-only" in args else []
+    )
+
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    if "--extract" in args and not find_ffmpeg(source_dir):
+        print("Error: --extract needs ffmpeg in the 'executables' folder or on PATH.")
+        sys.exit(1)
+    workdir = prepare_workdir(source_dir)
+    server, media_url = serve_media()
+    spool_path = os.path.join(workdir, "load_test.spool")
+    env = dict(os.environ, **{
+        "PATH": os.path.join(workdir, "executables") + os.pathsep + os.environ.get("PATH", ""),
+        YTDLP_COMMAND_ENV: f'"{sys.executable}" "{os.path.join(workdir, "executables", "yt-dlp")}"',
+        FAKE_LATENCY_ENV: str(get_option(args, "--latency", DEFAULT_LATENCY, float)),
+        FAKE_ERROR_RATE_ENV: str(get_option(args, "--error-rate", DEFAULT_ERROR_RATE, float)),
+        FAKE_MEDIA_ENV: media_url,
+        SPOOL_ENV: spool_path,  # Every stage reports its raw timings here
+    })
+
+    try:
+        check = subprocess.run([sys.executable, "requirements.py"], cwd=workdir, env=env, capture_output=True, text=True)
+        if check.returncode != 0:
+            print(check.stdout)
+            sys.exit(1)
+
+        sampler = ResourceSampler().start()
+        started = time.perf_counter()
+        if mode == "oneshot":
+            results = run_one_shot(links, workdir, env, rate, concurrency, extra_args)
+        else:
+            results = run_batch_mode(links, workdir, env, concurrency, extra_args)
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+        report = build_report(mode, results, elapsed, spool_latencies(spool_path), sampler)
+        print_report(report)
+        if "--report" in args:
+            with open(get_option(args, "--report", None), "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+    finally:
+        server.shutdown()
+        if "--keep" in args:
+            print(f"Working directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    tracing.run_main(main)
@@ -0,0 +1,100 @@
+import json
+import time
+import sqlite3
+import threading
+
+import tracing
+
+DEFAULT_LOUDNESS_DB = "loudness_cache.db"
+
+# EBU R128 targets for the mp3 output
+TARGET_LOUDNESS = -14.0  # Integrated loudness, LUFS
+TARGET_TRUE_PEAK = -1.0  # dBTP
+TARGET_RANGE = 11.0  # Loudness range, LU
+
+# Values printed by loudnorm's analysis pass that the second pass takes back
+MEASURED_KEYS = ("input_i", "input_tp", "input_lra", "input_thresh", "target_offset")
+
+trace = tracing.get_tracer("loudness")
+
+def target_options():
+    return f"I={TARGET_LOUDNESS:g}:TP={TARGET_TRUE_PEAK:g}:LRA={TARGET_RANGE:g}"
+
+def analysis_filter():
+    """loudnorm filter for the measuring pass."""
+    return f"loudnorm={target_options()}:print_format=json"
+
+def normalization_filter(measured):
+    """loudnorm filter applying a stored measurement in a single, linear pass."""
+    return (
+        f"loudnorm={target_options()}"
+        f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+        f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+        f":offset={measured['target_offset']}:linear=true:print_format=none"
+    )
+
+def parse_measurement(output):
+    """Return the measurement loudnorm printed at the end of ffmpeg's stderr, or None."""
+    start, end = output.rfind("{"), output.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        values = json.loads(output[start:end + 1])
+    except ValueError:
+        return None
+
+    measured = {key: values.get(key) for key in MEASURED_KEYS}
+    if any(value is None for value in measured.values()):
+        return None
+    return measured
+
+class LoudnessCache:
+    """Loudness measurements keyed by video ID and audio format ID.
+
+    A format's audio never changes, so re-encodes, profile changes and retries
+    only need the second pass. The SQLite file can be shared by several workers.
+    """
+
+    def __init__(self, path=DEFAULT_LOUDNESS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS measurements (
+                video_id TEXT NOT NULL,
+                format_id TEXT NOT NULL,
+                target TEXT NOT NULL,
+                measured TEXT NOT NULL,
+                updated REAL,
+                PRIMARY KEY (video_id, format_id)
+            )
+        """)
+
+    def get(self, video_id, format_id):
+        """Return the stored measurement for the current targets, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT target, measured FROM measurements WHERE video_id = ? AND format_id = ?",
+                (video_id, format_id),
+            ).fetchone()
+        if row is None:
+            return None
+
+        measured = json.loads(row[1])
+        if row[0] != target_options():
+            # The input figures still hold; only the offset was computed for other targets
+            measured["target_offset"] = 0.0
+        return measured
+
+    def put(self, video_id, format_id, measured):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO measurements (video_id, format_id, target, measured, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (video_id, format_id, target_options(), json.dumps(measured), time.time()),
+            )
+        trace.debug("Stored loudness of %s/%s: %s", video_id, format_id, measured)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,15 +1,26 @@
-import subprocess
 import sys
 import os
 import json
 
-# Import the generate_unique_filename function
-from generate_temp_filename import generate_unique_filename
+import tracing
+from metadata_fetch import fetch_metadata_file
+from subprocess_watchdog import run_with_deadline, print_run_summary
+from stage_scheduler import STAGES, AUDIO_STAGES, SELECTOR_STAGE, PROFILES_STAGE, StageScheduler
+from batch_runner import BATCH_WORKERS, read_links, report_item, run_batch, save_audio
+from spool_watch import run_spool
+from audio_stream import selected_audio_format
+from loudness import LoudnessCache
+from artwork_cache import ArtworkCache
+from output_store import OutputStore
+from batch_planner import DEFAULT_POLICY, POLICIES
+from batch_journal import journal_path
+from metadata_prefetch import PREFETCH_WINDOW
+from metrics import TextfileWriter
 
 # Ensure requirements.py is executed before proceeding
 def check_requirements():
     """Run requirements.py and exit if any requirements are missing."""
-    result = subprocess.run([sys.executable, "requirements.py"], capture_output=True, text=True)
+    result = run_with_deadline([sys.executable, "requirements.py"], "requirements")
     
     if result.returncode != 0:
         print(result.stdout)  # Show missing requirements
@@ -29,51 +40,117 @@ def read_metadata_file(filename):
         print(f"Error: Failed to read JSON file '{filename}'. Reason: {e}")
         sys.exit(1)
 
-def fetch_metadata(link):
+def fetch_metadata(link, audio_only=False):
     """Fetch metadata using yt-dlp and save it as a JSON file."""
-    temp_filename = generate_unique_filename()
-    command = ["py", "./executables/yt-dlp", "-j", link]
-    result = subprocess.run(command, capture_output=True, text=True)
+    temp_filename, error = fetch_metadata_file(link, audio_only)
 
-    if result.returncode == 0:
-        with open(temp_filename, "w", encoding="utf-8") as file:
-            file.write(result.stdout)
+    if temp_filename:
         print(f"Metadata saved as: {temp_filename}")
         return temp_filename
     else:
         print("Error: Failed to retrieve metadata.")
-        print(result.stderr)
+        print(error)
         sys.exit(1)
 
-def run_script(script_name, json_file):
-    """Execute a Python script with the given JSON file."""
-    command = ["python", script_name, json_file]
-    # if DEBUG_MODE:
-    #     command.append("-d")  # Pass debug flag if enabled
+def get_number_option(args, short_flag, long_flag, default=None):
+    """Return the number given after a flag, or the default."""
+    for flag in (short_flag, long_flag):
+        if flag in args:
+            try:
+                return int(args[args.index(flag) + 1])
+            except (IndexError, ValueError):
+                print(f"Error: {flag} requires a number.")
+                sys.exit(1)
+    return default
 
-    # log_debug(f"Executing: {' '.join(command)}")
+def get_path_option(args, short_flag, long_flag, default=None):
+    """Return the path given after a flag, or the default."""
+    for flag in (short_flag, long_flag):
+        if flag in args:
+            index = args.index(flag)
+            if index + 1 >= len(args):
+                print(f"Error: {flag} requires a path.")
+                sys.exit(1)
+            return args[index + 1]
+    return default
 
-    result = subprocess.run(command, capture_output=True, text=True)
+def metadata_file_option(args):
+    """Return the metadata file given with -m/--metadata, or with the older -d/--debug <file>.
 
-    if result.returncode != 0:
-        print(f"Error: {script_name} failed.")
-        print(result.stderr)
-        sys.exit(1)
+    Also returns the flag that gave it, or None when no file was given.
+    """
+    for flag in ("-m", "--metadata"):
+        if flag in args:
+            index = args.index(flag)
+            if index + 1 >= len(args):
+                print(f"Error: Metadata flag ({flag}) requires a file argument.")
+                sys.exit(1)
+            return args[index + 1], flag
+
+    # -d used to take the metadata file; it now only turns on debug tracing
+    for flag in ("-d", "--debug"):
+        if flag in args:
+            index = args.index(flag)
+            if index + 1 < len(args) and is_json_file(args[index + 1]):
+                print(f"Note: {flag} <file> is deprecated; use -m/--metadata <file>.")
+                return args[index + 1], flag
+
+    return None, None
+
+def is_audio_only(args):
+    """Check for -a/--audio-only, which only runs the audio chain."""
+    return ("-a" in args or "--audio-only" in args) and not any(
+        flag in args for flag in ("-p", "--profiles", "-s", "--selector")
+    )
 
-    print(result.stdout.strip())
+def select_stages(args):
+    """Return the stages to run and the chains to print for the given flags."""
+    if "-p" in args or "--profiles" in args:
+        # Every profile in docs/profiles.ini is evaluated in one pass
+        return [PROFILES_STAGE], ("profiles",)
+    if "-s" in args or "--selector" in args:
+        # One yt-dlp selector with the full fallback chain instead of the IDs
+        return STAGES + [SELECTOR_STAGE], ("selector",)
+    if is_audio_only(args):
+        # Only the audio stages; the video files and IDs are left alone
+        return AUDIO_STAGES, ("audio",)
+    return STAGES, ("video", "audio")
 
 def main():
     """Main program execution."""
+    args = sys.argv[1:]
+    metadata_file, metadata_flag = metadata_file_option(args)
+
+    # Debug tracing for this process and every stage it starts, unless -d only gave the metadata file
+    if ("-d" in args or "--debug" in args) and metadata_flag not in ("-d", "--debug"):
+        tracing.enable_debug()
+
     # Run requirements check first
     check_requirements()
 
     # Check for arguments
     if len(sys.argv) < 2:
-        print("Error: No input provided. Usage: main.py <link> OR main.py -d <filename>")
+        print("Error: No input provided. Usage: main.py <link> OR main.py -m <metadata file> OR main.py -b <links file>")
         sys.exit(1)
 
-    args = sys.argv[1:]
-    metadata_file = None
+    stages, chains = select_stages(args)
+
+    # -x streams the selected audio straight into an mp3; only the mp3 is written
+    extract_audio = "-x" in args or "--extract-audio" in args
+    output_dir = get_path_option(args, "-o", "--output-dir", ".")
+
+    # -n normalizes the mp3's loudness; measurements are cached per video and format
+    loudness_cache = LoudnessCache() if extract_audio and ("-n" in args or "--normalize" in args) else None
+
+    # --split-chapters saves one mp3 per chapter when the upload has chapters
+    split_chapters = "--split-chapters" in args
+
+    # The thumbnail is embedded as the cover unless --no-artwork is given
+    artwork_cache = ArtworkCache() if extract_audio and "--no-artwork" not in args else None
+
+    # Outputs are kept once in a shared store and linked to every requested location
+    store_dir = get_path_option(args, "--store", "--output-store")
+    output_store = OutputStore(store_dir) if extract_audio and store_dir else None
 
     if "-h" in args or "--help" in args:
         # Display help file
@@ -85,22 +162,72 @@ def main():
             print("Error: Help file not found.")
         sys.exit(0)
 
-    if "-d" in args or "--debug" in args:
-        try:
-            debug_index = args.index("-d") if "-d" in args else args.index("--debug")
-            metadata_file = args[debug_index + 1]
+    # --spool keeps handling the link files dropped into a directory
+    spool_dir = get_path_option(args, "--spool", "--spool-dir")
+
+    if spool_dir or "-b" in args or "--batch" in args:
+        if not spool_dir:
+            try:
+                batch_index = args.index("-b") if "-b" in args else args.index("--batch")
+                links_file = args[batch_index + 1]
+            except IndexError:
+                print("Error: Batch flag (-b or --batch) requires a file argument.")
+                sys.exit(1)
 
-            # Check if the file exists and is a JSON file
-            if not os.path.exists(metadata_file):
-                print(f"Error: Debug file '{metadata_file}' does not exist.")
+        # Metadata for the next links is fetched while earlier ones are handled
+        jobs = get_number_option(args, "-j", "--jobs")
+        prefetch = get_number_option(args, "-k", "--prefetch", PREFETCH_WINDOW)
+        workers = get_number_option(args, "-w", "--workers", BATCH_WORKERS)
+
+        # Prepared items are handled smallest first unless another policy is given
+        policy = DEFAULT_POLICY
+        if "--policy" in args:
+            policy = args[args.index("--policy") + 1] if args.index("--policy") + 1 < len(args) else ""
+            if policy not in POLICIES:
+                print(f"Error: --policy must be one of: {', '.join(POLICIES)}.")
                 sys.exit(1)
 
-            if not is_json_file(metadata_file):
-                print(f"Error: Debug file '{metadata_file}' is not a JSON file.")
+        # Metrics for a textfile collector, rewritten while the batch runs
+        metrics_writer = None
+        if "--metrics-file" in args:
+            index = args.index("--metrics-file")
+            if index + 1 >= len(args):
+                print("Error: --metrics-file requires a file argument.")
                 sys.exit(1)
+            metrics_writer = TextfileWriter(args[index + 1]).start()
 
-        except (IndexError, ValueError):
-            print("Error: Debug flag (-d or --debug) requires a file argument.")
+        options = dict(
+            max_workers=jobs, prefetch=prefetch, stages=stages, chains=chains, workers=workers,
+            policy=policy, extract_audio=extract_audio, output_dir=output_dir,
+            loudness_cache=loudness_cache, split_chapters=split_chapters, artwork_cache=artwork_cache,
+            output_store=output_store, audio_only=is_audio_only(args),
+        )
+        try:
+            if spool_dir:
+                # --once handles the files already there; --requeue retries those of a crashed run
+                succeeded = run_spool(spool_dir, once="--once" in args, requeue="--requeue" in args, **options)
+            else:
+                # Progress is journaled next to the links file; --resume continues from it
+                succeeded = run_batch(
+                    read_links(links_file), journal_file=journal_path(links_file), resume="--resume" in args,
+                    **options,
+                )
+        finally:
+            if metrics_writer:
+                metrics_writer.close()
+        print_run_summary()
+        if not succeeded:
+            sys.exit(1)
+        sys.exit(0)
+
+    if metadata_file:
+        # Check if the file exists and is a JSON file
+        if not os.path.exists(metadata_file):
+            print(f"Error: Metadata file '{metadata_file}' does not exist.")
+            sys.exit(1)
+
+        if not is_json_file(metadata_file):
+            print(f"Error: Metadata file '{metadata_file}' is not a JSON file.")
             sys.exit(1)
 
     else:
@@ -116,7 +243,7 @@ def main():
             sys.exit(1)
 
         print(f"Input Link: {link}")
-        metadata_file = fetch_metadata(link)  # Get metadata and save it
+        metadata_file = fetch_metadata(link, is_audio_only(args))  # Get metadata and save it
 
     # Read the metadata file
     metadata = read_metadata_file(metadata_file)
@@ -124,8 +251,27 @@ def main():
     # Continue with other tasks using the metadata...
     print("Metadata successfully loaded. Proceeding with other tasks...")
 
-    run_script("video_id.py", metadata_file)
-    run_script("audio_id.py", metadata_file)
+    # The video and audio chains share nothing but the metadata, so run them concurrently
+    scheduler = StageScheduler(stages=stages, max_workers=get_number_option(args, "-j", "--jobs"))
+    results = scheduler.run([metadata_file])
+    succeeded = report_item(results[metadata_file], chains)
+
+    if succeeded and extract_audio:
+        format_id = selected_audio_format(results[metadata_file])
+        output_path, error = save_audio(
+            metadata_file, metadata, format_id, output_dir, loudness_cache=loudness_cache,
+            artwork_cache=artwork_cache, split_chapters=split_chapters, output_store=output_store,
+        )
+        if output_path:
+            print(f"Saved: {output_path}")
+        else:
+            print("Error: Failed to extract the audio.")
+            print(error)
+            succeeded = False
+
+    print_run_summary()
+    if not succeeded:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
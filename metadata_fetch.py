@@ -0,0 +1,46 @@
+import os
+import json
+import time
+import shlex
+
+# Import the generate_unique_filename function
+from generate_temp_filename import generate_unique_filename
+from subprocess_watchdog import run_with_deadline
+from metrics import FETCH_SECONDS
+
+# YTM_YTDLP_COMMAND replaces the yt-dlp command line, e.g. with a stand-in for load tests
+YTDLP_COMMAND_ENV = "YTM_YTDLP_COMMAND"
+YTDLP_COMMAND = shlex.split(os.environ.get(YTDLP_COMMAND_ENV) or "py ./executables/yt-dlp", posix=os.name != "nt")
+
+def strip_video_formats(metadata):
+    """Drop the formats without audio, which the audio stages never look at."""
+    metadata["formats"] = [fmt for fmt in metadata.get("formats", []) if fmt.get("acodec") != "none"]
+    return metadata
+
+def fetch_metadata_file(link, audio_only=False):
+    """Fetch metadata using yt-dlp and save it as a JSON file.
+
+    yt-dlp always lists every format; with audio_only the video-only ones are
+    left out of the saved file, so every audio stage parses a fraction of it.
+    Returns the filename and None on success, or None and the error output.
+    """
+    temp_filename = generate_unique_filename()
+    command = YTDLP_COMMAND + ["-j", link]
+    started = time.perf_counter()
+    result = run_with_deadline(command, "fetch_metadata")
+    FETCH_SECONDS.observe(time.perf_counter() - started, result="ok" if result.returncode == 0 else "error")
+
+    if result.returncode != 0:
+        os.remove(temp_filename)  # Reserved before the fetch
+        return None, result.stderr
+
+    output = result.stdout
+    if audio_only:
+        try:
+            output = json.dumps(strip_video_formats(json.loads(output)))
+        except ValueError:
+            pass  # Saved as printed; the stages report what is wrong with it
+
+    with open(temp_filename, "w", encoding="utf-8") as file:
+        file.write(output)
+    return temp_filename, None
@@ -0,0 +1,176 @@
+import os
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metadata_fetch import fetch_metadata_file
+from metrics import CACHE_HITS, CACHE_MISSES
+from subprocess_watchdog import kill_all
+
+# Number of upcoming links prepared ahead of the one being handled
+PREFETCH_WINDOW = 4
+
+# Upper bound on the size of prepared metadata files waiting to be handled
+PREFETCH_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds between the None items yielded while a LinkFeed has no links
+IDLE_INTERVAL = 1.0
+
+class LinkFeed:
+    """Links that keep arriving while a batch runs, until the feed is closed."""
+
+    def __init__(self):
+        self._links = deque()
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def extend(self, links):
+        with self._condition:
+            self._links.extend(links)
+            self._condition.notify_all()
+
+    def close(self):
+        """No more links will arrive; the batch ends once the fed ones are handled."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def popleft(self):
+        with self._condition:
+            return self._links.popleft()
+
+    def clear(self):
+        with self._condition:
+            self._links.clear()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._links)
+
+    def wait(self, timeout):
+        """Block until links arrive, the feed is closed or the timeout passes."""
+        with self._condition:
+            if not self._links and not self.closed:
+                self._condition.wait(timeout)
+
+    def exhausted(self):
+        with self._condition:
+            return self.closed and not self._links
+
+class MetadataPrefetcher:
+    """Fetch metadata and select formats for the next links ahead of time.
+
+    Iterating yields one dict per link, in link order, with the keys
+    "link", "metadata_file", "stage_results" and "error". links can be a
+    LinkFeed; while it has no links, None is yielded every IDLE_INTERVAL.
+    """
+
+    def __init__(self, links, scheduler, window=PREFETCH_WINDOW, max_bytes=PREFETCH_MAX_BYTES,
+                 journal=None, resume_items=None, audio_only=False):
+        self.links = links if isinstance(links, LinkFeed) else deque(links)
+        self.scheduler = scheduler
+        self.journal = journal
+        self.resume_items = resume_items or {}
+        self.audio_only = audio_only
+        self.window = max(1, window)
+        self.max_bytes = max_bytes
+        self.cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.window)
+        self._queue = deque()  # Futures in link order
+        self._held_bytes = 0
+        self._lock = threading.Lock()
+
+    def _prepare(self, link):
+        """Fetch a link's metadata and run its selection stages."""
+        item = {"link": link, "metadata_file": None, "stage_results": None, "error": None}
+        if self.cancelled.is_set():
+            item["error"] = "Cancelled."
+            return item
+
+        # Work already recorded in the journal of an earlier run is reused
+        previous = self.resume_items.get(link, {})
+        if previous.get("audio_only") and not self.audio_only:
+            previous = {}  # The video stages need the formats -a stripped, so the metadata is fetched again
+        metadata_file = previous.get("metadata_file")
+
+        if metadata_file and os.path.exists(metadata_file):
+            CACHE_HITS.inc(cache="metadata")
+        else:
+            CACHE_MISSES.inc(cache="metadata")
+            metadata_file, error = fetch_metadata_file(link, self.audio_only)
+            if metadata_file is None:
+                item["error"] = error
+                return item
+            if self.journal:
+                self.journal.record(link, "metadata_fetched", metadata_file=metadata_file, audio_only=self.audio_only)
+
+        item["metadata_file"] = metadata_file
+        with self._lock:
+            self._held_bytes += os.path.getsize(metadata_file)
+
+        stage_names = [stage["name"] for stage in self.scheduler.stages]
+        stage_outputs = previous.get("stage_outputs") or {}
+        if all(name in stage_outputs for name in stage_names):
+            CACHE_HITS.inc(cache="selection")
+            item["stage_results"] = {
+                name: subprocess.CompletedProcess(name, 0, stage_outputs[name], "")
+                for name in stage_names
+            }
+        elif not self.cancelled.is_set():
+            CACHE_MISSES.inc(cache="selection")
+            stage_results = self.scheduler.run([metadata_file])[metadata_file]
+            item["stage_results"] = stage_results
+            if self.journal and all(
+                name in stage_results and stage_results[name].returncode == 0 for name in stage_names
+            ):
+                stage_outputs = {name: stage_results[name].stdout for name in stage_names}
+                self.journal.record(link, "selected", stage_outputs=stage_outputs)
+        return item
+
+    def _fill(self):
+        """Submit links until the window is full or the memory bound is reached."""
+        while self.links and len(self._queue) < self.window and not self.cancelled.is_set():
+            with self._lock:
+                # Always keep at least one link in flight so the batch makes progress
+                if self._queue and self._held_bytes >= self.max_bytes:
+                    return
+            self._queue.append(self._executor.submit(self._prepare, self.links.popleft()))
+
+    def __iter__(self):
+        self._fill()
+        while not self.cancelled.is_set():
+            if not self._queue:
+                if not isinstance(self.links, LinkFeed) or self.links.exhausted():
+                    break
+                self.links.wait(IDLE_INTERVAL)
+                self._fill()
+                if not self._queue:
+                    yield None  # Lets the caller finish running items while it waits
+                continue
+
+            item = self._queue.popleft().result()
+            if item["metadata_file"]:
+                with self._lock:
+                    self._held_bytes -= os.path.getsize(item["metadata_file"])
+            self._fill()
+            yield item
+        self._executor.shutdown(wait=True)
+
+    def cancel(self):
+        """Stop prefetching and remove metadata files nobody will handle."""
+        self.cancelled.set()
+        self.links.clear()
+
+        for future in self._queue:
+            future.cancel()
+        kill_all()  # Running fetches and stages are abandoned
+        self._executor.shutdown(wait=True)
+
+        for future in self._queue:
+            if future.cancelled():
+                continue
+            metadata_file = future.result()["metadata_file"]
+            if metadata_file and os.path.exists(metadata_file):
+                os.remove(metadata_file)
+        self._queue.clear()
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stage scripts run as child processes; when this is set they send their
+# samples to the given file and the process exporting the metrics merges them
+SPOOL_ENV = "YTM_METRICS_SPOOL"
+
+TEXTFILE_INTERVAL = 15  # Seconds between textfile writes
+DEFAULT_METRICS_PORT = 9464
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ENCODE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_metrics = {}
+
+_spool_path = os.environ.get(SPOOL_ENV)
+_spool_buffer = []
+_collecting = False  # True in the process that exports the metrics
+_spool_offset = 0
+_drain_lock = threading.Lock()  # The textfile writer and the HTTP server may drain at once
+
+def label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value):
+    """Print counts exactly; %g would round large byte counts."""
+    return str(value) if isinstance(value, int) else f"{value:g}"
+
+def format_labels(label_names, key, extra=()):
+    pairs = list(zip(label_names, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    """Monotonic count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        record(self, label_key(self.label_names, labels), amount)
+
+    def apply(self, key, amount):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def lines(self):
+        if not self.values and not self.label_names:
+            yield f"{self.name} 0"
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.values = {}  # key -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        record(self, label_key(self.label_names, labels), value)
+
+    def time(self, **labels):
+        """Context manager observing the seconds spent in its block."""
+        return _Timer(self, labels)
+
+    def apply(self, key, value):
+        counts, total, count = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        self.values[key] = [counts, total + value, count + 1]
+
+    def lines(self):
+        for key, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{format_labels(self.label_names, key, [('le', f'{bound:g}')])} {bucket_count}"
+            yield f"{self.name}_bucket{format_labels(self.label_names, key, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(self.label_names, key)} {count}"
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+def register(metric):
+    _metrics[metric.name] = metric
+    return metric
+
+def record(metric, key, value):
+    """Apply a sample here, or spool it for the exporting process."""
+    with _lock:
+        if _spool_path and not _collecting:
+            _spool_buffer.append(json.dumps([metric.name, key, value]) + "\n")
+        else:
+            metric.apply(key, value)
+
+def flush_spool():
+    """Append this process's samples to the spool in a single write."""
+    with _lock:
+        if not _spool_buffer or not _spool_path:
+            return
+        data = "".join(_spool_buffer).encode("utf-8")
+        _spool_buffer.clear()
+    try:
+        descriptor = os.open(_spool_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, data)
+        finally:
+            os.close(descriptor)
+    except OSError:
+        pass  # Metrics never fail a stage
+
+atexit.register(flush_spool)
+
+def collect_from_children():
+    """Have stage processes started from now on send their samples here."""
+    global _collecting, _spool_path
+    if _collecting:
+        return
+    _collecting = True
+    descriptor, _spool_path = tempfile.mkstemp(prefix="ytm_metrics_", suffix=".spool")
+    os.close(descriptor)
+    os.environ[SPOOL_ENV] = _spool_path
+    atexit.register(lambda: os.path.exists(_spool_path) and os.remove(_spool_path))
+
+def drain_spool():
+    """Merge the samples children appended since the last call."""
+    global _spool_offset
+    if not _collecting or not os.path.exists(_spool_path):
+        return
+
+    with _drain_lock:
+        with open(_spool_path, "rb") as file:
+            file.seek(_spool_offset)
+            data = file.read()
+
+        # Only whole lines; a child may be in the middle of its write
+        complete = data[:data.rfind(b"\n") + 1]
+        _spool_offset += len(complete)
+
+    with _lock:
+        for line in complete.decode("utf-8").splitlines():
+            try:
+                name, key, value = json.loads(line)
+            except ValueError:
+                continue
+            if name in _metrics:
+                _metrics[name].apply(tuple(key), value)
+
+def render():
+    """Return every metric in the Prometheus text format."""
+    drain_spool()
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.lines())
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path):
+    """Write the metrics for a textfile collector, replacing the file atomically."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write(render())
+    os.replace(temp_path, path)
+
+class TextfileWriter:
+    """Rewrite a metrics textfile periodically while a run is in progress."""
+
+    def __init__(self, path, interval=TEXTFILE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._write_periodically, daemon=True)
+
+    def start(self):
+        collect_from_children()
+        self._thread.start()
+        return self
+
+    def _write_periodically(self):
+        while not self._stop.wait(self.interval):
+            write_textfile(self.path)
+
+    def close(self):
+        """Stop the writer and write the final values."""
+        self._stop.set()
+        self._thread.join()
+        write_textfile(self.path)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a line each
+
+def serve_metrics(port=DEFAULT_METRICS_PORT, host="127.0.0.1"):
+    """Serve /metrics from a background thread and return the server."""
+    collect_from_children()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+LINKS_PROCESSED = register(Counter(
+    "ytm_links_processed_total", "Links handled, by final result.", ("result",)
+))
+CACHE_HITS = register(Counter(
+    "ytm_cache_hits_total", "Lookups answered from a cache.", ("cache",)
+))
+CACHE_MISSES = register(Counter(
+    "ytm_cache_misses_total", "Lookups that had to be computed or fetched.", ("cache",)
+))
+FETCH_SECONDS = register(Histogram(
+    "ytm_fetch_seconds", "Latency of yt-dlp metadata fetches.", ("result",)
+))
+STAGE_SECONDS = register(Histogram(
+    "ytm_stage_seconds", "Run time of selection stages.", ("stage", "result")
+))
+SELECTION_RUNGS = register(Counter(
+    "ytm_selection_rung_total", "Format selections, by kind and the rung that decided them.", ("kind", "rung")
+))
+BYTES_DOWNLOADED = register(Counter(
+    "ytm_downloaded_bytes_total", "Media bytes downloaded.", ("kind",)
+))
+ENCODE_SECONDS = register(Histogram(
+    "ytm_encode_seconds", "Time spent encoding audio.", buckets=ENCODE_BUCKETS
+))
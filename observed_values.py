@@ -0,0 +1,169 @@
+import sys
+import os
+import json
+import re
+import time
+import tempfile
+
+import tracing
+
+# File paths
+OBSERVED_VALUES_FILE = "docs/observed_values.jsonl"
+RES_LANDSCAPE_FILE = "docs/video_resolutions_landscape.txt"
+RES_PORTRAIT_FILE = "docs/video_resolutions_portrait.txt"
+VIDEO_CODEC_FILE = "docs/video_codecs.txt"
+AUDIO_CODEC_FILE = "docs/audio_codecs.txt"
+AUDIO_FORMAT_NOTE_FILE = "docs/audio_format_notes.txt"
+
+trace = tracing.get_tracer("observed_values")
+
+def validate_input():
+    """Validate command-line arguments and check if debug mode is enabled."""
+    if "-d" in sys.argv:
+        tracing.enable_debug()
+        sys.argv.remove("-d")  # Remove debug flag from arguments
+
+def resolution_sort_key(resolution):
+    """Extract the first numeric value (A) from 'AxB' format for sorting."""
+    match = re.match(r"(\d+)", resolution)
+    return int(match.group(1)) if match else float('inf')
+
+def video_codec_sort_key(codec):
+    """Sort video codecs alphabetically, ignoring case."""
+    return codec.lower()
+
+def audio_sort_key(value):
+    """Sort audio codecs and format notes in plain order."""
+    return value
+
+# Sort order used when a view file is regenerated
+VIEW_SORT_KEYS = {
+    RES_LANDSCAPE_FILE: resolution_sort_key,
+    RES_PORTRAIT_FILE: resolution_sort_key,
+    VIDEO_CODEC_FILE: video_codec_sort_key,
+    AUDIO_CODEC_FILE: audio_sort_key,
+    AUDIO_FORMAT_NOTE_FILE: audio_sort_key,
+}
+
+def append_records(records):
+    """Append records to the store with a single write."""
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+
+    # A single append keeps records from concurrent workers from interleaving
+    fd = os.open(OBSERVED_VALUES_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, lines.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+def record_values(view_file, values):
+    """Append this item's observed values for a view file to the store."""
+    if not values:
+        return
+
+    seen = int(time.time())
+    append_records(
+        {"file": view_file, "value": value, "count": 1, "last_seen": seen}
+        for value in sorted(values)
+    )
+
+    trace.debug("Recorded %s observed values for %s", len(values), view_file)
+
+def load_value_stats(filepath=OBSERVED_VALUES_FILE):
+    """Aggregate the store into {view_file: {value: {"count", "last_seen"}}}."""
+    stats = {}
+
+    if not os.path.exists(filepath):
+        return stats
+
+    with open(filepath, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                trace.debug("Skipping unreadable record: %s", line)
+                continue  # A torn write from a killed worker
+
+            entry = stats.setdefault(record["file"], {}).setdefault(
+                record["value"], {"count": 0, "last_seen": 0}
+            )
+            entry["count"] += record.get("count", 1)
+            entry["last_seen"] = max(entry["last_seen"], record.get("last_seen", 0))
+
+    return stats
+
+def load_markers(filepath):
+    """Load values and their priority markers (`@`, `#`) from a view file."""
+    markers = {}
+
+    if not os.path.exists(filepath):
+        return markers
+
+    with open(filepath, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            marker = ""
+            value = line
+            if line[0] in {"@", "#"}:
+                marker, value = line[0], line[1:]
+            markers[value] = marker
+
+    return markers
+
+def regenerate_view(view_file, values):
+    """Rewrite a view file from the given values, keeping the user's markers."""
+    markers = load_markers(view_file)  # User markers stay authoritative
+    for value in values:
+        markers.setdefault(value, "")
+
+    sort_key = VIEW_SORT_KEYS.get(view_file, audio_sort_key)
+    # Every regeneration writes its own temp file, so concurrent ones never mix
+    descriptor, temp_file = tempfile.mkstemp(
+        prefix=f".{os.path.basename(view_file)}.", suffix=".tmp", dir=os.path.dirname(view_file) or "."
+    )
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            for value in sorted(markers, key=sort_key):
+                file.write(f"{markers[value]}{value}\n")
+        os.chmod(temp_file, 0o644)  # mkstemp creates it private
+        os.replace(temp_file, view_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    trace.debug("Regenerated %s with %s values", view_file, len(markers))
+
+def compact_store():
+    """Merge the store into one record per value and regenerate the views."""
+    if os.path.exists(OBSERVED_VALUES_FILE):
+        # Move the log aside so workers keep appending to a fresh file meanwhile
+        compacting_file = f"{OBSERVED_VALUES_FILE}.compacting"
+        os.replace(OBSERVED_VALUES_FILE, compacting_file)
+        merged = load_value_stats(compacting_file)
+
+        append_records(
+            {"file": view_file, "value": value, **entry}
+            for view_file in sorted(merged)
+            for value, entry in sorted(merged[view_file].items())
+        )
+        os.remove(compacting_file)
+
+    stats = load_value_stats()
+    for view_file, values in stats.items():
+        regenerate_view(view_file, values)
+
+    trace.debug("Compacted observed values for %s view files", len(stats))
+    return stats
+
+def main():
+    """Main execution."""
+    validate_input()
+    compact_store()
+
+if __name__ == "__main__":
+    tracing.run_main(main)
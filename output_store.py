@@ -0,0 +1,207 @@
+import sys
+import os
+import json
+import time
+import errno
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+import tracing
+from metrics import CACHE_HITS, CACHE_MISSES
+
+DEFAULT_STORE_DIR = "output_store"
+
+# Linux ioctl cloning a file's extents (btrfs, XFS); see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+trace = tracing.get_tracer("output_store")
+
+def output_key(video_id, format_id, settings):
+    """Hash of everything that decides the bytes of an output."""
+    payload = json.dumps({"video_id": video_id, "format_id": format_id, "settings": settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def reflink(source, destination):
+    """Clone a file without copying its data, where the file system supports it."""
+    import fcntl  # Not available on Windows
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def link_file(source, destination):
+    """Hardlink a file, else reflink it, else copy it; return the method used."""
+    try:
+        os.link(source, destination)
+        return "hardlink"
+    except OSError:
+        pass  # Another volume, or a file system without hardlinks
+
+    try:
+        reflink(source, destination)
+        return "reflink"
+    except (OSError, ImportError):
+        if os.path.exists(destination):
+            os.remove(destination)
+
+    shutil.copy2(source, destination)
+    return "copy"
+
+def link_tree(source, destination):
+    """Link a file, or every file of a directory, to a new path; return the methods used."""
+    if not os.path.isdir(source):
+        return {link_file(source, destination)}
+
+    methods = set()
+    os.makedirs(destination)
+    for name in sorted(os.listdir(source)):
+        methods |= link_tree(os.path.join(source, name), os.path.join(destination, name))
+    return methods
+
+def replace_path(path):
+    """Remove a file or directory about to be replaced."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class OutputStore:
+    """Finished outputs stored once per (video ID, format ID, encode settings).
+
+    Every requested location gets a hardlink (or reflink, or copy) of the
+    stored object instead of a new download and encode. The index is a SQLite
+    file that workers sharing the store volume can query before scheduling work.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, "index.db"), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS outputs (
+                key TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                format_id TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                name TEXT NOT NULL,
+                bytes INTEGER,
+                created REAL
+            )
+        """)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS placements (
+                key TEXT NOT NULL,
+                location TEXT NOT NULL,
+                method TEXT,
+                placed REAL,
+                PRIMARY KEY (key, location)
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS outputs_video ON outputs (video_id)")
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def object_path(self, key):
+        return os.path.join(self.directory, "objects", key[:2], key)
+
+    def lookup(self, key):
+        """Return the stored object for a key, or None."""
+        path = self.object_path(key)
+        if not self._execute("SELECT 1 FROM outputs WHERE key = ?", (key,)) or not os.path.exists(path):
+            return None
+        return path
+
+    def outputs_for(self, video_id):
+        """Return (format_id, settings, name) of every output stored for a video."""
+        return [
+            (format_id, json.loads(settings), name)
+            for format_id, settings, name in self._execute(
+                "SELECT format_id, settings, name FROM outputs WHERE video_id = ? ORDER BY created", (video_id,)
+            )
+        ]
+
+    def place(self, key, destination):
+        """Link the stored output to a destination; return the destination, or None if not stored."""
+        source = self.lookup(key)
+        if source is None:
+            CACHE_MISSES.inc(cache="output")
+            return None
+        CACHE_HITS.inc(cache="output")
+
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            return destination  # Already linked by an earlier run
+
+        partial = f"{destination}.part"
+        replace_path(partial)
+        methods = link_tree(source, partial)
+        replace_path(destination)
+        os.replace(partial, destination)
+
+        self._execute(
+            "INSERT OR REPLACE INTO placements (key, location, method, placed) VALUES (?, ?, ?, ?)",
+            (key, os.path.abspath(destination), ",".join(sorted(methods)), time.time()),
+        )
+        trace.debug("Placed %s at %s (%s)", key, destination, ", ".join(sorted(methods)))
+        return destination
+
+    def add(self, key, video_id, format_id, settings, path):
+        """Store a finished output, linked from where it was written."""
+        target = self.object_path(key)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            partial = f"{target}.{os.getpid()}.{threading.get_ident()}.part"
+            replace_path(partial)
+            methods = link_tree(path, partial)
+            try:
+                os.rename(partial, target)
+            except OSError as e:
+                # Another worker stored the same output first
+                replace_path(partial)
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY) and not os.path.exists(target):
+                    raise
+            trace.debug("Stored %s (%s)", key, ", ".join(sorted(methods)))
+
+        size = sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(target) for name in names
+        ) if os.path.isdir(target) else os.path.getsize(target)
+        self._execute(
+            "INSERT OR IGNORE INTO outputs (key, video_id, format_id, settings, name, bytes, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, video_id, format_id, json.dumps(settings, sort_keys=True), os.path.basename(path), size, time.time()),
+        )
+        self._execute(
+            "INSERT OR REPLACE INTO placements (key, location, method, placed) VALUES (?, ?, ?, ?)",
+            (key, os.path.abspath(path), "original", time.time()),
+        )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+def main():
+    """List the outputs stored for the given video IDs."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    if len(args) < 2:
+        print("Error: Usage: output_store.py <store directory> <video ID>...")
+        sys.exit(1)
+
+    store = OutputStore(args[0])
+    found = False
+    for video_id in args[1:]:
+        for format_id, settings, name in store.outputs_for(video_id):
+            found = True
+            print(f"{video_id}\t{format_id}\t{json.dumps(settings, sort_keys=True)}\t{name}")
+    sys.exit(0 if found else 1)
+
+if __name__ == "__main__":
+    tracing.run_main(main)
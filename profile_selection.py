@@ -0,0 +1,233 @@
+import sys
+import os
+import json
+import configparser
+
+import tracing
+from video_format_ids import find_nearest_format_id, normalize_codec
+
+# File with the named preference profiles
+PROFILES_FILE = "docs/profiles.ini"
+
+# Profile keys holding `@`/`#` ladders, one entry per line
+LADDER_KEYS = (
+    "landscape_resolutions",
+    "portrait_resolutions",
+    "video_codecs",
+    "audio_codecs",
+    "audio_notes",
+)
+
+trace = tracing.get_tracer("profile_selection")
+
+def validate_input():
+    """Validate command-line arguments and check if debug mode is enabled."""
+    if "-d" in sys.argv:
+        tracing.enable_debug()
+        sys.argv.remove("-d")  # Remove debug flag from arguments
+
+    if len(sys.argv) < 2:
+        print("Error: No JSON file provided.")
+        sys.exit(1)
+
+    json_file = sys.argv[1]
+
+    if not os.path.exists(json_file):
+        print(f"Error: File '{json_file}' not found.")
+        sys.exit(1)
+
+    if not json_file.lower().endswith(".json"):
+        print(f"Error: File '{json_file}' is not a JSON file.")
+        sys.exit(1)
+
+    trace.debug("Validated input file: %s", json_file)
+    return json_file
+
+def parse_ladder(value):
+    """Read primary (`@`) and secondary (`#`) entries like the docs/*.txt files."""
+    primary, secondary = None, None
+
+    for line in value.splitlines():
+        line = line.strip()
+        if line.startswith("@"):
+            primary = line[1:]  # Highest priority
+        elif line.startswith("#") and secondary is None:
+            secondary = line[1:]  # Second priority
+
+    return primary, secondary
+
+def load_profiles(file_path=PROFILES_FILE):
+    """Load {profile: {ladder key: (primary, secondary)}} from the profiles file."""
+    if not os.path.exists(file_path):
+        print(f"Error: Profiles file '{file_path}' not found.")
+        sys.exit(1)
+
+    # `#` starts a secondary entry here, so only `;` starts a comment
+    parser = configparser.ConfigParser(comment_prefixes=(";",), inline_comment_prefixes=None)
+    try:
+        parser.read(file_path, encoding="utf-8")
+    except configparser.Error as e:
+        print(f"Error: Failed to read profiles file '{file_path}'. Reason: {e}")
+        sys.exit(1)
+
+    profiles = {}
+    for name in parser.sections():
+        profiles[name] = {
+            key: parse_ladder(parser[name][key]) for key in LADDER_KEYS if key in parser[name]
+        }
+        trace.debug("Loaded profile %s: %s", name, profiles[name])
+
+    return profiles
+
+def new_video_state():
+    return {"found": False, "primary": None, "secondary": None, "matched": False, "first": None}
+
+def update_video_state(state, width, height, primary_codec, secondary_codec, fmt_width, fmt_height, fmt_codec, fmt_id):
+    """Apply one format to a profile's exact-resolution match, as video_format_ids does.
+
+    The flags record that a match was found even when its format ID is empty.
+    """
+    if state["found"] or not width:
+        return
+    if fmt_width == width or fmt_height == height:
+        if not state["matched"]:
+            state["matched"], state["first"] = True, fmt_id
+        if fmt_codec == primary_codec:
+            state["found"], state["primary"] = True, fmt_id
+        elif fmt_codec == secondary_codec and state["secondary"] is None:
+            state["secondary"] = fmt_id
+
+def update_audio_state(state, ladders, fmt_codec, fmt_note, fmt_id):
+    """Apply one format to a profile's audio rungs, as audio_format_ids does."""
+    if state["found"]:
+        return
+
+    primary_codec, secondary_codec = ladders.get("audio_codecs", (None, None))
+    primary_note, secondary_note = ladders.get("audio_notes", (None, None))
+
+    if fmt_codec == primary_codec and fmt_note == primary_note:
+        state["found"], state["exact"] = True, fmt_id
+        return
+    if fmt_codec == primary_codec and fmt_note == secondary_note:
+        state["selected"] = fmt_id
+    if fmt_codec == primary_codec and not state["selected"]:
+        state["selected"] = fmt_id
+    if fmt_codec == secondary_codec and fmt_note == primary_note and not state["selected"]:
+        state["selected"] = fmt_id
+    if fmt_codec == secondary_codec and fmt_note == secondary_note and not state["selected"]:
+        state["selected"] = fmt_id
+    if fmt_codec == secondary_codec and not state["selected"]:
+        state["selected"] = fmt_id
+
+def resolution_size(resolution):
+    """Return (width, height) for an 'AxB' entry, or (None, None)."""
+    if not resolution:
+        return None, None
+    width, height = map(int, resolution.split("x"))
+    return width, height
+
+def select_all_profiles(metadata, profiles):
+    """Evaluate every profile in a single pass over the formats.
+
+    Returns {profile: {"video": id, "audio": id}}, with only the kinds the profile configures.
+    """
+    video_profiles = {
+        name: ladders for name, ladders in profiles.items()
+        if "landscape_resolutions" in ladders or "portrait_resolutions" in ladders
+    }
+    audio_profiles = {name: ladders for name, ladders in profiles.items() if "audio_codecs" in ladders}
+
+    # The orientation is only known after the pass, so both resolutions are tracked
+    targets = {}
+    for name, ladders in video_profiles.items():
+        codecs = ladders.get("video_codecs", (None, None))
+        for orientation, key in (("Landscape", "landscape_resolutions"), ("Portrait", "portrait_resolutions")):
+            width, height = resolution_size(ladders.get(key, (None, None))[0])
+            targets[(name, orientation)] = (width, height) + codecs
+    video_states = {target: new_video_state() for target in targets}
+    audio_states = {name: {"found": False, "exact": None, "selected": None} for name in audio_profiles}
+
+    max_width, max_height = 0, 0
+    sized_formats = []
+
+    for fmt in metadata.get("formats", []):
+        fmt_id = fmt.get("format_id")
+        fmt_width, fmt_height = fmt.get("width"), fmt.get("height")
+
+        if fmt_width and fmt_height and fmt_width * fmt_height > max_width * max_height:
+            max_width, max_height = fmt_width, fmt_height
+
+        if fmt.get("vcodec") != "none":
+            fmt_codec = normalize_codec(fmt.get("vcodec") or "")
+            for target, (width, height, primary_codec, secondary_codec) in targets.items():
+                update_video_state(
+                    video_states[target], width, height, primary_codec, secondary_codec,
+                    fmt_width, fmt_height, fmt_codec, fmt_id,
+                )
+            if fmt_width and fmt_height:
+                sized_formats.append((fmt_width * fmt_height, fmt))
+
+        if fmt.get("acodec") != "none":
+            for name, ladders in audio_profiles.items():
+                update_audio_state(audio_states[name], ladders, fmt.get("acodec"), fmt.get("format_note"), fmt_id)
+
+    orientation = "Landscape" if max_width >= max_height else "Portrait"
+    trace.debug("Determined Video Orientation: %s", orientation)
+
+    # Nearest-resolution fallback index, shared by every profile
+    index = sorted(
+        (entry for entry in sized_formats
+         if ("Landscape" if entry[1]["width"] >= entry[1]["height"] else "Portrait") == orientation),
+        key=lambda entry: entry[0],
+    )
+
+    selections = {name: {} for name in profiles}
+
+    for name in video_profiles:
+        width, height, primary_codec, secondary_codec = targets[(name, orientation)]
+        state = video_states[(name, orientation)]
+        if state["found"]:
+            format_id = state["primary"]
+        elif state["secondary"]:
+            format_id = state["secondary"]
+        elif state["matched"]:
+            format_id = state["first"]
+        elif width:
+            secondary_res = profiles[name].get(f"{orientation.lower()}_resolutions", (None, None))[1]
+            format_id = find_nearest_format_id(index, width, height, secondary_res, primary_codec, secondary_codec)
+        else:
+            format_id = None
+        selections[name]["video"] = format_id or "bv"
+
+    for name in audio_profiles:
+        state = audio_states[name]
+        selections[name]["audio"] = (state["exact"] if state["found"] else state["selected"]) or "av"
+
+    trace.debug("Profile selections: %s", selections)
+    return selections
+
+def process_profiles(json_file):
+    """Print the selections of every profile for one video."""
+    try:
+        with open(json_file, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+    except Exception as e:
+        print(f"Error: Failed to read JSON file. {e}")
+        sys.exit(1)
+
+    if "formats" not in metadata:
+        print("Error: 'formats' data missing in JSON file.")
+        sys.exit(1)
+
+    selections = select_all_profiles(metadata, load_profiles())
+    for name, selection in selections.items():
+        format_ids = [selection[kind] for kind in ("video", "audio") if kind in selection]
+        print(f"{name}: {'+'.join(format_ids)}")
+
+def main():
+    """Main execution."""
+    json_file = validate_input()
+    process_profiles(json_file)
+
+if __name__ == "__main__":
+    tracing.run_main(main)
@@ -42,7 +42,7 @@ def check_required_variables():
         variables = [line.strip() for line in file.readlines() if line.strip()]
 
     # Get system PATH directories
-    path_dirs = os.environ.get("PATH", "").split(";")
+    path_dirs = os.environ.get("PATH", "").split(os.pathsep)
 
     for var in variables:
         var_name = var + ".exe" if IS_WINDOWS else var  # Append .exe for Windows
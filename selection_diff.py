@@ -0,0 +1,362 @@
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from bulk_reselect import find_documents, load_document, load_ladders, select_audio, select_video
+from profile_selection import select_all_profiles
+from metrics import SPOOL_ENV
+
+# The scripts whose output every candidate has to reproduce
+LEGACY_SCRIPTS = {"video": "video_format_ids.py", "audio": "audio_format_ids.py"}
+CANDIDATES = ("scalar", "profiles")
+
+DEFAULT_RANDOM_DOCUMENTS = 200
+MAX_RANDOM_FORMATS = 30
+SHOWN_DIVERGENCES = 20
+
+# Values the random format lists draw from, next to the current ladder values
+VIDEO_CODECS = ("avc1.4d401e", "avc1.640028", "vp09.00.40.08", "vp9", "av01.0.08M.08", "hev1.1.6.L93", "none")
+AUDIO_CODECS = ("opus", "mp4a.40.2", "mp4a.40.5", "mp4a", "ac-3", "none")
+FORMAT_NOTES = ("low", "medium", "high", "low, DRC", "medium, DRC", "360p", "720p", "Default", None)
+SIZES = ((256, 144), (426, 240), (640, 360), (854, 480), (1280, 720), (1920, 1080), (2560, 1440), (3840, 2160))
+
+trace = tracing.get_tracer("selection_diff")
+
+# --- Random documents ----------------------------------------------------------
+
+def ladder_sizes(ladders):
+    sizes = []
+    for key in ("Landscape", "Portrait"):
+        for resolution in ladders[key]:
+            if resolution:
+                sizes.append(tuple(map(int, resolution.split("x"))))
+    return sizes
+
+def random_size(rng, sizes):
+    """A width and height, mostly ordinary, sometimes portrait, partial or unusual."""
+    width, height = rng.choice(sizes)
+    if rng.random() < 0.3:
+        width, height = height, width
+    roll = rng.random()
+    if roll < 0.05:
+        return None, height
+    if roll < 0.10:
+        return width, None
+    if roll < 0.13:
+        return 0, height
+    if roll < 0.16:
+        return float(width), float(height)  # Compared like ints by the legacy scripts
+    if roll < 0.18:
+        return width + 0.5, height
+    if roll < 0.20:
+        return -width, -height
+    return width, height
+
+def random_format(rng, ladders, sizes, format_ids):
+    """One format entry, video-only, audio-only or muxed.
+
+    Some video formats have no vcodec, which video_format_ids.py crashes on.
+    String sizes, which crash both scripts, are not generated.
+    """
+    kind = rng.choice(("video", "audio", "muxed"))
+    video_codecs = VIDEO_CODECS + tuple(value for value in ladders["video_codecs"] if value)
+    audio_codecs = AUDIO_CODECS + tuple(value for value in ladders["audio_codecs"] if value)
+    notes = FORMAT_NOTES + tuple(ladders["audio_notes"])
+
+    # Reused IDs and falsy IDs exercise the "first match wins" and fallback paths
+    if format_ids and rng.random() < 0.05:
+        format_id = rng.choice(format_ids)
+    elif rng.random() < 0.01:
+        format_id = rng.choice(("", None))
+    else:
+        format_id = str(rng.randint(100, 999))
+    format_ids.append(format_id)
+
+    fmt = {"format_id": format_id, "format_note": rng.choice(notes)}
+    if kind == "audio":
+        fmt.update(vcodec="none", acodec=rng.choice(audio_codecs), width=None, height=None)
+    else:
+        width, height = random_size(rng, sizes)
+        fmt.update(
+            vcodec=rng.choice(video_codecs),
+            acodec="none" if kind == "video" else rng.choice(audio_codecs),
+            width=width, height=height,
+        )
+        if fmt["vcodec"] == "none":
+            fmt["acodec"] = rng.choice(audio_codecs)  # Listed as a video format by size only
+        elif rng.random() < 0.01:
+            del fmt["vcodec"]  # Counts as video with no codec
+
+    if rng.random() < 0.02:
+        del fmt["acodec"]  # Counts as audio with no codec
+    if rng.random() < 0.02:
+        del fmt["format_note"]
+    return fmt
+
+def random_documents(count, seed, ladders):
+    """Documents with random format lists built around the current ladders."""
+    rng = random.Random(seed)
+    sizes = list(SIZES) + ladder_sizes(ladders)
+    documents = []
+    for index in range(count):
+        document = {"id": f"random{index:05d}"}
+        if rng.random() > 0.01:
+            format_ids = []
+            document["formats"] = [
+                random_format(rng, ladders, sizes, format_ids) for _ in range(rng.randint(0, MAX_RANDOM_FORMATS))
+            ]
+        documents.append(document)
+    return documents
+
+def write_documents(documents, directory):
+    paths = []
+    for document in documents:
+        path = os.path.join(directory, f"{document['id']}.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(document, file)
+        paths.append(path)
+    return paths
+
+# --- Legacy scripts ------------------------------------------------------------
+
+def crash_output(stdout, name):
+    """Mark output cut short by an exception."""
+    return f"{stdout}<{name}>"
+
+def is_crash(output):
+    return output.endswith(">")
+
+def run_script(script, path, env):
+    result = subprocess.run([sys.executable, script, path], capture_output=True, text=True, env=env)
+    if result.returncode != 0 and not result.stdout.startswith("Error:"):
+        last_line = (result.stderr.strip().splitlines() or ["exit status"])[-1]
+        return crash_output(result.stdout, last_line.split(":")[0])
+    return result.stdout
+
+def run_legacy(paths, workers=None):
+    """Run both format ID scripts on every document; returns (outputs, script seconds)."""
+    env = dict(os.environ)
+    env.pop(SPOOL_ENV, None)  # The comparison runs are not worth metrics
+
+    def run(path):
+        started = time.perf_counter()
+        outputs = {kind: run_script(script, path, env) for kind, script in LEGACY_SCRIPTS.items()}
+        return outputs, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        results = list(pool.map(run, paths))
+    return [outputs for outputs, _ in results], sum(seconds for _, seconds in results)
+
+# --- Candidates --------------------------------------------------------------
+
+def render(selection):
+    """The stdout the format ID scripts print for a selection."""
+    video, audio = selection.get("video"), selection.get("audio")
+    return {
+        "video": "Error: No priority resolution found.\n" if video is None else (
+            "bv" if video == "bv" else f"{video}\n"  # The script prints 'bv' without a newline
+        ),
+        "audio": "Error: No priority codec found.\n" if audio is None else f"{audio}\n",
+    }
+
+def crashed(e):
+    return {kind: crash_output("", type(e).__name__) for kind in LEGACY_SCRIPTS}
+
+def run_scalar(documents, ladders):
+    """Select each kind on its own, as the two scripts do, so a crash in one keeps the other."""
+    outputs = []
+    for metadata in documents:
+        selection, crashes = {}, {}
+        for kind, select in (("video", select_video), ("audio", select_audio)):
+            try:
+                selection[kind] = select(metadata, ladders)
+            except Exception as e:
+                crashes[kind] = crash_output("", type(e).__name__)
+        outputs.append(dict(render(selection), **crashes))
+    return outputs
+
+def current_profile(ladders):
+    """The docs/*.txt ladders as a single profile."""
+    return {
+        "current": {
+            "landscape_resolutions": tuple(ladders["Landscape"]),
+            "portrait_resolutions": tuple(ladders["Portrait"]),
+            "video_codecs": tuple(ladders["video_codecs"]),
+            "audio_codecs": tuple(ladders["audio_codecs"]),
+            "audio_notes": tuple(ladders["audio_notes"]),
+        }
+    }
+
+def run_profiles(documents, ladders):
+    profile = current_profile(ladders)
+    outputs = []
+    for metadata in documents:
+        try:
+            outputs.append(render(select_all_profiles(metadata, profile)["current"]))
+        except Exception as e:
+            outputs.append(crashed(e))
+    return outputs
+
+CANDIDATE_RUNNERS = {"scalar": run_scalar, "profiles": run_profiles}
+
+def run_candidate(name, loaded, ladders):
+    """Run a candidate over the loaded documents; returns (outputs, seconds).
+
+    Documents that could not be loaded get the scripts' error line without
+    involving the candidate, which only ever sees parsed metadata.
+    """
+    documents = [metadata for metadata, _ in loaded if metadata is not None]
+    started = time.perf_counter()
+    selected = iter(CANDIDATE_RUNNERS[name](documents, ladders))
+    seconds = time.perf_counter() - started
+
+    outputs = []
+    for metadata, error in loaded:
+        if metadata is None:
+            outputs.append({kind: f"Error: {error['error']}\n" for kind in LEGACY_SCRIPTS})
+        else:
+            outputs.append(next(selected))
+    return outputs, seconds
+
+# --- Comparison --------------------------------------------------------------
+
+def divergences(paths, expected, actual):
+    """Outputs that differ, except where the script crashed, which no candidate has to reproduce."""
+    return [
+        {"path": path, "kind": kind, "legacy": legacy[kind], "candidate": candidate[kind]}
+        for path, legacy, candidate in zip(paths, expected, actual)
+        for kind in LEGACY_SCRIPTS if legacy[kind] != candidate[kind] and not is_crash(legacy[kind])
+    ]
+
+def usable_candidates(names, ladders):
+    """Drop the candidates that cannot run here, with a warning."""
+    usable = []
+    for name in names:
+        if name == "profiles" and ladders["bandwidth"].get("mode", "off") != "off":
+            print("Warning: Profiles ignore docs/bandwidth_budget.txt; skipping the profiles candidate.")
+        elif name == "profiles" and not (ladders["Landscape"][0] and ladders["Portrait"][0]
+                                         and ladders["audio_codecs"][0]):
+            # The scripts stop with an error without them, while profiles fall back to bv/av
+            print("Warning: Profiles need `@` resolutions for both orientations and an `@` audio codec; "
+                  "skipping the profiles candidate.")
+        else:
+            usable.append(name)
+    return usable
+
+def print_report(report, shown):
+    legacy = report["legacy"]
+    print(f"Documents: {report['documents']} ({report['random']} random, seed {report['seed']})")
+    print(f"Legacy scripts: {legacy['seconds']:.2f}s ({legacy['ms_per_document']:.2f} ms/doc, "
+          "including process start-up and JSON parsing)")
+    if legacy["crashes"]:
+        print(f"Script crashes: {legacy['crashes']} outputs, not compared")
+
+    print(f"\n{'Candidate':<12}{'divergences':>12}{'seconds':>10}{'ms/doc':>10}{'speedup':>10}")
+    for name, result in report["candidates"].items():
+        print(f"{name:<12}{len(result['divergences']):>12}{result['seconds']:>10.3f}"
+              f"{result['ms_per_document']:>10.3f}{result['speedup']:>9.1f}x")
+
+    for name, result in report["candidates"].items():
+        for divergence in result["divergences"][:shown]:
+            print(f"\n{name}: {divergence['path']} ({divergence['kind']})")
+            print(f"  legacy:    {divergence['legacy']!r}")
+            print(f"  candidate: {divergence['candidate']!r}")
+        hidden = len(result["divergences"]) - shown
+        if hidden > 0:
+            print(f"\n{name}: {hidden} more divergences not shown.")
+
+def get_option(args, flag, default, convert=str):
+    """Remove a flag and its value from args; return the converted value or the default."""
+    if flag not in args:
+        return default
+    index = args.index(flag)
+    try:
+        value = convert(args[index + 1])
+    except (IndexError, ValueError):
+        print(f"Error: {flag} requires a value.")
+        sys.exit(1)
+    del args[index:index + 2]
+    return value
+
+def main():
+    """Compare the selection candidates with the format ID scripts, document by document."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    random_count = get_option(args, "--random", DEFAULT_RANDOM_DOCUMENTS, int)
+    seed = get_option(args, "--seed", random.randrange(2**32), int)
+    workers = get_option(args, "-j", None, int)
+    shown = get_option(args, "--show", SHOWN_DIVERGENCES, int)
+    report_file = get_option(args, "--report", None)
+    names = get_option(args, "--candidates", ",".join(CANDIDATES)).split(",")
+
+    unknown = [name for name in names if name not in CANDIDATES]
+    if unknown or any(arg.startswith("-") for arg in args):
+        print("Error: Usage: selection_diff.py [<directories or JSON files>] [--random <n>] [--seed <n>] "
+              f"[--candidates {','.join(CANDIDATES)}] [-j workers] [--show <n>] [--report <json file>]")
+        sys.exit(1)
+
+    ladders = load_ladders()
+    trace.debug("Loaded ladders: %s", ladders)
+    names = usable_candidates(names, ladders)
+
+    corpus = find_documents(args) if args else []
+    random_dir = tempfile.mkdtemp(prefix="ytm_diff_")
+    try:
+        paths = corpus + write_documents(random_documents(random_count, seed, ladders), random_dir)
+        if not paths:
+            print("Error: No documents to compare.")
+            sys.exit(1)
+
+        loaded = [load_document(path) for path in paths]
+        expected, legacy_seconds = run_legacy(paths, workers)
+        trace.debug("Ran the legacy scripts on %s documents", len(paths))
+
+        def per_document(seconds):
+            return seconds * 1000 / len(paths)
+
+        report = {
+            "documents": len(paths),
+            "random": random_count,
+            "seed": seed,
+            "legacy": {
+                "seconds": legacy_seconds,
+                "ms_per_document": per_document(legacy_seconds),
+                "crashes": sum(is_crash(outputs[kind]) for outputs in expected for kind in LEGACY_SCRIPTS),
+            },
+            "candidates": {},
+        }
+        for name in names:
+            actual, seconds = run_candidate(name, loaded, ladders)
+            report["candidates"][name] = {
+                "seconds": seconds,
+                "ms_per_document": per_document(seconds),
+                "speedup": legacy_seconds / seconds if seconds else float("inf"),
+                "divergences": [
+                    dict(divergence, path=os.path.relpath(divergence["path"], random_dir))
+                    if divergence["path"].startswith(random_dir) else divergence
+                    for divergence in divergences(paths, expected, actual)
+                ],
+            }
+    finally:
+        shutil.rmtree(random_dir, ignore_errors=True)
+
+    print_report(report, shown)
+    if report_file:
+        with open(report_file, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    # Any divergence fails the run, so the harness can gate a change
+    sys.exit(1 if any(result["divergences"] for result in report["candidates"].values()) else 0)
+
+if __name__ == "__main__":
+    tracing.run_main(main)
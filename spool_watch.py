@@ -0,0 +1,306 @@
+import sys
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from batch_journal import FAILED
+from batch_planner import BatchPlanner, DEFAULT_POLICY
+from batch_runner import BATCH_WORKERS, extract_item_audio, print_lock, process_items, read_links
+from metadata_prefetch import LinkFeed, MetadataPrefetcher, PREFETCH_WINDOW
+from metrics import LINKS_PROCESSED
+from stage_scheduler import STAGES, StageScheduler
+
+# Claimed files move to processing/, then to done/ or failed/ once all their links finished
+PROCESSING, DONE = "processing", "done"
+SPOOL_FOLDERS = (PROCESSING, DONE, FAILED)
+
+POLL_INTERVAL = 5  # Seconds between scans without inotify
+RESCAN_INTERVAL = 60  # Seconds between scans with inotify, in case an event was missed
+SETTLE_SECONDS = 2  # Files changed more recently may still be being written
+
+# Names of files still being written by their producer
+IGNORED_PREFIXES = (".",)
+IGNORED_SUFFIXES = (".tmp", ".part")
+
+# inotify(7) events: a file was closed after writing, or renamed into the directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+trace = tracing.get_tracer("spool_watch")
+
+class InotifyWatcher:
+    """Wake up when a file is written or moved into a directory (Linux only)."""
+
+    interval = RESCAN_INTERVAL
+
+    def __init__(self, directory):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux.")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+        self._descriptor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._descriptor, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self._descriptor)
+            raise OSError(error, "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        """Block until there are events or the timeout passes, and discard the events.
+
+        The directory is scanned after every wake-up, so the event details are not needed.
+        """
+        readable, _, _ = select.select([self._descriptor], [], [], timeout)
+        while readable:
+            try:
+                if not os.read(self._descriptor, 65536):
+                    break
+            except BlockingIOError:
+                break
+
+    def close(self):
+        os.close(self._descriptor)
+
+class PollingWatcher:
+    """Scan a directory at a fixed interval where inotify is not available."""
+
+    interval = POLL_INTERVAL
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+    def close(self):
+        pass
+
+def open_watcher(directory):
+    try:
+        watcher = InotifyWatcher(directory)
+        trace.debug("Watching %s with inotify", directory)
+        return watcher
+    except (OSError, AttributeError) as e:
+        trace.debug("Polling %s every %ss: %s", directory, POLL_INTERVAL, e)
+        return PollingWatcher()
+
+class SpoolDirectory:
+    """A directory that link files are dropped into.
+
+    A file is claimed by renaming it into processing/, which only one watcher
+    can do, even with several hosts sharing the directory. When all its links
+    are finished it moves to done/, or to failed/ if any link failed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        for folder in SPOOL_FOLDERS:
+            os.makedirs(os.path.join(directory, folder), exist_ok=True)
+
+    def path(self, folder, name):
+        return os.path.join(self.directory, folder, name)
+
+    def waiting(self):
+        """Return the files ready to be claimed, oldest first, and whether others are still settling."""
+        ready, settling = [], False
+        now = time.time()
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith(IGNORED_PREFIXES) \
+                        or entry.name.endswith(IGNORED_SUFFIXES):
+                    continue
+                modified = entry.stat().st_mtime
+                if now - modified < SETTLE_SECONDS:
+                    settling = True
+                    continue
+                # A file with the name of one still being handled waits for it to finish
+                if not os.path.exists(self.path(PROCESSING, entry.name)):
+                    ready.append((modified, entry.name))
+
+        return [name for _, name in sorted(ready)], settling
+
+    def claim(self, name):
+        """Move a file into processing/; False if another watcher took it first."""
+        try:
+            os.rename(os.path.join(self.directory, name), self.path(PROCESSING, name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def finish(self, name, folder):
+        """Move a claimed file to done/ or failed/, numbering it if the name is taken."""
+        target = self.path(folder, name)
+        number = 1
+        while os.path.exists(target):
+            target = self.path(folder, f"{name}.{number}")
+            number += 1
+        os.rename(self.path(PROCESSING, name), target)
+        return target
+
+    def requeue(self, names=None):
+        """Move claimed files back into the spool directory; returns how many moved."""
+        names = os.listdir(os.path.join(self.directory, PROCESSING)) if names is None else names
+        moved = 0
+        for name in names:
+            target = os.path.join(self.directory, name)
+            if os.path.exists(target):
+                continue  # A newer file with the same name was dropped meanwhile
+            os.rename(self.path(PROCESSING, name), target)
+            moved += 1
+        return moved
+
+class SpoolIngest:
+    """Claim the files of a spool directory and feed their links to a running batch."""
+
+    def __init__(self, spool, feed):
+        self.spool = spool
+        self.feed = feed
+        self.files = {}  # Claimed name: links left and links failed
+        self.owners = {}  # Link: claimed names waiting for it, oldest first
+        self.failed_files = 0
+        self._lock = threading.Lock()
+
+    def ingest(self):
+        """Claim every ready file and feed its links; returns True if others are still settling."""
+        names, settling = self.spool.waiting()
+
+        for name in names:
+            if not self.spool.claim(name):
+                continue
+            # The file is read once, right after the claim; its links live in the feed from now on
+            try:
+                links = read_links(self.spool.path(PROCESSING, name))
+            except (OSError, ValueError) as e:
+                with print_lock:
+                    print(f"Error: Failed to read spool file '{name}'. Reason: {e}")
+                self.spool.finish(name, FAILED)
+                self.failed_files += 1
+                continue
+            with print_lock:
+                print(f"Spool: Claimed {name} ({len(links)} links).")
+
+            if not links:
+                self.spool.finish(name, DONE)
+                continue
+
+            with self._lock:
+                self.files[name] = {"left": len(links), "failed": 0}
+                for link in links:
+                    self.owners.setdefault(link, deque()).append(name)
+            self.feed.extend(links)
+
+        return settling
+
+    def finished(self, link, succeeded):
+        """Count a finished link against its file, and move the file once all its links finished."""
+        with self._lock:
+            owners = self.owners[link]
+            name = owners.popleft()
+            if not owners:
+                del self.owners[link]
+
+            file = self.files[name]
+            file["left"] -= 1
+            if not succeeded:
+                file["failed"] += 1
+            if file["left"]:
+                return
+            del self.files[name]
+            if file["failed"]:
+                self.failed_files += 1
+
+        target = self.spool.finish(name, FAILED if file["failed"] else DONE)
+        with print_lock:
+            if file["failed"]:
+                print(f"Spool: {name} finished with {file['failed']} failed links: {target}")
+            else:
+                print(f"Spool: {name} finished: {target}")
+
+    def release_unfinished(self):
+        """Put the files whose links did not all finish back into the spool directory."""
+        with self._lock:
+            names = list(self.files)
+            self.files.clear()
+            self.owners.clear()
+        return self.spool.requeue(names)
+
+def watch(spool, ingest, stop, settling=False):
+    """Claim new files as they appear until stop is set."""
+    watcher = open_watcher(spool.directory)
+    try:
+        while not stop.is_set():
+            watcher.wait(SETTLE_SECONDS if settling else watcher.interval)
+            try:
+                settling = ingest.ingest()
+            except OSError as e:
+                with print_lock:
+                    print(f"Warning: Failed to scan '{spool.directory}'. Reason: {e}")
+    finally:
+        watcher.close()
+
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+def run_spool(directory, once=False, requeue=False, max_workers=None, prefetch=PREFETCH_WINDOW, stages=STAGES,
+              chains=("video", "audio"), workers=BATCH_WORKERS, policy=DEFAULT_POLICY, extract_audio=False,
+              output_dir=".", loudness_cache=None, split_chapters=False, artwork_cache=None, output_store=None,
+              audio_only=False):
+    """Handle the links of every file dropped into a spool directory, until interrupted.
+
+    All files share one worker pool, so a new file costs no process start-up.
+    With once, only the files already there are handled. Returns True if no file failed.
+    """
+    spool = SpoolDirectory(directory)
+    if requeue:
+        print(f"Spool: Requeued {spool.requeue()} files left in {PROCESSING}/.")
+    elif os.listdir(os.path.join(directory, PROCESSING)):
+        print(f"Note: Files left in {PROCESSING}/ by an interrupted run are not handled; use --requeue.")
+
+    if extract_audio:
+        os.makedirs(output_dir, exist_ok=True)  # The planner watches its free space from the start
+
+    feed = LinkFeed()
+    ingest = SpoolIngest(spool, feed)
+    scheduler = StageScheduler(stages=stages, max_workers=max_workers)
+    prefetcher = MetadataPrefetcher(feed, scheduler, window=prefetch, audio_only=audio_only)
+    planner = BatchPlanner(
+        policy, directories=(os.getcwd(), output_dir), kinds=("audio",) if audio_only else ("video", "audio"),
+        extract_audio=extract_audio,
+    )
+
+    def finish(item, state):
+        LINKS_PROCESSED.inc(result=state)
+        ingest.finished(item["link"], state == DONE)
+
+    def extract(item):
+        return extract_item_audio(item, output_dir, None, loudness_cache, split_chapters, artwork_cache, output_store)
+
+    stop = threading.Event()
+    settling = ingest.ingest()
+    if once:
+        feed.close()
+    else:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, stop_on_sigterm)  # Service managers stop the watcher this way
+        threading.Thread(target=watch, args=(spool, ingest, stop, settling), daemon=True).start()
+        print(f"Watching {directory} for link files. Press Ctrl+C to stop.")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            process_items(pool, workers, prefetcher, planner, chains, extract if extract_audio else None, finish)
+        except KeyboardInterrupt:
+            stop.set()
+            prefetcher.cancel()
+            print(f"Spool stopped; {ingest.release_unfinished()} unfinished files put back.")
+            return ingest.failed_files == 0
+        finally:
+            stop.set()
+
+    print(f"Spool finished: {ingest.failed_files} files with failed links.")
+    return ingest.failed_files == 0
@@ -0,0 +1,297 @@
+import sys
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import tracing
+from metrics import STAGE_SECONDS
+from subprocess_watchdog import kill_all, run_with_deadline
+
+# Shared files the stages read and write
+RES_LANDSCAPE_FILE = "docs/video_resolutions_landscape.txt"
+RES_PORTRAIT_FILE = "docs/video_resolutions_portrait.txt"
+VIDEO_CODEC_FILE = "docs/video_codecs.txt"
+AUDIO_CODEC_FILE = "docs/audio_codecs.txt"
+AUDIO_FORMAT_NOTE_FILE = "docs/audio_format_notes.txt"
+
+VIDEO_VIEWS = (RES_LANDSCAPE_FILE, RES_PORTRAIT_FILE, VIDEO_CODEC_FILE)
+AUDIO_VIEWS = (AUDIO_CODEC_FILE, AUDIO_FORMAT_NOTE_FILE)
+
+# Resources starting with "item:" belong to a single item and are never shared
+METADATA = "item:metadata"
+
+# Stages in declaration order; a stage depends on earlier stages producing its inputs
+STAGES = [
+    {
+        "name": "video_vocabulary",
+        "script": "video_codecs_resolutions.py",
+        "chain": "video",
+        "inputs": (METADATA,),
+        "outputs": VIDEO_VIEWS,
+    },
+    {
+        "name": "video_markers",
+        "script": "video_selections.py",
+        "chain": "video",
+        "inputs": VIDEO_VIEWS,
+        "outputs": VIDEO_VIEWS,
+    },
+    {
+        "name": "video_format_id",
+        "script": "video_format_ids.py",
+        "chain": "video",
+        "inputs": (METADATA,) + VIDEO_VIEWS,
+        "outputs": ("item:video_format_id",),
+    },
+    {
+        "name": "audio_vocabulary",
+        "script": "audio_codecs_qualities.py",
+        "chain": "audio",
+        "inputs": (METADATA,),
+        "outputs": AUDIO_VIEWS,
+    },
+    {
+        "name": "audio_markers",
+        "script": "audio_selections.py",
+        "chain": "audio",
+        "inputs": AUDIO_VIEWS,
+        "outputs": AUDIO_VIEWS,
+    },
+    {
+        "name": "audio_format_id",
+        "script": "audio_format_ids.py",
+        "chain": "audio",
+        "inputs": (METADATA,) + AUDIO_VIEWS,
+        "outputs": ("item:audio_format_id",),
+    },
+]
+
+# Only the audio chain, for runs whose output is an mp3
+AUDIO_STAGES = [stage for stage in STAGES if stage["chain"] == "audio"]
+
+# Optional stage printing one yt-dlp selector with the whole fallback chain
+SELECTOR_STAGE = {
+    "name": "format_selector",
+    "script": "format_selector.py",
+    "chain": "selector",
+    "inputs": (METADATA,) + VIDEO_VIEWS + AUDIO_VIEWS,
+    "outputs": ("item:format_selector",),
+}
+
+# Optional stage evaluating every profile in docs/profiles.ini in one pass
+PROFILES_STAGE = {
+    "name": "profile_selection",
+    "script": "profile_selection.py",
+    "chain": "profiles",
+    "inputs": (METADATA, "docs/profiles.ini"),
+    "outputs": ("item:profile_selection",),
+}
+
+ALL_STAGES = STAGES + [SELECTOR_STAGE, PROFILES_STAGE]
+
+def stage_name(script):
+    """Return the name of the stage that runs a script, which keys its deadline."""
+    for stage in ALL_STAGES:
+        if stage["script"] == script:
+            return stage["name"]
+    return os.path.splitext(script)[0]
+
+# Maximum number of concurrent runs per stage across all items
+STAGE_LIMITS = {
+    "video_vocabulary": 2,
+    "video_markers": 1,
+    "video_format_id": 4,
+    "audio_vocabulary": 2,
+    "audio_markers": 1,
+    "audio_format_id": 4,
+    "format_selector": 4,
+    "profile_selection": 4,
+}
+
+trace = tracing.get_tracer("stage_scheduler")
+
+class ReadWriteLock:
+    """Lock that admits many readers or a single writer."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire(self, write):
+        with self._condition:
+            if write:
+                while self._writer or self._readers:
+                    self._condition.wait()
+                self._writer = True
+            else:
+                while self._writer:
+                    self._condition.wait()
+                self._readers += 1
+
+    def release(self, write):
+        with self._condition:
+            if write:
+                self._writer = False
+            else:
+                self._readers -= 1
+            self._condition.notify_all()
+
+def is_shared(resource):
+    """Check whether a resource is shared between items."""
+    return not resource.startswith("item:")
+
+def stage_dependencies(stages):
+    """Map each stage name to the earlier stages producing one of its inputs."""
+    dependencies = {}
+
+    for index, stage in enumerate(stages):
+        dependencies[stage["name"]] = {
+            earlier["name"]
+            for earlier in stages[:index]
+            if set(earlier["outputs"]) & set(stage["inputs"])
+        }
+
+    return dependencies
+
+def run_stage(stage, json_file):
+    """Execute a stage script with the given JSON file and return its result."""
+    command = ["python", stage["script"], json_file]
+    trace.debug("Executing: %s", " ".join(command))
+
+    started = time.perf_counter()
+    result = run_with_deadline(command, stage["name"])
+    STAGE_SECONDS.observe(
+        time.perf_counter() - started, stage=stage["name"], result="ok" if result.returncode == 0 else "error"
+    )
+    if result.stderr and trace.level <= tracing.DEBUG:
+        tracing.write_line(result.stderr.rstrip())  # The stage's own trace output
+    return result
+
+class StageScheduler:
+    """Run the stages of many items on a worker pool, respecting dependencies."""
+
+    def __init__(self, stages=STAGES, max_workers=None, stage_limits=STAGE_LIMITS):
+        self.stages = stages
+        self.dependencies = stage_dependencies(stages)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.stage_slots = {
+            stage["name"]: threading.Semaphore(stage_limits.get(stage["name"], self.max_workers))
+            for stage in stages
+        }
+        self.resource_locks = {}
+        for stage in stages:
+            for resource in stage["inputs"] + stage["outputs"]:
+                if is_shared(resource):
+                    self.resource_locks.setdefault(resource, ReadWriteLock())
+
+    def _execute(self, stage, json_file):
+        """Run one stage while holding its concurrency slot and resource locks."""
+        # Writers take shared resources exclusively, readers share them
+        writes = {r for r in stage["outputs"] if is_shared(r)}
+        locks = sorted({r for r in stage["inputs"] if is_shared(r)} | writes)
+
+        with self.stage_slots[stage["name"]]:
+            for resource in locks:
+                self.resource_locks[resource].acquire(resource in writes)
+            try:
+                return run_stage(stage, json_file)
+            finally:
+                for resource in reversed(locks):
+                    self.resource_locks[resource].release(resource in writes)
+
+    def run(self, json_files):
+        """Run every stage for every item and return {json_file: {stage: result}}."""
+        results = {json_file: {} for json_file in json_files}
+        stages_by_name = {stage["name"]: stage for stage in self.stages}
+        dependents = {
+            name: [other for other, deps in self.dependencies.items() if name in deps]
+            for name in self.dependencies
+        }
+        completed, submitted = set(), set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+
+            def submit_ready(json_file, names):
+                """Submit every stage whose dependencies have all completed."""
+                for name in names:
+                    if (json_file, name) in submitted:
+                        continue
+                    if all((json_file, dep) in completed for dep in self.dependencies[name]):
+                        submitted.add((json_file, name))
+                        future = executor.submit(self._execute, stages_by_name[name], json_file)
+                        running[future] = (json_file, name)
+
+            for json_file in json_files:
+                submit_ready(json_file, stages_by_name)
+
+            try:
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        json_file, name = running.pop(future)
+                        result = future.result()
+                        results[json_file][name] = result
+
+                        # Stages depending on a failed stage are never submitted
+                        if result.returncode == 0:
+                            completed.add((json_file, name))
+                            submit_ready(json_file, dependents[name])
+                        else:
+                            trace.debug("%s failed for %s; skipping its dependents.", name, json_file)
+            except KeyboardInterrupt:
+                # Stages run in their own sessions, so stop them instead of waiting out their deadlines
+                executor.shutdown(wait=False, cancel_futures=True)
+                kill_all()
+                raise
+
+        return results
+
+def chain_output(stage_results, chain, stages=ALL_STAGES):
+    """Join the printed output of a chain's stages, like the chain scripts do."""
+    outputs = [
+        stage_results[stage["name"]].stdout.strip()
+        for stage in stages
+        if stage["chain"] == chain and stage["name"] in stage_results
+    ]
+    return "\n".join(output for output in outputs if output)
+
+def failed_stage(stage_results, stages=ALL_STAGES):
+    """Return the first stage that failed, or None."""
+    for stage in stages:
+        result = stage_results.get(stage["name"])
+        if result is not None and result.returncode != 0:
+            return stage
+    return None
+
+def main():
+    """Run all stages for the given JSON files."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    if not args:
+        print("Error: No JSON file provided.")
+        sys.exit(1)
+
+    results = StageScheduler(stages=STAGES + [SELECTOR_STAGE]).run(args)
+
+    exit_code = 0
+    for json_file in args:
+        stage = failed_stage(results[json_file])
+        if stage:
+            print(f"Error: {stage['script']} failed for '{json_file}'.")
+            print(results[json_file][stage["name"]].stderr)
+            exit_code = 1
+            continue
+        print(chain_output(results[json_file], "video"))
+        print(chain_output(results[json_file], "audio"))
+        print(chain_output(results[json_file], "selector"))
+
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    tracing.run_main(main)
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import random
+import signal
+import subprocess
+import threading
+
+# File with per-stage deadlines, one `stage=seconds` per line
+STAGE_DEADLINES_FILE = "docs/stage_deadlines.txt"
+
+DEFAULT_DEADLINE = 300  # Seconds
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 1.0  # Seconds, doubled on every retry
+
+# Return code reported when a stage ran out of time on every attempt
+TIMEOUT_RETURNCODE = 124
+
+# Set for processes started under a watchdog; nested calls share the group
+WATCHDOG_ENV = "YTM_WATCHDOG_GROUP"
+
+IS_WINDOWS = sys.platform.startswith("win")
+
+_active_processes = set()
+_summary = {}  # stage -> {"timeouts": n, "retries": n, "failed": n}
+_lock = threading.Lock()
+
+def load_deadlines():
+    """Load `stage=seconds` deadlines and the `retries` count from the deadlines file."""
+    deadlines = {}
+
+    if not os.path.exists(STAGE_DEADLINES_FILE):
+        return deadlines
+
+    with open(STAGE_DEADLINES_FILE, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or "=" not in line:
+                continue
+            name, value = (part.strip() for part in line.split("=", 1))
+            try:
+                deadlines[name] = float(value)
+            except ValueError:
+                continue  # Ignore malformed entries
+
+    return deadlines
+
+def backoff_delay(attempt):
+    """Return a jittered exponential backoff delay for the given attempt."""
+    return BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+def process_group_options():
+    """Return Popen options that put a top-level child into its own process group."""
+    if os.environ.get(WATCHDOG_ENV):
+        return {}  # Already inside a watched group; the outer watchdog kills everything
+    if IS_WINDOWS:
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+def kill_process_tree(process, own_group):
+    """Kill a child and, when it leads its own group, everything it started."""
+    try:
+        if IS_WINDOWS:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        elif own_group:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass  # Already gone
+
+def record(stage, key):
+    """Count an event for a stage in the run summary."""
+    with _lock:
+        entry = _summary.setdefault(stage, {"timeouts": 0, "retries": 0, "failed": 0})
+        entry[key] += 1
+
+def track_process(process, own_group):
+    """Have kill_all() also kill a process started outside run_with_deadline."""
+    with _lock:
+        _active_processes.add((process, own_group))
+
+def untrack_process(process, own_group):
+    with _lock:
+        _active_processes.discard((process, own_group))
+
+def run_with_deadline(command, stage, capture_output=True, deadline=None, retries=None):
+    """Run a command like subprocess.run, killing and retrying it when it hangs."""
+    deadlines = load_deadlines()
+    if deadline is None:
+        deadline = deadlines.get(stage, deadlines.get("default", DEFAULT_DEADLINE))
+    retries = int(deadlines.get("retries", DEFAULT_RETRIES)) if retries is None else retries
+
+    options = process_group_options()
+    own_group = bool(options)
+    env = dict(os.environ, **{WATCHDOG_ENV: "1"})
+    pipe = subprocess.PIPE if capture_output else None
+
+    for attempt in range(retries + 1):
+        process = subprocess.Popen(command, stdout=pipe, stderr=pipe, text=True, env=env, **options)
+        track_process(process, own_group)
+
+        try:
+            stdout, stderr = process.communicate(timeout=deadline)
+            return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process, own_group)
+            process.communicate()  # Reap the killed process
+            record(stage, "timeouts")
+        except BaseException:
+            # The child runs in its own session, so a Ctrl-C in the terminal never reaches it
+            kill_process_tree(process, own_group)
+            raise
+        finally:
+            untrack_process(process, own_group)
+
+        if attempt < retries:
+            record(stage, "retries")
+            time.sleep(backoff_delay(attempt))
+
+    record(stage, "failed")
+    message = f"Error: {stage} timed out after {deadline:g}s ({retries + 1} attempts)."
+    return subprocess.CompletedProcess(command, TIMEOUT_RETURNCODE, "", message)
+
+def kill_all():
+    """Kill every process currently running under a watchdog."""
+    with _lock:
+        processes = list(_active_processes)
+
+    for process, own_group in processes:
+        kill_process_tree(process, own_group)
+
+def run_summary():
+    """Return a copy of the per-stage timeout counters."""
+    with _lock:
+        return {stage: dict(entry) for stage, entry in _summary.items()}
+
+def print_run_summary():
+    """Print the timeout counters, if any stage timed out."""
+    summary = run_summary()
+    if not summary:
+        return
+
+    print("=== Timeouts ===")
+    for stage, entry in sorted(summary.items()):
+        print(f"- {stage}: {entry['timeouts']} timeouts, {entry['retries']} retries, {entry['failed']} failed")
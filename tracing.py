@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+from collections import deque
+
+# Trace settings, inherited by every stage started from this process:
+#   YTM_TRACE=debug                        every module at debug
+#   YTM_TRACE=info,video_format_ids=trace  one module down to each checked format
+TRACE_ENV = "YTM_TRACE"
+
+LEVELS = {"trace": 5, "debug": 10, "info": 20, "off": 100}
+TRACE, DEBUG, INFO, OFF = LEVELS["trace"], LEVELS["debug"], LEVELS["info"], LEVELS["off"]
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+
+# The last debug records are kept even when nothing is printed, and written out if the job fails
+RING_SIZE = 200
+
+_ring = deque(maxlen=RING_SIZE)
+_tracers = {}
+
+def parse_settings(value):
+    """Parse 'level,module=level,...' into {module or '*': level}."""
+    settings = {}
+
+    for entry in (value or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        module, _, level = entry.rpartition("=")
+        if level.lower() in LEVELS:
+            settings[module or "*"] = LEVELS[level.lower()]
+
+    return settings
+
+class Tracer:
+    """Per-module trace output; messages are only formatted when they are printed or dumped."""
+
+    def __init__(self, name):
+        self.name = name
+        self.apply(_settings)
+
+    def apply(self, settings):
+        self.level = settings.get(self.name, settings.get("*", OFF))
+        # Hot loops check this before building any arguments
+        self.tracing = self.level <= TRACE
+
+    def _emit(self, level, message, args):
+        if level >= self.level:
+            write_line(format_record(self.name, level, message, args))
+        elif level >= DEBUG:
+            _ring.append((time.time(), self.name, level, message, args))
+
+    def trace(self, message, *args):
+        """Per-format detail; callers guard it with `if trace.tracing:`."""
+        if self.tracing:
+            self._emit(TRACE, message, args)
+
+    def debug(self, message, *args):
+        self._emit(DEBUG, message, args)
+
+    def info(self, message, *args):
+        self._emit(INFO, message, args)
+
+def format_record(name, level, message, args):
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError) as e:
+            message = f"{message} {args} (format error: {e})"
+    return f"[{LEVEL_NAMES[level]}] {name}: {message}"
+
+def write_line(line):
+    """Write to stderr so a stage's stdout stays its result."""
+    try:
+        print(line, file=sys.stderr)
+    except UnicodeEncodeError:
+        print(line.encode("ascii", "ignore").decode("ascii"), file=sys.stderr)
+
+def get_tracer(name):
+    """Return the tracer of a module, created once."""
+    if name not in _tracers:
+        _tracers[name] = Tracer(name)
+    return _tracers[name]
+
+def configure(value):
+    """Apply trace settings here and pass them on to child processes."""
+    global _settings
+    os.environ[TRACE_ENV] = value
+    _settings = parse_settings(value)
+    for tracer in _tracers.values():
+        tracer.apply(_settings)
+
+def enable_debug():
+    """Handle a script's -d flag: debug output for every module, unless set more finely."""
+    settings = os.environ.get(TRACE_ENV, "")
+    if parse_settings(settings).get("*", OFF) > DEBUG:
+        configure(f"{settings},debug" if settings else "debug")
+
+def dump_ring(reason=None):
+    """Write out the retained debug records that were not printed, oldest first."""
+    if not _ring:
+        return
+    write_line(f"--- Last {len(_ring)} debug records{f' ({reason})' if reason else ''} ---")
+    for timestamp, name, level, message, args in _ring:
+        clock = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        write_line(f"{clock} {format_record(name, level, message, args)}")
+    _ring.clear()
+
+def run_main(main):
+    """Run a script's main function, dumping the debug records if it fails."""
+    try:
+        main()
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            dump_ring(f"exit status {e.code}")
+        raise
+    except BaseException as e:
+        dump_ring(type(e).__name__)
+        raise
+
+_settings = parse_settings(os.environ.get(TRACE_ENV))
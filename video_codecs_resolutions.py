@@ -3,23 +3,18 @@ import os
 import json
 import re
 
+import tracing
+from observed_values import record_values, regenerate_view
+
 # File paths
 RES_LANDSCAPE_FILE = "docs/video_resolutions_landscape.txt"
 RES_PORTRAIT_FILE = "docs/video_resolutions_portrait.txt"
 VIDEO_CODEC_FILE = "docs/video_codecs.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        print(f"[DEBUG] {message}")
+trace = tracing.get_tracer("video_codecs_resolutions")
 
 def validate_input():
     """Validate command-line arguments and check if the JSON file exists."""
-    global DEBUG_MODE
-
     if len(sys.argv) < 2:
         print("Error: No JSON file provided.")
         sys.exit(1)
@@ -28,7 +23,7 @@ def validate_input():
 
     # Check if debug mode is enabled
     if "-d" in args:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         args.remove("-d")  # Remove debug flag from arguments
 
     json_file = args[0] if args else None
@@ -45,7 +40,7 @@ def validate_input():
         print(f"Error: File '{json_file}' is not a JSON file.")
         sys.exit(1)
 
-    log_debug(f"Validated input file: {json_file}")
+    trace.debug("Validated input file: %s", json_file)
     return json_file
 
 def load_json(json_file):
@@ -53,7 +48,7 @@ def load_json(json_file):
     try:
         with open(json_file, "r", encoding="utf-8") as file:
             data = json.load(file)
-            log_debug("Successfully loaded JSON data.")
+            trace.debug("Successfully loaded JSON data.")
             return data
     except Exception as e:
         print(f"Error: Failed to read JSON file '{json_file}'. Reason: {e}")
@@ -65,11 +60,6 @@ def determine_orientation(width, height):
         return "Landscape"
     return "Portrait"
 
-def extract_resolution_key(resolution):
-    """Extract the first numeric value (A) from 'AxB' format for sorting."""
-    match = re.match(r"(\d+)", resolution)
-    return int(match.group(1)) if match else float('inf')
-
 def parse_resolution(resolution):
     """Extract width and height from 'AxB' resolution format."""
     match = re.match(r"(\d+)x(\d+)", resolution)
@@ -98,20 +88,6 @@ def load_existing_data(filepath):
 
     return data
 
-def save_sorted_resolutions(filepath, data):
-    """Sort resolutions numerically by A in AxB and save to file."""
-    sorted_values = sorted(data.keys(), key=extract_resolution_key)
-    with open(filepath, "w", encoding="utf-8") as file:
-        for value in sorted_values:
-            file.write(f"{data[value]}{value}\n")  # Restore symbol before value
-
-def save_sorted_codecs(filepath, data):
-    """Sort codecs alphabetically and save to file."""
-    sorted_values = sorted(data.keys(), key=lambda x: x.lower())
-    with open(filepath, "w", encoding="utf-8") as file:
-        for value in sorted_values:
-            file.write(f"{data[value]}{value}\n")
-
 def normalize_codec(codec):
     """Normalize codecs into categories."""
     if codec.startswith("av01."):
@@ -156,23 +132,22 @@ def process_json(json_file):
             codecs.add(normalized_codec)
 
     orientation = determine_orientation(*highest_resolution)
-    log_debug(f"Video Orientation: {orientation}")
+    trace.debug("Video Orientation: %s", orientation)
 
     resolution_file = RES_LANDSCAPE_FILE if orientation == "Landscape" else RES_PORTRAIT_FILE
+
+    # Observations are appended; the sorted views are only rewritten for new values
+    record_values(resolution_file, resolutions)
+    record_values(VIDEO_CODEC_FILE, codecs)
+
     existing_resolutions = load_existing_data(resolution_file)
     existing_codecs = load_existing_data(VIDEO_CODEC_FILE)
 
-    # Update resolution and codec files
-    for res in resolutions:
-        if res not in existing_resolutions:
-            existing_resolutions[res] = ""
-
-    for codec in codecs:
-        if codec not in existing_codecs:
-            existing_codecs[codec] = ""
+    if not resolutions.issubset(existing_resolutions):
+        regenerate_view(resolution_file, resolutions)
 
-    save_sorted_resolutions(resolution_file, existing_resolutions)
-    save_sorted_codecs(VIDEO_CODEC_FILE, existing_codecs)
+    if not codecs.issubset(existing_codecs):
+        regenerate_view(VIDEO_CODEC_FILE, codecs)
 
     # print(f"Updated {resolution_file} and {VIDEO_CODEC_FILE}")
 
@@ -182,4 +157,4 @@ def main():
     process_json(json_file)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
@@ -1,29 +1,23 @@
 import sys
 import os
 import json
+from bisect import bisect_left, bisect_right
+
+import tracing
+from bandwidth_selection import load_budget_settings, select_by_bandwidth
+from metrics import SELECTION_RUNGS
 
 # File paths
 RES_LANDSCAPE_FILE = "docs/video_resolutions_landscape.txt"
 RES_PORTRAIT_FILE = "docs/video_resolutions_portrait.txt"
 VIDEO_CODEC_FILE = "docs/video_codecs.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        try:
-            print(f"[DEBUG] {message}")
-        except UnicodeEncodeError:
-            print(f"[DEBUG] {message}".encode("ascii", "ignore").decode("ascii"))
+trace = tracing.get_tracer("video_format_ids")
 
 def validate_input():
     """Validate command-line arguments and check if debug mode is enabled."""
-    global DEBUG_MODE
-
     if "-d" in sys.argv:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         sys.argv.remove("-d")  # Remove debug flag from arguments
 
     if len(sys.argv) < 2:
@@ -40,7 +34,7 @@ def validate_input():
         print(f"Error: File '{json_file}' is not a JSON file.")
         sys.exit(1)
 
-    log_debug(f"Validated input file: {json_file}")
+    trace.debug("Validated input file: %s", json_file)
     return json_file
 
 def load_prioritized_data(file_path):
@@ -48,7 +42,7 @@ def load_prioritized_data(file_path):
     primary, secondary = None, None
 
     if not os.path.exists(file_path):
-        log_debug(f"File '{file_path}' does not exist. Skipping.")
+        trace.debug("File '%s' does not exist. Skipping.", file_path)
         return primary, secondary
 
     with open(file_path, "r", encoding="utf-8") as file:
@@ -59,7 +53,7 @@ def load_prioritized_data(file_path):
             elif line.startswith("#") and secondary is None:
                 secondary = line[1:]  # Second priority
 
-    log_debug(f"Loaded priority data from {file_path}: Primary: {primary}, Secondary: {secondary}")
+    trace.debug("Loaded priority data from %s: Primary: %s, Secondary: %s", file_path, primary, secondary)
     return primary, secondary
 
 def normalize_codec(codec):
@@ -82,15 +76,60 @@ def determine_orientation(json_data):
             max_width, max_height = width, height
 
     orientation = "Landscape" if max_width >= max_height else "Portrait"
-    log_debug(f"Determined Video Orientation: {orientation}")
+    trace.debug("Determined Video Orientation: %s", orientation)
     return orientation
 
-def find_matching_format_ids(json_data, width, height, primary_codec, secondary_codec):
-    """Find `format_id` based on resolution and codec priority."""
+def build_resolution_index(json_data, orientation):
+    """Sort the video formats of one orientation by pixel count."""
+    index = []
+
+    for fmt in json_data.get("formats", []):
+        if fmt.get("vcodec") == "none":
+            continue  # Skip non-video formats
+
+        fmt_width, fmt_height = fmt.get("width"), fmt.get("height")
+        if not fmt_width or not fmt_height:
+            continue
+        if ("Landscape" if fmt_width >= fmt_height else "Portrait") != orientation:
+            continue
+
+        index.append((fmt_width * fmt_height, fmt))
+
+    index.sort(key=lambda entry: entry[0])  # Stable, keeps the original order per resolution
+    return index
+
+def find_nearest_format_id(index, width, height, secondary_resolution, primary_codec, secondary_codec):
+    """Find the format nearest at or below the preferred resolution, bounded by the secondary one."""
+    pixel_counts = [pixels for pixels, _ in index]
+
+    position = bisect_right(pixel_counts, width * height)
+    if position == 0:
+        return None  # Every format is larger than the preferred resolution
+
+    nearest = pixel_counts[position - 1]
+    if secondary_resolution:
+        secondary_width, secondary_height = map(int, secondary_resolution.split("x"))
+        if nearest < secondary_width * secondary_height:
+            trace.debug("Nearest resolution is below the secondary resolution %s.", secondary_resolution)
+            return None
+
+    formats = [fmt for _, fmt in index[bisect_left(pixel_counts, nearest):position]]
+    codecs = [normalize_codec(fmt.get("vcodec") or "") for fmt in formats]
+
+    for codec in (primary_codec, secondary_codec):
+        if codec in codecs:
+            return formats[codecs.index(codec)].get("format_id")
+    return formats[0].get("format_id")
+
+def select_video_format(json_data, width, height, primary_codec, secondary_codec, secondary_resolution=None, orientation=None):
+    """Select a `format_id` based on resolution and codec priority.
+
+    Returns (format_id, rung), where rung names the rule that decided; (None, None) if none did.
+    """
     format_id_candidates = []
     selected_format_id = None
 
-    log_debug(f"Searching for format IDs with width={width}, height={height}, primary_codec={primary_codec}, secondary_codec={secondary_codec}")
+    trace.debug("Searching for format IDs with width=%s, height=%s, primary_codec=%s, secondary_codec=%s", width, height, primary_codec, secondary_codec)
 
     for fmt in json_data.get("formats", []):
         if fmt.get("vcodec") == "none":
@@ -100,7 +139,8 @@ def find_matching_format_ids(json_data, width, height, primary_codec, secondary_
         fmt_codec = normalize_codec(fmt.get("vcodec"))
         fmt_id = fmt.get("format_id")
 
-        log_debug(f"Checking format: ID={fmt_id}, Width={fmt_width}, Height={fmt_height}, Codec={fmt_codec}")
+        if trace.tracing:
+            trace.trace("Checking format: ID=%s, Width=%s, Height=%s, Codec=%s", fmt_id, fmt_width, fmt_height, fmt_codec)
 
         # Match resolution (width first, then height)
         if fmt_width == width or fmt_height == height:
@@ -108,24 +148,49 @@ def find_matching_format_ids(json_data, width, height, primary_codec, secondary_
 
             # Match primary codec (`@codec`)
             if fmt_codec == primary_codec:
-                log_debug(f"✅ Found exact match: {fmt_id} (Primary Codec)")
-                print(fmt_id)  # Print immediately if perfect match
-                return
+                trace.debug("✅ Found exact match: %s (Primary Codec)", fmt_id)
+                return fmt_id, "primary"  # Return immediately if perfect match
 
             # Match secondary codec (`#codec`)
             if fmt_codec == secondary_codec and selected_format_id is None:
-                log_debug(f"⚠️ Found second priority match: {fmt_id} (Secondary Codec)")
+                trace.trace("⚠️ Found second priority match: %s (Secondary Codec)", fmt_id)
                 selected_format_id = fmt_id
 
-    # Print best alternative or fallback
+    # Return best alternative
     if selected_format_id:
-        log_debug(f"✅ Using secondary codec match: {selected_format_id}")
-        print(selected_format_id)
+        trace.debug("✅ Using secondary codec match: %s", selected_format_id)
+        return selected_format_id, "secondary"
     elif format_id_candidates:
-        log_debug(f"✅ Using best available resolution match: {format_id_candidates[0]}")
-        print(format_id_candidates[0])  # Print first available resolution match
+        trace.debug("✅ Using best available resolution match: %s", format_id_candidates[0])
+        return format_id_candidates[0], "resolution"  # First available resolution match
+
+    # No exact resolution match; fall back to the nearest smaller resolution
+    index = build_resolution_index(json_data, orientation or determine_orientation(json_data))
+    nearest_format_id = find_nearest_format_id(index, width, height, secondary_resolution, primary_codec, secondary_codec)
+
+    if nearest_format_id:
+        trace.debug("✅ Using nearest resolution match: %s", nearest_format_id)
+        return nearest_format_id, "nearest"
+    return None, None
+
+def select_video_format_id(json_data, width, height, primary_codec, secondary_codec, secondary_resolution=None, orientation=None):
+    """Select a `format_id` based on resolution and codec priority, or None."""
+    return select_video_format(
+        json_data, width, height, primary_codec, secondary_codec, secondary_resolution, orientation
+    )[0]
+
+def find_matching_format_ids(json_data, width, height, primary_codec, secondary_codec, secondary_resolution=None, orientation=None):
+    """Find `format_id` based on resolution and codec priority and print it."""
+    selected_format_id, rung = select_video_format(
+        json_data, width, height, primary_codec, secondary_codec, secondary_resolution, orientation
+    )
+
+    if selected_format_id:
+        SELECTION_RUNGS.inc(kind="video", rung=rung)
+        print(selected_format_id)
     else:
-        log_debug(f"⚠️ No matching format found. Using 'bv'.")
+        trace.debug("⚠️ No matching format found. Using 'bv'.")
+        SELECTION_RUNGS.inc(kind="video", rung="fallback")
         print("bv", end="")  # No match found
 
 def process_format_ids(json_file):
@@ -141,6 +206,14 @@ def process_format_ids(json_file):
         print("Error: 'formats' data missing in JSON file.")
         sys.exit(1)
 
+    # A bandwidth selection mode, when configured, takes precedence over the markers
+    bandwidth_format_id = select_by_bandwidth(metadata, "video", load_budget_settings())
+    if bandwidth_format_id:
+        trace.debug("✅ Using bandwidth selection: %s", bandwidth_format_id)
+        SELECTION_RUNGS.inc(kind="video", rung="bandwidth")
+        print(bandwidth_format_id)
+        return
+
     # Determine orientation
     orientation = determine_orientation(metadata)
 
@@ -154,7 +227,7 @@ def process_format_ids(json_file):
         sys.exit(1)
 
     width, height = map(int, primary_res.split("x"))
-    find_matching_format_ids(metadata, width, height, primary_codec, secondary_codec)
+    find_matching_format_ids(metadata, width, height, primary_codec, secondary_codec, secondary_res, orientation)
 
 def main():
     """Main execution."""
@@ -162,4 +235,4 @@ def main():
     process_format_ids(json_file)
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
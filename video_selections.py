@@ -1,31 +1,25 @@
 import sys
 import os
 
+import tracing
+
 # File paths
 RES_LANDSCAPE_FILE = "docs/video_resolutions_landscape.txt"
 RES_PORTRAIT_FILE = "docs/video_resolutions_portrait.txt"
 VIDEO_CODEC_FILE = "docs/video_codecs.txt"
 
-# Global debug flag
-DEBUG_MODE = False
-
-def log_debug(message):
-    """Prints debug messages only if debug mode is enabled."""
-    if DEBUG_MODE:
-        print(f"[DEBUG] {message}")
+trace = tracing.get_tracer("video_selections")
 
 def validate_input():
     """Validate command-line arguments and check if debug mode is enabled."""
-    global DEBUG_MODE
-
     if "-d" in sys.argv:
-        DEBUG_MODE = True
+        tracing.enable_debug()
         sys.argv.remove("-d")  # Remove debug flag from arguments
 
 def load_resolutions(file_path):
     """Load resolutions from a file and return them as a list."""
     if not os.path.exists(file_path):
-        log_debug(f"File '{file_path}' does not exist. Skipping.")
+        trace.debug("File '%s' does not exist. Skipping.", file_path)
         return []
 
     with open(file_path, "r", encoding="utf-8") as file:
@@ -41,19 +35,19 @@ def ensure_priority_markers(resolutions):
     has_at = any(res.startswith("@") for res in resolutions)
 
     if has_at:
-        log_debug("Priority markers found. No changes needed.")
+        trace.debug("Priority markers found. No changes needed.")
         return resolutions  # No changes needed
 
     # Select the highest resolution (last item in sorted list) and mark it with `@`
     if resolutions:
         resolutions[-1] = "@" + resolutions[-1]
-        log_debug(f"No priority markers found. Assigned '@' to: {resolutions[-1]}")
+        trace.debug("No priority markers found. Assigned '@' to: %s", resolutions[-1])
     return resolutions
 
 def update_codecs():
     """Ensure `vp09` is the highest priority codec and `av01` is second."""
     if not os.path.exists(VIDEO_CODEC_FILE):
-        log_debug(f"File '{VIDEO_CODEC_FILE}' does not exist. Skipping.")
+        trace.debug("File '%s' does not exist. Skipping.", VIDEO_CODEC_FILE)
         return
 
     with open(VIDEO_CODEC_FILE, "r", encoding="utf-8") as file:
@@ -110,7 +104,7 @@ def update_codecs():
     with open(VIDEO_CODEC_FILE, "w", encoding="utf-8") as file:
         file.write("\n".join(updated_codecs) + "\n")
 
-    log_debug(f"Updated codec priorities: {', '.join(updated_codecs)}")
+    trace.debug("Updated codec priorities: %s", ', '.join(updated_codecs))
 
 def process_selections():
     """Process resolutions and codecs selection."""
@@ -137,4 +131,4 @@ def main():
     process_selections()
 
 if __name__ == "__main__":
-    main()
+    tracing.run_main(main)
@@ -0,0 +1,315 @@
+import sys
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import socketserver
+
+import tracing
+from batch_runner import read_links
+from metadata_fetch import fetch_metadata_file
+from metrics import LINKS_PROCESSED, DEFAULT_METRICS_PORT, TextfileWriter, serve_metrics
+from stage_scheduler import AUDIO_STAGES, STAGES, StageScheduler, chain_output, failed_stage
+
+DEFAULT_QUEUE_DB = "work_queue.db"
+DEFAULT_BROKER_PORT = 8765
+
+VISIBILITY_TIMEOUT = 600  # Seconds a lease stays valid without a heartbeat
+HEARTBEAT_INTERVAL = 60  # Seconds between lease extensions while working
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5  # Seconds a worker waits when the queue is empty
+
+trace = tracing.get_tracer("work_queue")
+
+class SQLiteQueue:
+    """Work queue in a SQLite file that workers on several hosts can share."""
+
+    def __init__(self, path=DEFAULT_QUEUE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                link TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated REAL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_expires)")
+
+    def _transaction(self, callback):
+        """Run a callback inside an immediate (write-locking) transaction."""
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = callback(cursor)
+                cursor.execute("COMMIT")
+                return result
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, links):
+        """Add links to the queue and return how many were added."""
+        now = time.time()
+        return self._transaction(lambda cursor: cursor.executemany(
+            "INSERT INTO items (link, updated) VALUES (?, ?)", [(link, now) for link in links]
+        ).rowcount)
+
+    def lease(self, owner, timeout=VISIBILITY_TIMEOUT):
+        """Lease the next pending or expired item to a worker, or return None."""
+        def take(cursor):
+            now = time.time()
+            # Expired leases that used up their attempts are given up for good
+            cursor.execute(
+                "UPDATE items SET state = 'failed', updated = ? "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, MAX_ATTEMPTS),
+            )
+            row = cursor.execute(
+                "SELECT id, link, attempts FROM items "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                "UPDATE items SET state = 'leased', owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (owner, now + timeout, now, row[0]),
+            )
+            return {"id": row[0], "link": row[1], "attempts": row[2] + 1}
+
+        return self._transaction(take)
+
+    def heartbeat(self, item_id, owner, timeout=VISIBILITY_TIMEOUT):
+        """Extend a lease; returns False when the lease was lost to another worker."""
+        now = time.time()
+        return self._transaction(lambda cursor: cursor.execute(
+            "UPDATE items SET lease_expires = ?, updated = ? "
+            "WHERE id = ? AND owner = ? AND state = 'leased'",
+            (now + timeout, now, item_id, owner),
+        ).rowcount == 1)
+
+    def complete(self, item_id, owner, success, result):
+        """Report an item's result; failures go back to the queue until attempts run out."""
+        def finish(cursor):
+            row = cursor.execute(
+                "SELECT attempts FROM items WHERE id = ? AND owner = ? AND state = 'leased'",
+                (item_id, owner),
+            ).fetchone()
+            if row is None:
+                return False  # The lease expired and the item belongs to someone else now
+            if success:
+                state = "done"
+            else:
+                state = "failed" if row[0] >= MAX_ATTEMPTS else "pending"
+            cursor.execute(
+                "UPDATE items SET state = ?, owner = NULL, lease_expires = NULL, result = ?, updated = ? "
+                "WHERE id = ?",
+                (state, json.dumps(result), time.time(), item_id),
+            )
+            return True
+
+        return self._transaction(finish)
+
+    def stats(self):
+        """Return the number of items per state."""
+        with self._lock:
+            rows = self._connection.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+        return dict(rows)
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    """Serve queue operations as JSON lines over TCP."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                operation = request.pop("op")
+                if operation not in ("enqueue", "lease", "heartbeat", "complete", "stats"):
+                    raise ValueError(f"Unknown operation '{operation}'.")
+                response = {"ok": True, "result": getattr(self.server.queue, operation)(**request)}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+class Broker(socketserver.ThreadingTCPServer):
+    """Local TCP broker in front of a SQLite queue."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, queue, host="127.0.0.1", port=DEFAULT_BROKER_PORT):
+        super().__init__((host, port), BrokerHandler)
+        self.queue = queue
+
+class BrokerClient:
+    """Queue interface that forwards every operation to a broker."""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_BROKER_PORT):
+        self.address = (host, port)
+
+    def _call(self, operation, **arguments):
+        with socket.create_connection(self.address, timeout=30) as connection:
+            connection.sendall((json.dumps({"op": operation, **arguments}) + "\n").encode("utf-8"))
+            response = json.loads(connection.makefile("r", encoding="utf-8").readline())
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def enqueue(self, links):
+        return self._call("enqueue", links=links)
+
+    def lease(self, owner, timeout=VISIBILITY_TIMEOUT):
+        return self._call("lease", owner=owner, timeout=timeout)
+
+    def heartbeat(self, item_id, owner, timeout=VISIBILITY_TIMEOUT):
+        return self._call("heartbeat", item_id=item_id, owner=owner, timeout=timeout)
+
+    def complete(self, item_id, owner, success, result):
+        return self._call("complete", item_id=item_id, owner=owner, success=success, result=result)
+
+    def stats(self):
+        return self._call("stats")
+
+def process_link(link, scheduler, audio_only=False):
+    """Fetch a link's metadata and run its stages; returns (success, result)."""
+    metadata_file, error = fetch_metadata_file(link, audio_only)
+    if metadata_file is None:
+        return False, {"error": "Failed to retrieve metadata.", "details": error}
+
+    stage_results = scheduler.run([metadata_file])[metadata_file]
+    stage = failed_stage(stage_results)
+    if stage:
+        result = stage_results[stage["name"]]
+        return False, {"error": f"{stage['script']} failed.", "details": result.stdout + result.stderr}
+
+    return True, {
+        "metadata_file": metadata_file,
+        "video": chain_output(stage_results, "video"),
+        "audio": chain_output(stage_results, "audio"),
+    }
+
+def run_worker(queue, owner, exit_when_empty=False, timeout=VISIBILITY_TIMEOUT, audio_only=False):
+    """Lease and process items until the queue is empty (or forever)."""
+    scheduler = StageScheduler(stages=AUDIO_STAGES if audio_only else STAGES)
+    processed = 0
+
+    while True:
+        item = queue.lease(owner, timeout)
+        if item is None:
+            if exit_when_empty:
+                return processed
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        trace.debug("Leased item %s (attempt %s): %s", item["id"], item["attempts"], item["link"])
+
+        # Keep the lease alive while the item is being processed
+        stop = threading.Event()
+        def keep_alive():
+            while not stop.wait(min(HEARTBEAT_INTERVAL, timeout / 3)):
+                if not queue.heartbeat(item["id"], owner, timeout):
+                    trace.debug("Lost the lease on item %s.", item["id"])
+                    return
+        heartbeat = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat.start()
+
+        try:
+            success, result = process_link(item["link"], scheduler, audio_only)
+        except Exception as e:
+            success, result = False, {"error": str(e)}
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        queue.complete(item["id"], owner, success, result)
+        LINKS_PROCESSED.inc(result="done" if success else "failed")
+        print(f"{'Done' if success else 'Failed'}: {item['link']}")
+        processed += 1
+
+def get_option(args, flag, default=None):
+    """Return the value following a flag, or the default."""
+    if flag in args:
+        index = args.index(flag)
+        if index + 1 >= len(args):
+            print(f"Error: {flag} requires a value.")
+            sys.exit(1)
+        return args[index + 1]
+    return default
+
+def open_queue(args):
+    """Open the queue given by --broker host:port, or the SQLite file given by --db."""
+    broker = get_option(args, "--broker")
+    if broker:
+        host, _, port = broker.rpartition(":")
+        return BrokerClient(host or "127.0.0.1", int(port))
+    return SQLiteQueue(get_option(args, "--db", DEFAULT_QUEUE_DB))
+
+def main():
+    """Run a queue command: serve, enqueue, worker or status."""
+    args = sys.argv[1:]
+    if "-d" in args:
+        tracing.enable_debug()
+        args.remove("-d")  # Remove debug flag from arguments
+
+    if not args or args[0] not in ("serve", "enqueue", "worker", "status"):
+        print("Error: Usage: work_queue.py serve|enqueue <links file>|worker|status "
+              "[--db <file>] [--broker <host:port>] [--metrics-port <port>] [--metrics-file <file>] [--audio-only]")
+        sys.exit(1)
+
+    command = args[0]
+
+    if command == "serve":
+        port = int(get_option(args, "--port", DEFAULT_BROKER_PORT))
+        host = get_option(args, "--host", "127.0.0.1")
+        broker = Broker(SQLiteQueue(get_option(args, "--db", DEFAULT_QUEUE_DB)), host, port)
+        print(f"Broker listening on {host}:{port}")
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            broker.shutdown()
+
+    elif command == "enqueue":
+        if len(args) < 2:
+            print("Error: No links file provided.")
+            sys.exit(1)
+        added = open_queue(args).enqueue(read_links(args[1]))
+        print(f"Queued {added} links.")
+
+    elif command == "worker":
+        owner = get_option(args, "--owner", f"{socket.gethostname()}:{os.getpid()}")
+        timeout = float(get_option(args, "--lease", VISIBILITY_TIMEOUT))
+
+        # A long-running worker exposes its metrics for scraping
+        if "--metrics-port" in args:
+            port = int(get_option(args, "--metrics-port", DEFAULT_METRICS_PORT))
+            serve_metrics(port)
+            print(f"Metrics on http://127.0.0.1:{port}/metrics")
+        metrics_writer = TextfileWriter(get_option(args, "--metrics-file")).start() if "--metrics-file" in args else None
+
+        try:
+            processed = run_worker(
+                open_queue(args), owner, "--exit-when-empty" in args, timeout, "--audio-only" in args
+            )
+        finally:
+            if metrics_writer:
+                metrics_writer.close()
+        print(f"Worker {owner} processed {processed} items.")
+
+    else:
+        for state, count in sorted(open_queue(args).stats().items()):
+            print(f"{state}: {count}")
+
+if __name__ == "__main__":
+    tracing.run_main(main)